@@ -2,6 +2,7 @@ from pycromanager.acquisition.java_backend_acquisitions import JavaBackendAcquis
 from pycromanager.acquisition.python_backend_acquisitions import PythonBackendAcquisition
 from pycromanager.acquisition.acquisition_superclass import Acquisition as PycromanagerAcquisitionBase
 from inspect import signature
+import warnings
 from mmpycorex import is_pymmcore_active
 
 # This is a convenience class that automatically selects the appropriate acquisition
@@ -39,6 +40,11 @@ class Acquisition(PycromanagerAcquisitionBase):
         else:
             # add any kwargs are specific to java backend
             specific_arg_names = [k for k in signature(JavaBackendAcquisition.__init__).parameters.keys() if k != 'self']
+            python_only_arg_names = [name for name in kwargs if name not in specific_arg_names and
+                                     name in signature(PythonBackendAcquisition.__init__).parameters]
+            if python_only_arg_names:
+                warnings.warn('Arguments only supported by the Python backend are ignored by the Java backend: '
+                              + ', '.join(python_only_arg_names))
             for name in specific_arg_names:
                 if name in kwargs:
                     named_args[name] = kwargs[name]
@@ -0,0 +1,362 @@
+import threading
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future
+from itertools import islice
+
+from pycromanager.acquisition.acq_eng_py.internal.sequence_planner import SequencePlanner
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+
+# How long the scheduler sleeps at most before checking again whether a paused acquisition has resumed
+IDLE_POLL_INTERVAL_S = 0.05
+
+
+def run_event_generation_hooks(hooks, events):
+    """
+    Pass a batch of events through the event generation hooks, in order. Hooks with a run_batch method are
+    given the whole list and return a new list, others are called once per event. Consecutive hooks with a
+    run_batch_json method are given the events as JSON and chained without converting the events back and
+    forth between them. A hook can cancel the rest of the events of an iterator, by returning None from run
+    (for that event and all later ones) or from a batch method. Returns the events that remain and whether
+    the rest of the iterator was cancelled
+    """
+    cancelled = False
+    i = 0
+    while i < len(hooks):
+        h = hooks[i]
+        i += 1
+        if hasattr(h, 'run_batch_json'):
+            chain = [h]
+            while i < len(hooks) and hasattr(hooks[i], 'run_batch_json'):
+                chain.append(hooks[i])
+                i += 1
+            if not events:
+                continue
+            acq = events[0].acquisition_
+            event_dicts = [event.to_json() for event in events]
+            for h in chain:
+                event_dicts = h.run_batch_json(event_dicts, acq) if event_dicts else []
+                if event_dicts is None:
+                    return [], True
+            events = [AcquisitionEvent.from_json(event, acq) for event in event_dicts]
+        elif hasattr(h, 'run_batch'):
+            output = h.run_batch(events) if events else []
+            if output is None:
+                return [], True
+            events = list(output)
+        else:
+            output = []
+            for event in events:
+                event = h.run(event)
+                if event is None:
+                    cancelled = True
+                    break
+                output.append(event)
+            events = output
+    return events, cancelled
+
+
+class _EventStream:
+    """
+    Event iterators waiting to be run (each with the future that completes once all of its events have been
+    acquired), the planner that splits their events into hardware sequences, and the next sequence to run
+    """
+
+    def __init__(self, planner):
+        self.planner = planner
+        self.iterators = deque()
+        # Events taken from the first iterator that have been through the event generation hooks
+        self.generated_events = deque()
+        # Whether the first iterator has no more events, or the hooks cancelled the rest of them
+        self.iterator_ended = False
+        # (events, future to complete once they have been acquired) of the next sequence to run
+        self.next_sequence = None
+
+    def has_events(self):
+        return self.next_sequence is not None or bool(self.iterators)
+
+    def end_iterator(self):
+        self.generated_events.clear()
+        self.iterator_ended = False
+        return self.iterators.popleft()
+
+
+class _AcquisitionLane:
+    """
+    Events of one acquisition waiting to be run. Priority events (e.g. generated in response to an image)
+    have their own stream, so that they go ahead of bulk events without breaking up the sequence the bulk
+    events are building
+    """
+
+    def __init__(self, acq, capabilities):
+        self.acq = acq
+        self.priority_stream = _EventStream(SequencePlanner(capabilities))
+        self.bulk_stream = _EventStream(SequencePlanner(capabilities))
+        self.finishing = False
+        self.finish_future = Future()
+        self.last_served = 0
+        self.next_allowed_time_s = 0
+
+    def get_streams(self):
+        return self.priority_stream, self.bulk_stream
+
+    def has_events(self):
+        return any(stream.has_events() or stream.planner.get_pending_events() for stream in self.get_streams())
+
+    def get_next_stream(self):
+        """
+        The stream whose sequence runs next, or None if neither has a sequence ready
+        """
+        for stream in self.get_streams():
+            if stream.next_sequence is not None:
+                return stream
+        return None
+
+
+class AcquisitionScheduler:
+    """
+    Interleaves the events of all acquisitions running on an engine. Each acquisition's events are split
+    into hardware sequences by its own planner, so acquisitions running together don't break up each
+    other's sequences, and the scheduler decides which acquisition runs next after every sequence:
+
+    - Priority events, submitted for closed-loop control, go ahead of all other events. They are still
+      merged into hardware sequences with each other where possible
+    - Otherwise, the acquisition with the highest priority whose next sequence can start goes first.
+      Between acquisitions of equal priority, the one that was served least recently goes first
+    - A sequence that waits for a minimum start time (e.g. the next time point of a time-lapse) doesn't
+      hold up other acquisitions while it waits
+    - An acquisition with a maximum number of events per second waits after each sequence until it is
+      back within that rate
+    - Paused acquisitions are skipped
+
+    Events are taken from the iterators on a thread of the engine's event generator executor, and each
+    sequence is run on its acquisition executor
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self._condition = threading.Condition()
+        self._lanes = {}
+        self._running = False
+        self._served = 0
+
+    def submit(self, acq, event_iterator, priority=False):
+        """
+        Add an iterator of events to an acquisition. Priority events go ahead of the other events that are
+        waiting. Returns a future that completes once all of them have been acquired
+        """
+        future = Future()
+        with self._condition:
+            lane = self._get_lane(acq)
+            stream = lane.priority_stream if priority else lane.bulk_stream
+            stream.iterators.append((event_iterator, future))
+            self._start()
+        return future
+
+    def finish(self, acq):
+        """
+        Finish an acquisition once all of its events have been acquired (or straight away if it was aborted).
+        Returns a future that completes when it has finished
+        """
+        with self._condition:
+            lane = self._get_lane(acq)
+            lane.finishing = True
+            self._start()
+        return lane.finish_future
+
+    def get_acquisitions(self):
+        with self._condition:
+            return list(self._lanes)
+
+    def _get_lane(self, acq):
+        lane = self._lanes.get(acq)
+        if lane is None:
+            lane = _AcquisitionLane(acq, self.engine.device_capabilities)
+            self._lanes[acq] = lane
+        self._condition.notify_all()
+        return lane
+
+    def _start(self):
+        if not self._running:
+            self._running = True
+            self.engine.event_generator_executor.submit(self._run)
+
+    def _run(self):
+        try:
+            while True:
+                with self._condition:
+                    if not self._lanes:
+                        self._running = False
+                        return
+                    lanes = list(self._lanes.values())
+                for lane in lanes:
+                    self._prepare(lane)
+                with self._condition:
+                    lane, wait_s = self._choose(lanes)
+                    if lane is None:
+                        self._condition.wait(wait_s)
+                        continue
+                    self._served += 1
+                    lane.last_served = self._served
+                self._serve(lane)
+        except Exception:
+            traceback.print_exc()
+            with self._condition:
+                self._running = False
+
+    def _prepare(self, lane):
+        """
+        Take events from an acquisition's iterators until the next hardware sequence of each of its streams
+        is known
+        """
+        acq = lane.acq
+        if acq.is_abort_requested():
+            self._drop_events(lane)
+            return
+        for stream in lane.get_streams():
+            while stream.next_sequence is None and stream.iterators and not acq.is_paused():
+                event_iterator, future = stream.iterators[0]
+                try:
+                    if stream.generated_events:
+                        event = stream.generated_events.popleft()
+                        with self.engine.cached_core.counting_for(acq):
+                            self.engine.check_for_default_devices(event)
+                        sequence = stream.planner.add(event)
+                        if sequence is not None:
+                            self._log_break(lane, stream, sequence)
+                            stream.next_sequence = (sequence, None)
+                        continue
+                    if not stream.iterator_ended:
+                        self._generate_events(acq, stream, event_iterator)
+                        continue
+                except Exception as ex:
+                    traceback.print_exc()
+                    self._drop_events(lane, ex)
+                    acq.abort(ex)
+                    return
+                # No more events from this iterator, so what is left can't become part of a longer sequence
+                stream.end_iterator()
+                sequence = stream.planner.flush()
+                if sequence is None:
+                    future.set_result(None)
+                else:
+                    stream.next_sequence = (sequence, future)
+
+    def _generate_events(self, acq, stream, event_iterator):
+        """
+        Take the next events from an iterator and pass them through the acquisition's event generation hooks.
+        Events are taken one at a time, unless a hook handles batches of events
+        """
+        hooks = acq.get_event_generation_hooks()
+        batch_size = max([h.get_batch_size() for h in hooks if hasattr(h, 'run_batch')], default=1)
+        events = list(islice(event_iterator, batch_size))
+        if len(events) < batch_size:
+            stream.iterator_ended = True
+        if not events:
+            return
+        if acq.is_debug_mode():
+            for event in events:
+                self.engine.core.logMessage("got event: " + event.to_string())
+        submit_time = events[0].get_priority_submit_time()
+        events, cancelled = run_event_generation_hooks(hooks, events)
+        if cancelled:
+            stream.iterator_ended = True
+        for event in events:
+            event.set_priority_submit_time(submit_time)
+        stream.generated_events.extend(events)
+
+    def _choose(self, lanes):
+        """
+        Pick the acquisition to run next. Returns it (or None), and how long to wait before checking again
+        if none can run yet
+        """
+        now = time.time()
+        wait_s = IDLE_POLL_INTERVAL_S
+        best = None
+        best_key = None
+        for lane in lanes:
+            acq = lane.acq
+            if lane.finishing and not lane.has_events():
+                # Finishing takes precedence, so that the acquisition shuts down promptly
+                return lane, 0
+            stream = lane.get_next_stream()
+            if stream is None or acq.is_paused():
+                continue
+            is_priority = stream is lane.priority_stream
+            ready_time = 0 if is_priority else lane.next_allowed_time_s
+            start_time_ms = stream.next_sequence[0][0].get_minimum_start_time_absolute()
+            if start_time_ms is not None and not acq.is_abort_requested():
+                ready_time = max(ready_time, start_time_ms / 1000)
+            if ready_time > now:
+                wait_s = min(wait_s, ready_time - now)
+                continue
+            key = (is_priority, acq.get_priority(), -lane.last_served)
+            if best is None or key > best_key:
+                best, best_key = lane, key
+        return best, wait_s
+
+    def _serve(self, lane):
+        acq = lane.acq
+        stream = lane.get_next_stream()
+        if stream is None:
+            self._finish(lane)
+            return
+        sequence, future = stream.next_sequence
+        stream.next_sequence = None
+        # Hardware for the next event can only be moved early if no other events might run first
+        next_event = None
+        if len(self._lanes) == 1 and not lane.priority_stream.has_events():
+            pending_events = stream.planner.get_pending_events()
+            next_event = pending_events[0] if pending_events else None
+        start = time.time()
+        try:
+            self.engine.process_sequence(sequence, next_event).result()
+        except Exception as ex:
+            traceback.print_exc()
+            if future is not None:
+                future.set_exception(ex)
+            self._drop_events(lane, ex)
+            acq.abort(ex)
+            return
+        if future is not None:
+            future.set_result(None)
+        max_events_per_second = acq.get_max_events_per_second()
+        if max_events_per_second and stream is lane.bulk_stream:
+            lane.next_allowed_time_s = max(lane.next_allowed_time_s, start) + len(sequence) / max_events_per_second
+
+    def _finish(self, lane):
+        acq = lane.acq
+        try:
+            if acq.is_debug_mode():
+                self.engine.core.logMessage("creating acquisition finished event")
+            self.engine.finish_acquisition_events(acq).result()
+            lane.finish_future.set_result(None)
+        except Exception as ex:
+            traceback.print_exc()
+            lane.finish_future.set_exception(ex)
+        with self._condition:
+            del self._lanes[acq]
+
+    def _drop_events(self, lane, exception=None):
+        """
+        Discard the events an acquisition has left, e.g. because it was aborted
+        """
+        if lane.acq.is_debug_mode():
+            self.engine.core.logMessage("acquisition aborted")
+        for stream in lane.get_streams():
+            stream.planner.clear()
+            if stream.next_sequence is not None and stream.next_sequence[1] is not None:
+                stream.iterators.appendleft((None, stream.next_sequence[1]))
+            stream.next_sequence = None
+            while stream.iterators:
+                _, future = stream.end_iterator()
+                if exception is None:
+                    future.set_result(None)
+                else:
+                    future.set_exception(exception)
+
+    def _log_break(self, lane, stream, sequence):
+        if lane.acq.is_debug_mode() and stream.planner.last_break_reason is not None:
+            self.engine.core.logMessage("sequence of {} events ended: {}".format(
+                len(sequence), stream.planner.last_break_reason))
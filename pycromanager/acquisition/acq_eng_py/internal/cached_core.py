@@ -0,0 +1,163 @@
+import threading
+from contextlib import contextmanager
+
+
+class CachedCore:
+    """
+    Facade over the core for the queries the engine makes for every event or image: which devices are
+    assigned to the core's roles, and the size of the camera's images. These rarely change during an
+    acquisition, but over a bridged core or with a slow device adapter each call is a round trip, so the
+    values are cached. All other methods are passed through to the core.
+
+    The image geometry is cached for each camera, so that switching between cameras (e.g. to snap with a
+    named camera) keeps what is known about both. A role is forgotten when its Core property changes, and
+    the geometry of a camera whenever one of its properties changes (e.g. binning). The geometry of all
+    cameras is forgotten when a property of the core or a config group changes, since a preset can change
+    any of them. Changes to the ROI are not reported by the core, so set_roi and clear_roi should go through
+    this facade. Everything is forgotten when a system configuration is loaded, and when an acquisition
+    starts.
+
+    Cache hits are counted, in total and for the acquisition set with counting_for on the calling thread
+    """
+
+    # Core property that changes which device is used for a role -> method that returns the device
+    ROLE_PROPERTIES = {'Camera': 'get_camera_device', 'Focus': 'get_focus_device',
+                       'XYStage': 'get_xy_stage_device', 'SLM': 'get_slm_device'}
+
+    def __init__(self, core):
+        self.core = core
+        self._lock = threading.Lock()
+        self._values = {}
+        self._local = threading.local()
+        # Number of calls to the core that were answered from the cache
+        self.round_trips_saved = 0
+
+    def __getattr__(self, name):
+        if name == 'core':
+            raise AttributeError(name)
+        return getattr(self.core, name)
+
+    @contextmanager
+    def counting_for(self, acq):
+        """
+        Count the cache hits on this thread towards acq, using its add_core_round_trips_saved
+        """
+        previous = getattr(self._local, 'acq', None)
+        self._local.acq = acq
+        try:
+            yield
+        finally:
+            self._local.acq = previous
+
+    def invalidate(self):
+        with self._lock:
+            self._values.clear()
+
+    def invalidate_geometry(self, camera=None):
+        """
+        Forget the image geometry of a camera, or of all cameras if camera is None
+        """
+        with self._lock:
+            for key in [key for key in self._values if isinstance(key, tuple) and
+                        (camera is None or key[1] == camera)]:
+                del self._values[key]
+
+    def get_round_trips_saved(self):
+        with self._lock:
+            return self.round_trips_saved
+
+    def _get(self, method_name, key=None):
+        """
+        Call a method of the core that takes no arguments, or return its cached value. key is what the value
+        is cached under, by default the name of the method
+        """
+        key = method_name if key is None else key
+        with self._lock:
+            hit = key in self._values
+            if hit:
+                value = self._values[key]
+                self.round_trips_saved += 1
+        if hit:
+            acq = getattr(self._local, 'acq', None)
+            if acq is not None:
+                acq.add_core_round_trips_saved(1)
+            return value
+        value = getattr(self.core, method_name)()
+        with self._lock:
+            self._values[key] = value
+        return value
+
+    def _get_geometry(self, method_name):
+        # The lookup of the camera isn't counted, as it isn't made by the caller
+        with self._lock:
+            camera = self._values.get('get_camera_device')
+        if camera is None:
+            camera = self.get_camera_device()
+        return self._get(method_name, (method_name, camera))
+
+    ########  Device roles ###########
+
+    def get_camera_device(self):
+        return self._get('get_camera_device')
+
+    def get_focus_device(self):
+        return self._get('get_focus_device')
+
+    def get_xy_stage_device(self):
+        return self._get('get_xy_stage_device')
+
+    def get_slm_device(self):
+        return self._get('get_slm_device')
+
+    ########  Image geometry ###########
+
+    def get_image_width(self):
+        return self._get_geometry('get_image_width')
+
+    def get_image_height(self):
+        return self._get_geometry('get_image_height')
+
+    def get_bytes_per_pixel(self):
+        return self._get_geometry('get_bytes_per_pixel')
+
+    def get_number_of_camera_channels(self):
+        return self._get_geometry('get_number_of_camera_channels')
+
+    ########  Changes made through the facade ###########
+
+    def set_camera_device(self, camera_device):
+        with self._lock:
+            if self._values.get('get_camera_device') == camera_device:
+                return
+        self.core.set_camera_device(camera_device)
+        # Only the camera role changes, as the geometry is cached for each camera
+        with self._lock:
+            self._values['get_camera_device'] = camera_device
+
+    def set_roi(self, *args):
+        self.core.set_roi(*args)
+        self.invalidate_geometry()
+
+    def clear_roi(self):
+        self.core.clear_roi()
+        self.invalidate_geometry()
+
+    ########  Core callbacks ###########
+
+    def onSystemConfigurationLoaded(self):
+        self.invalidate()
+
+    def onPropertiesChanged(self):
+        self.invalidate()
+
+    def onPropertyChanged(self, device_name, prop_name, prop_value):
+        if device_name == 'Core' and prop_name in self.ROLE_PROPERTIES:
+            with self._lock:
+                self._values.pop(self.ROLE_PROPERTIES[prop_name], None)
+        elif device_name == 'Core':
+            self.invalidate_geometry()
+        else:
+            self.invalidate_geometry(device_name)
+
+    def onConfigGroupChanged(self, group_name, new_config_name):
+        self.invalidate_geometry()
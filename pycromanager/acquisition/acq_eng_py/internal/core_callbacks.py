@@ -0,0 +1,90 @@
+import traceback
+
+import pymmcore
+
+
+class CoreCallbackRelay(pymmcore.MMEventCallback):
+    """
+    The core accepts only a single callback object, so this forwards the core's callbacks to any number of
+    listeners. A listener implements whichever of the MMEventCallback methods (e.g. onPropertyChanged) it
+    is interested in
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.listeners = []
+        # Callback registered on the core by the user after the relay, which is forwarded to like a listener
+        self.user_callback = None
+
+    def register_on(self, core):
+        """
+        Register the relay as the core's callback. As the core holds only one callback, the core's
+        register_callback is redirected to set_user_callback, so that a callback the user registers afterwards
+        is called by the relay rather than replacing it. A callback registered on the core before this is
+        replaced, and has to be registered again
+        """
+        core.register_callback(self)
+        core.register_callback = self.set_user_callback
+        core.registerCallback = self.set_user_callback
+
+    def set_user_callback(self, callback):
+        """
+        Forward the core's callbacks to callback (an MMEventCallback), in place of the last one set. None
+        removes it
+        """
+        if self.user_callback is not None:
+            self.remove_listener(self.user_callback)
+        self.user_callback = callback
+        if callback is not None:
+            self.add_listener(callback)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def _forward(self, method_name, *args):
+        for listener in list(self.listeners):
+            method = getattr(listener, method_name, None)
+            if method is None:
+                continue
+            try:
+                method(*args)
+            except Exception:
+                # Exceptions can't propagate back into the core
+                traceback.print_exc()
+
+    def onPropertiesChanged(self):
+        self._forward('onPropertiesChanged')
+
+    def onPropertyChanged(self, device_name, prop_name, prop_value):
+        self._forward('onPropertyChanged', device_name, prop_name, prop_value)
+
+    def onChannelGroupChanged(self, new_channel_group_name):
+        self._forward('onChannelGroupChanged', new_channel_group_name)
+
+    def onConfigGroupChanged(self, group_name, new_config_name):
+        self._forward('onConfigGroupChanged', group_name, new_config_name)
+
+    def onSystemConfigurationLoaded(self):
+        self._forward('onSystemConfigurationLoaded')
+
+    def onPixelSizeChanged(self, new_pixel_size_um):
+        self._forward('onPixelSizeChanged', new_pixel_size_um)
+
+    def onPixelSizeAffineChanged(self, v0, v1, v2, v3, v4, v5):
+        self._forward('onPixelSizeAffineChanged', v0, v1, v2, v3, v4, v5)
+
+    def onStagePositionChanged(self, device_name, pos):
+        self._forward('onStagePositionChanged', device_name, pos)
+
+    def onXYStagePositionChanged(self, device_name, x_pos, y_pos):
+        self._forward('onXYStagePositionChanged', device_name, x_pos, y_pos)
+
+    def onExposureChanged(self, device_name, new_exposure):
+        self._forward('onExposureChanged', device_name, new_exposure)
+
+    def onSLMExposureChanged(self, device_name, new_exposure):
+        self._forward('onSLMExposureChanged', device_name, new_exposure)
@@ -0,0 +1,101 @@
+import threading
+
+
+class DeviceCapabilities:
+    """
+    Cache of the hardware capabilities the engine needs when deciding whether events can be merged into
+    hardware sequences: sequenceable flags, maximum sequence lengths and the property settings of config group
+    presets. None of these change while an acquisition runs, so each is only requested from the core the
+    first time it is needed. The cache is cleared when an acquisition starts and whenever the core reports a
+    change to its configuration. Values are cached for each device, so they stay valid when a different device
+    is assigned to one of the core's roles. The devices assigned to the roles are cached by the CachedCore
+    this is given as its core
+    """
+
+    def __init__(self, core):
+        self.core = core
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def invalidate(self):
+        with self._lock:
+            self._values.clear()
+
+    def _get(self, key, fetch):
+        with self._lock:
+            if key in self._values:
+                return self._values[key]
+        value = fetch()
+        with self._lock:
+            self._values[key] = value
+        return value
+
+    ########  Core callbacks ###########
+
+    def onSystemConfigurationLoaded(self):
+        self.invalidate()
+
+    def onPropertiesChanged(self):
+        self.invalidate()
+
+    ########  Device roles ###########
+
+    def get_camera_device(self):
+        return self.core.get_camera_device()
+
+    def get_focus_device(self):
+        return self.core.get_focus_device()
+
+    def get_xy_stage_device(self):
+        return self.core.get_xy_stage_device()
+
+    ########  Sequencing capabilities ###########
+
+    def is_property_sequenceable(self, device_name, prop_name):
+        return self._get(('property_sequenceable', device_name, prop_name),
+                         lambda: self.core.is_property_sequenceable(device_name, prop_name))
+
+    def get_property_sequence_max_length(self, device_name, prop_name):
+        return self._get(('property_sequence_max_length', device_name, prop_name),
+                         lambda: self.core.get_property_sequence_max_length(device_name, prop_name))
+
+    def is_stage_sequenceable(self, stage_device):
+        return self._get(('stage_sequenceable', stage_device),
+                         lambda: self.core.is_stage_sequenceable(stage_device))
+
+    def get_stage_sequence_max_length(self, stage_device):
+        return self._get(('stage_sequence_max_length', stage_device),
+                         lambda: self.core.get_stage_sequence_max_length(stage_device))
+
+    def is_xy_stage_sequenceable(self, xy_stage_device):
+        return self._get(('xy_stage_sequenceable', xy_stage_device),
+                         lambda: self.core.is_xy_stage_sequenceable(xy_stage_device))
+
+    def get_xy_stage_sequence_max_length(self, xy_stage_device):
+        return self._get(('xy_stage_sequence_max_length', xy_stage_device),
+                         lambda: self.core.get_xy_stage_sequence_max_length(xy_stage_device))
+
+    def is_exposure_sequenceable(self, camera_device):
+        return self._get(('exposure_sequenceable', camera_device),
+                         lambda: self.core.is_exposure_sequenceable(camera_device))
+
+    def get_exposure_sequence_max_length(self, camera_device):
+        return self._get(('exposure_sequence_max_length', camera_device),
+                         lambda: self.core.get_exposure_sequence_max_length(camera_device))
+
+    ########  Config groups ###########
+
+    def get_config_settings(self, group, preset):
+        """
+        Return a dict mapping (device label, property name) to the property value for each setting of a
+        config group preset
+        """
+        def fetch():
+            config = self.core.get_config_data(group, preset)
+            settings = {}
+            for i in range(config.size()):
+                setting = config.getSetting(i)
+                settings[(setting.getDeviceLabel(), setting.getPropertyName())] = setting.getPropertyValue()
+            return settings
+
+        return self._get(('config', group, preset), fetch)
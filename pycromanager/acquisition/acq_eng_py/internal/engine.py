@@ -1,3 +1,5 @@
+import itertools
+import threading
 import traceback
 from concurrent.futures import Future
 from concurrent.futures import ThreadPoolExecutor
@@ -7,136 +9,270 @@ import datetime
 from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
 from pycromanager.acquisition.acq_eng_py.main.acq_eng_metadata import AcqEngMetadata
 from pycromanager.acquisition.acq_eng_py.internal.hardware_sequences import HardwareSequences
+from pycromanager.acquisition.acq_eng_py.internal.device_capabilities import DeviceCapabilities
+from pycromanager.acquisition.acq_eng_py.internal.core_callbacks import CoreCallbackRelay
+from pycromanager.acquisition.acq_eng_py.internal.sequence_planner import SequencePlanner
+from pycromanager.acquisition.acq_eng_py.internal.acquisition_scheduler import AcquisitionScheduler
+from pycromanager.acquisition.acq_eng_py.internal.loaded_sequences import LoadedSequences
+from pycromanager.acquisition.acq_eng_py.internal.image_waiter import ImageWaiter
+from pycromanager.acquisition.acq_eng_py.internal.cached_core import CachedCore
+from pycromanager.acquisition.acq_eng_py.internal.hardware_state import HardwareState
 import pymmcore
 from pycromanager.acquisition.acq_eng_py.main.acq_notification import AcqNotification
 
+# Points of an event at which the engine waits for hooks that run asynchronously, in the order they are reached:
+# before the hardware is changed, before the Z drive moves, before the camera starts, when the event is
+# done, and when the acquisition finishes
+HOOK_BARRIERS = ('hardware', 'z_drive', 'camera', 'event_end', 'acquisition_end')
+
 HARDWARE_ERROR_RETRIES = 6
 DELAY_BETWEEN_RETRIES_MS = 5
+# How long to poll concurrently dispatched devices for their individual settle times before
+# falling back to the core's own waiting (and timeout)
+SETTLE_TIME_POLL_TIMEOUT_S = 10
 
 class HardwareControlException(Exception):
     def __init__(self, message=""):
         super().__init__(message)
 
 class Engine:
+    """
+    Runs acquisitions on one core. Each engine has its own threads, so that acquisitions on different cores
+    (i.e. separate microscopes) can run in parallel. A core can only be driven by one engine, which can be
+    looked up with for_core. The first engine created is the default, used by acquisitions that aren't
+    given an engine. The engine registers itself for the core's callbacks, replacing a callback registered
+    on the core before it was created. Callbacks registered afterwards are called as well
+    """
+
+    _engines = []
+    _engines_lock = threading.Lock()
+
     def __init__(self, core):
-        if not hasattr(Engine, 'singleton'):
-            Engine.singleton = self
-            self.last_event = None
-            self.core = core
-            self.acq_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Acquisition Engine Thread')
-            self.event_generator_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Acq Eng event generator')
-            self.sequenced_events = []
+        with Engine._engines_lock:
+            if any(engine.core is core for engine in Engine._engines):
+                raise RuntimeError("An acquisition engine already exists for this core. "
+                                   "Use Engine.for_core(core) to get it")
+            Engine._engines.append(self)
+            if Engine.get_instance() is None:
+                Engine.singleton = self
+        self.last_event = None
+        self.core = core
+        self.acq_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Acquisition Engine Thread')
+        self.event_generator_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='Acq Eng event generator')
+        # Used to start hardware changes for the next event while the current one is being read out
+        self.pipelined_hardware_executor = ThreadPoolExecutor(max_workers=1,
+                                                              thread_name_prefix='Acq Eng pipelined hardware')
+        self.pipelined_hardware_future = None
+        self.pipelined_hardware = None
+        # (index in HOOK_BARRIERS of the barrier to wait at, future) for hooks of the current event that run
+        # asynchronously
+        self.pending_hook_futures = []
+        # Paces polling the core for images
+        self.image_waiter = ImageWaiter()
+        # Device roles and image size, which are otherwise requested from the core for every event or image
+        self.cached_core = CachedCore(core)
+        # Sequencing capabilities of the hardware, so that merging events doesn't need core calls
+        self.device_capabilities = DeviceCapabilities(self.cached_core)
+        # Used for dry runs of how events are split into hardware sequences. Each acquisition that is running
+        # has its own planner in the scheduler
+        self.sequence_planner = SequencePlanner(self.device_capabilities)
+        # Interleaves the events of the acquisitions running on this engine
+        self.scheduler = AcquisitionScheduler(self)
+        # Sequences currently held by devices, so identical ones aren't uploaded again
+        self.loaded_sequences = LoadedSequences()
+        # Last known state of the hardware, so commands that wouldn't change anything are skipped
+        self.hardware_state = HardwareState(self.device_capabilities)
+        self.core_callback_relay = CoreCallbackRelay()
+        self.core_callback_relay.add_listener(self.cached_core)
+        self.core_callback_relay.add_listener(self.device_capabilities)
+        self.core_callback_relay.add_listener(self.loaded_sequences)
+        self.core_callback_relay.add_listener(self.hardware_state)
+        try:
+            self.core_callback_relay.register_on(core)
+        except Exception:
+            # Capabilities are still refreshed at the start of each acquisition
+            traceback.print_exc()
 
     def shutdown(self):
         self.acq_executor.shutdown()
         self.event_generator_executor.shutdown()
+        self.pipelined_hardware_executor.shutdown()
+        with Engine._engines_lock:
+            if self in Engine._engines:
+                Engine._engines.remove(self)
+            if Engine.get_instance() is self:
+                # The next oldest engine becomes the default
+                Engine.singleton = Engine._engines[0] if Engine._engines else None
+
+    @staticmethod
+    def for_core(core):
+        """
+        Return the engine that drives a core, creating one if there is none yet
+        """
+        with Engine._engines_lock:
+            for engine in Engine._engines:
+                if engine.core is core:
+                    return engine
+        return Engine(core)
+
+    @staticmethod
+    def get_instances():
+        with Engine._engines_lock:
+            return list(Engine._engines)
 
     @staticmethod
     def get_core():
+        """
+        The core of the default engine
+        """
         return Engine.singleton.core
 
     @staticmethod
     def get_instance():
-        if not hasattr(Engine, 'singleton'):
-            return None
-
-        return Engine.singleton
+        """
+        The default engine, or None if no engine has been created
+        """
+        return getattr(Engine, 'singleton', None)
 
     def finish_acquisition(self, acq):
+        """
+        Finish an acquisition once the events already submitted to it have been acquired
+        """
+        return self.scheduler.finish(acq)
+
+    def submit_event_iterator(self, event_iterator, acq=None, priority=False):
+        """
+        Submit an iterator of AcquisitionEvents, which are run interleaved with the events of other
+        acquisitions on this engine. Priority events go ahead of all other waiting events. Returns a future
+        that completes once all of them have been acquired
+        """
+        if acq is None:
+            first_event = next(event_iterator, None)
+            if first_event is None:
+                future = Future()
+                future.set_result(None)
+                return future
+            acq = first_event.acquisition_
+            event_iterator = itertools.chain([first_event], event_iterator)
+        return self.scheduler.submit(acq, event_iterator, priority)
+
+    def finish_acquisition_events(self, acq) -> Future:
         def finish_acquisition_inner():
             if acq.is_debug_mode():
-                Engine.get_core().logMessage("recieved acquisition finished signal")
-            self.sequenced_events.clear()
-            if acq.is_debug_mode():
-                Engine.get_core().logMessage("creating acquisition finished event")
+                self.core.logMessage("recieved acquisition finished signal")
             self.execute_acquisition_event(AcquisitionEvent.create_acquisition_finished_event(acq))
             acq.block_until_events_finished()
 
-        return self.event_generator_executor.submit(finish_acquisition_inner)
-
-    def submit_event_iterator(self, event_iterator):
-        def submit_event_iterator_inner():
-            acq = None
-            while True:
-                try:
-                    event = next(event_iterator, None)
-                except StopIteration:
-                    traceback.print_exc()
-                    break
-                if event is None:
-                    break # iterator exhausted
-                acq = event.acquisition_
-                if acq.is_debug_mode():
-                    Engine.get_core().logMessage("got event: " + event.to_string())
-                for h in event.acquisition_.get_event_generation_hooks():
-                    event = h.run(event)
-                    if event is None:
-                        return
-                while event.acquisition_.is_paused():
-                    time.sleep(0.005)
-                try:
-                    if acq.is_abort_requested():
-                        if acq.is_debug_mode():
-                            Engine.get_core().logMessage("acquisition aborted")
-                        return
-                    image_acquired_future = self.process_acquisition_event(event)
-                    image_acquired_future.result()
-
-                except Exception as ex:
-                    traceback.print_exc()
-                    acq.abort(ex)
-                    raise ex
-
-            last_image_future = self.process_acquisition_event(AcquisitionEvent.create_acquisition_sequence_end_event(acq))
-            last_image_future.result()
-
-
-        return self.event_generator_executor.submit(submit_event_iterator_inner)
-    
+        return self.acq_executor.submit(finish_acquisition_inner)
 
     def check_for_default_devices(self, event: AcquisitionEvent):
-        xy_stage = self.core.get_xy_stage_device()
-        z_stage = self.core.get_focus_device()
+        xy_stage = self.device_capabilities.get_xy_stage_device()
+        z_stage = self.device_capabilities.get_focus_device()
         if event.get_z_position() is not None and (z_stage is None or z_stage == ""):
             raise Exception("Event requires a z position, but no Core-Focus device is set")
         if event.get_x_position() is not None and (xy_stage is None or xy_stage == ""):
             raise Exception("Event requires an x position, but no Core-XYStage device is set")
 
-    def process_acquisition_event(self, event: AcquisitionEvent) -> Future:
-        def process_acquisition_event_inner():
+    def process_sequence(self, sequence, next_event: AcquisitionEvent = None) -> Future:
+        """
+        Run a list of events that the sequence planner has grouped into one hardware sequence. next_event is
+        the event that will run after them, if known, so that its hardware can be prepared early
+        """
+        def process_sequence_inner():
             try:
-                self.check_for_default_devices(event)
-                if event.acquisition_.is_debug_mode():
-                    self.core.logMessage("Processing event: " + str(event))
-                    self.core.logMessage("checking for sequencing")
-                if not self.sequenced_events and not event.is_acquisition_sequence_end_event():
-                    self.sequenced_events.append(event)
-                elif self.is_sequencable(self.sequenced_events, event, len(self.sequenced_events) + 1):
-                    # merge event into the sequence
-                    self.sequenced_events.append(event)
-                else:
-                    # all events
-                    sequence_event = self.merge_sequence_event(self.sequenced_events)
-                    self.sequenced_events.clear()
-                    # Add in the start of the new sequence
-                    if not event.is_acquisition_sequence_end_event():
-                        self.sequenced_events.append(event)
-                    if event.acquisition_.is_debug_mode():
-                        self.core.logMessage("executing acquisition event")
-                    try:
-                        self.execute_acquisition_event(sequence_event)
-                    except HardwareControlException as e:
-                        raise e
+                sequence_event = self.merge_sequence_event(sequence)
+                if sequence_event.acquisition_.is_debug_mode():
+                    self.core.logMessage("executing acquisition event: " + str(sequence_event))
+                with self.cached_core.counting_for(sequence_event.acquisition_):
+                    self.execute_acquisition_event(sequence_event, next_event)
+                self.await_hook_barrier('event_end')
             except Exception as e:
                 traceback.print_exc()
+                self.discard_hook_futures()
                 if self.core.is_sequence_running():
                     self.core.stop_sequence_acquisition()
                 raise e
 
+        return self.acq_executor.submit(process_sequence_inner)
+
+    def run_hook(self, hook, event: AcquisitionEvent):
+        """
+        Run a hook and return the event it returns. A hook can instead return a Future, to keep running
+        while the engine carries on with the event. The engine then waits for it at the hook's barrier (one
+        of HOOK_BARRIERS), given by its get_barrier method or 'camera' by default, and the event is used
+        unchanged.
+
+        Device changes the core reports are tracked through its callbacks. A hook that changes devices which
+        don't report their changes says so with a changes_untracked_hardware method that returns True, and
+        the engine then forgets the hardware state once the hook has finished
+        """
+        output = hook.run(event)
+        untracked = hasattr(hook, 'changes_untracked_hardware') and hook.changes_untracked_hardware()
+        if not isinstance(output, Future):
+            if untracked:
+                self.forget_hardware_state()
+            return output
+        barrier = hook.get_barrier() if hasattr(hook, 'get_barrier') else None
+        if barrier == 'acquisition_end':
+            if untracked:
+                output.add_done_callback(lambda f: self.forget_hardware_state())
+            event.acquisition_.add_pending_hook_future(output)
+        else:
+            self.pending_hook_futures.append((HOOK_BARRIERS.index(barrier or 'camera'), output, untracked))
+        return event
+
+    def await_hook_barrier(self, barrier: str) -> None:
+        """
+        Wait for the asynchronous hooks that must finish before the given point of the event. Raises the
+        exception of a hook that failed
+        """
+        index = HOOK_BARRIERS.index(barrier)
+        waiting = [pending for pending in self.pending_hook_futures if pending[0] <= index]
+        if not waiting:
+            return
+        self.pending_hook_futures = [pending for pending in self.pending_hook_futures if pending[0] > index]
+        try:
+            for _, future, _ in waiting:
+                future.result()
+        finally:
+            if any(untracked for _, _, untracked in waiting):
+                # The hooks may have changed the hardware while the engine carried on
+                self.forget_hardware_state()
+
+    def discard_hook_futures(self) -> None:
+        """
+        Wait for the asynchronous hooks of an event that failed, ignoring their results
+        """
+        pending, self.pending_hook_futures = self.pending_hook_futures, []
+        for _, future, _ in pending:
+            try:
+                future.result()
+            except Exception:
+                traceback.print_exc()
+        if any(untracked for _, _, untracked in pending):
+            self.forget_hardware_state()
+
+    def forget_hardware_state(self) -> None:
+        """
+        Forget the cached hardware state, device roles and image size, e.g. after a hook that changed them
+        without the core reporting it
+        """
+        self.hardware_state.invalidate()
+        self.cached_core.invalidate()
+
+    def record_priority_latency(self, event: AcquisitionEvent) -> None:
+        """
+        For priority events, record the time from their submission until the hardware starts changing for them
+        """
+        first_event = event if event.get_sequence() is None else event.get_sequence()[0]
+        if first_event.get_priority_submit_time() is not None:
+            event.acquisition_.add_priority_latency_ms(
+                (time.perf_counter() - first_event.get_priority_submit_time()) * 1000)
 
-        return self.acq_executor.submit(process_acquisition_event_inner)
+    def execute_acquisition_event(self, event: AcquisitionEvent, next_event: AcquisitionEvent = None):
+        # Make sure nothing started early for a pipelined event is still moving
+        self.await_pipelined_hardware()
 
-    def execute_acquisition_event(self, event: AcquisitionEvent):
         # check if we should pause until the minimum start time of the event has occured
         while event.get_minimum_start_time_absolute() is not None and \
                 time.time() * 1000 < event.get_minimum_start_time_absolute():
@@ -148,6 +284,8 @@ class Engine:
             if event.acquisition_.are_events_finished():
                 return  # Duplicate finishing event, possibly from x-ing out viewer
 
+            # Hooks still running asynchronously must finish before the hooks are closed
+            event.acquisition_.await_hook_futures()
             # send message acquisition finished message so things shut down properly
             for h in event.acquisition_.get_event_generation_hooks():
                 h.run(event)
@@ -168,13 +306,15 @@ class Engine:
             event.acquisition_.post_notification(AcqNotification.create_acq_events_finished_notification())
 
         else:
+            self.record_priority_latency(event)
             event.acquisition_.post_notification(AcqNotification(
                 AcqNotification.Hardware, event.axisPositions_, AcqNotification.Hardware.PRE_HARDWARE))
             for h in event.acquisition_.get_before_hardware_hooks():
-                event = h.run(event)
+                event = self.run_hook(h, event)
                 if event is None:
                     return  # The hook cancelled this event
                 self.abort_if_requested(event, None)
+            self.await_hook_barrier('hardware')
             hardware_sequences_in_progress = HardwareSequences()
             try:
                 self.prepare_hardware(event, hardware_sequences_in_progress)
@@ -185,12 +325,13 @@ class Engine:
             event.acquisition_.post_notification(AcqNotification(
                 AcqNotification.Hardware, event.axisPositions_, AcqNotification.Hardware.PRE_Z_DRIVE))
             for h in event.acquisition_.get_before_z_hooks():
-                event = h.run(event)
+                event = self.run_hook(h, event)
                 if event is None:
                     return  # The hook cancelled this event
                 self.abort_if_requested(event, None)
 
             try:
+                self.await_hook_barrier('z_drive')
                 self.start_z_drive(event, hardware_sequences_in_progress)
             except HardwareControlException as e:
                 self.stop_hardware_sequences(hardware_sequences_in_progress)
@@ -199,7 +340,7 @@ class Engine:
             event.acquisition_.post_notification(AcqNotification(
                 AcqNotification.Hardware, event.axisPositions_, AcqNotification.Hardware.POST_HARDWARE))
             for h in event.acquisition_.get_after_hardware_hooks():
-                event = h.run(event)
+                event = self.run_hook(h, event)
                 if event is None:
                     return  # The hook cancelled this event
                 self.abort_if_requested(event, hardware_sequences_in_progress)
@@ -215,11 +356,16 @@ class Engine:
                     # Abort while waiting for next time point
                     return
 
+            try:
+                self.await_hook_barrier('camera')
+            except Exception:
+                self.stop_hardware_sequences(hardware_sequences_in_progress)
+                raise
             if event.should_acquire_image():
                 if event.acquisition_.is_debug_mode():
                     self.core.logMessage("acquiring image(s)")
                 try:
-                    self.acquire_images(event, hardware_sequences_in_progress)
+                    self.acquire_images(event, hardware_sequences_in_progress, next_event)
                 except TimeoutError:
                     # Don't abort on a timeout
                     # TODO: this could probably be an option added to the acquisition in the future
@@ -229,42 +375,47 @@ class Engine:
                 self.abort_if_requested(event, hardware_sequences_in_progress)
 
         
-    def acquire_images(self, event: AcquisitionEvent, hardware_sequences_in_progress: HardwareSequences) -> None:
+    def acquire_images(self, event: AcquisitionEvent, hardware_sequences_in_progress: HardwareSequences,
+                       next_event: AcquisitionEvent = None) -> None:
         """
         Acquire 1 or more images in a sequence, add some metadata, then
         put them into an output queue.
 
         If the event is a sequence and a sequence acquisition is started in the core,
         It should be completed by the time this method returns.
+
+        If next_event is given and the acquisition is pipelined, hardware changes for it are started
+        as soon as the exposure of a snapped image is finished.
         """
-        camera_image_counts = event.get_camera_image_counts(self.core.get_camera_device())
+        camera_image_counts = event.get_camera_image_counts(self.cached_core.get_camera_device())
         if event.get_sequence() is not None and len(event.get_sequence()) > 1:
             # start sequences on one or more cameras
             for camera_device_name, image_count in camera_image_counts.items():
                 event.acquisition_.post_notification(AcqNotification(
                     AcqNotification.Camera, event.axisPositions_, AcqNotification.Camera.PRE_SEQUENCE_STARTED))
-                self.core.start_sequence_acquisition(
-                    camera_device_name, camera_image_counts[camera_device_name], 0, True)
+                sequence_start_time_ms = time.time() * 1000
+                self.core.start_sequence_acquisition(camera_device_name, camera_image_counts[camera_device_name],
+                                                     event.get_sequence_interval_ms(), True)
         else:
             # snap one image with no sequencing
             event.acquisition_.post_notification(AcqNotification(
                 AcqNotification.Camera, event.axisPositions_, AcqNotification.Camera.PRE_SNAP))
             if event.get_camera_device_name() is not None:
-                current_camera = self.core.get_camera_device()
-                width = self.core.get_image_width()
-                height = self.core.get_image_height()
-                self.core.set_camera_device(event.get_camera_device_name())
+                current_camera = self.cached_core.get_camera_device()
+                width = self.cached_core.get_image_width()
+                height = self.cached_core.get_image_height()
+                self.cached_core.set_camera_device(event.get_camera_device_name())
                 self.core.snap_image()
-                self.core.set_camera_device(current_camera)
+                self.cached_core.set_camera_device(current_camera)
             else:
                 # Unlike MMCoreJ, pymmcore does not automatically add this metadata when snapping, so need to do it manually
-                width = self.core.get_image_width()
-                height = self.core.get_image_height()
+                width = self.cached_core.get_image_width()
+                height = self.cached_core.get_image_height()
                 self.core.snap_image()
             event.acquisition_.post_notification(AcqNotification(
                 AcqNotification.Camera, event.axisPositions_, AcqNotification.Camera.POST_SNAP))
             for h in event.acquisition_.get_after_exposure_hooks():
-                h.run(event)
+                self.run_hook(h, event)
         
         # get elapsed time
         current_time_ms = time.time() * 1000
@@ -277,7 +428,7 @@ class Engine:
         multi_cam_adapter_camera_event_lists = None
         if event.get_sequence() is not None:
             multi_cam_adapter_camera_event_lists = {}
-            for cam_index in range(self.core.get_number_of_camera_channels()):
+            for cam_index in range(self.cached_core.get_number_of_camera_channels()):
                 multi_cam_adapter_camera_event_lists[cam_index] = []
                 for e in event.get_sequence():
                     multi_cam_adapter_camera_event_lists[cam_index].append(e)
@@ -290,114 +441,139 @@ class Engine:
         # in a separate thread, started after snapImage is started. But there is no
         # guarantee that the camera will be ready to accept a trigger at that point.
         for h in event.acquisition_.get_after_camera_hooks():
-            h.run(event)
+            self.run_hook(h, event)
+
+        if event.get_sequence() is None and next_event is not None:
+            # Exposure is over, so the next event's hardware can change while this image is read out
+            self.start_pipelined_hardware(event, next_event)
 
         if event.acquisition_.is_debug_mode():
             self.core.log_message("images acquired, copying from core")
         start_copy_time = time.time()
+        self.image_waiter.start_sequence(event.get_sequence_interval_ms() or event.get_exposure())
         # Loop through and collect all acquired images. There will be
         # (# of images in sequence) x (# of camera channels) of them
         timeout = False
-        for i in range(0, 1 if event.get_sequence() is None else len(event.get_sequence())):
-            if timeout:
-                # Cancel the rest of the sequence
-                self.stop_hardware_sequences(hardware_sequences_in_progress)
-                break
+        if self.is_batch_drainable(event):
+            # Take all images that are ready out of the buffer at once
+            timeout = self.drain_sequence_images(event, hardware_sequences_in_progress, current_time_ms,
+                                                 start_copy_time, sequence_start_time_ms)
+        else:
+            # Metadata that is the same for all images of the event or sequence
+            metadata_template = AcqEngMetadata.make_sequence_metadata_template(self.cached_core)
             try:
                 exposure = self.core.get_exposure() if event.get_exposure() is None else event.get_exposure()
             except Exception as ex:
                 raise Exception("Couldnt get exposure form core")
-            num_cam_channels = self.core.get_number_of_camera_channels()
-
-            need_to_run_after_exposure_hooks = len(event.acquisition_.get_after_exposure_hooks()) > 0
-            for cam_index in range(num_cam_channels):
-                ti = None
-                camera_name = None
-                while ti is None:
-                    if event.acquisition_.is_abort_requested():
-                        return
-                    try:
-                        if event.get_sequence() is not None and len(event.get_sequence()) > 1:
-                            if self.core.is_buffer_overflowed():
-                                raise Exception("Sequence buffer overflow")
-                            try:
-                                ti = self.core.pop_next_tagged_image()
-                                camera_name = ti.tags["Camera"]
-                            except Exception as e:
-                                # continue waiting
-                                if not self.core.is_sequence_running() and self.core.get_remaining_image_count() == 0:
-                                    raise Exception("Expected images did not arrive in circular buffer")
-                                # check if timeout has been exceeded. This is used in the case of a
-                                # camera waiting for a trigger that never comes.
-                                if event.get_sequence()[i].get_timeout_ms() is not None:
-                                    if time.time() - start_copy_time > event.get_sequence()[i].get_timeout_ms():
-                                        timeout = True
-                                        self.core.stop_sequence_acquisition()
-                                        while self.core.is_sequence_running():
-                                            time.sleep(0.001)
-                                        break
-                        else:
-                            try:
-                                # TODO: probably there should be a timeout here too, but I'm
-                                #  not sure the snap_image system supports it (as opposed to sequences)
-                                # This is a little different from the java version due to differences in metadata
-                                # handling in the SWIG wrapper
-                                camera_name = self.core.get_camera_device()
-                                ti = self.core.get_tagged_image(cam_index, camera_name, height, width)
-                            except Exception as e:
-                                # continue waiting
-                                pass
-                    except Exception as ex:
-                        # Sequence buffer overflow
-                        e = HardwareControlException(str(ex))
-                        event.acquisition_.abort(e)
-                        raise e
-                if need_to_run_after_exposure_hooks:
-                    for camera_device_name in camera_image_counts.keys():
-                        if self.core.is_sequence_running(camera_device_name):
-                            # all of the sequences are not yet done, so this will need to be handled
-                            # on another iteration of the loop
-                            break
-                    event.acquisition_.post_notification(AcqNotification(
-                        AcqNotification.Camera, event.axisPositions_, AcqNotification.Camera.POST_EXPOSURE))
-                    for h in event.acquisition_.get_after_exposure_hooks():
-                        h.run(event)
-                    need_to_run_after_exposure_hooks = False
-
+            num_cam_channels = self.cached_core.get_number_of_camera_channels()
+            for i in range(0, 1 if event.get_sequence() is None else len(event.get_sequence())):
                 if timeout:
+                    # Cancel the rest of the sequence
+                    self.stop_hardware_sequences(hardware_sequences_in_progress)
                     break
-                # Doesn't seem to be a version in the API in which you don't have to do this
-                actual_cam_index = cam_index
-                if "Multi Camera-CameraChannelIndex" in ti.tags.keys() :
-                    actual_cam_index = ti.tags["Multi Camera-CameraChannelIndex"]
-                    if num_cam_channels == 1:
-                        # probably a mistake in the core....
-                        actual_cam_index = 0  # Override index because not using multi cam mode right now
-
-                corresponding_event = event
-                if event.get_sequence() is not None:
-                    # Find the event that corresponds to the camera that captured this image.
-                    # This assumes that the images from a single camera are in order
-                    # in the sequence, though different camera images may be interleaved
-                    if event.get_sequence()[0].get_camera_device_name() is not None:
-                        # camera is specified in the acquisition event. Find the first event that matches
-                        # this camera name.
-                        the_camera_name = camera_name
-                        corresponding_event = next(filter(lambda
-                                                              e: e.get_camera_device_name() is not None and e.get_camera_device_name() == the_camera_name,
-                                                          multi_cam_adapter_camera_event_lists.get(actual_cam_index)))
-                        multi_cam_adapter_camera_event_lists.get(actual_cam_index).remove(corresponding_event)
-                    else:
-                        # multi camera adapter or just using the default camera
-                        corresponding_event = multi_cam_adapter_camera_event_lists.get(actual_cam_index).pop(0)
-                # add standard metadata
-                AcqEngMetadata.add_image_metadata(self.core, ti.tags, corresponding_event,
-                                                  current_time_ms - corresponding_event.acquisition_.get_start_time_ms(),
-                                                  exposure)
-                # add user metadata specified in the event
-                corresponding_event.acquisition_.add_tags_to_tagged_image(ti.tags, corresponding_event.get_tags())
-                corresponding_event.acquisition_.add_to_image_metadata(ti.tags)
-                corresponding_event.acquisition_.add_to_output(ti)
+
+                need_to_run_after_exposure_hooks = len(event.acquisition_.get_after_exposure_hooks()) > 0
+                for cam_index in range(num_cam_channels):
+                    ti = None
+                    camera_name = None
+                    while ti is None:
+                        if event.acquisition_.is_abort_requested():
+                            return
+                        try:
+                            if event.get_sequence() is not None and len(event.get_sequence()) > 1:
+                                if self.core.is_buffer_overflowed():
+                                    raise Exception("Sequence buffer overflow")
+                                sequence_running = self.core.is_sequence_running()
+                                if self.core.get_remaining_image_count() == 0:
+                                    if not sequence_running:
+                                        raise Exception("Expected images did not arrive in circular buffer")
+                                    # check if timeout has been exceeded. This is used in the case of a
+                                    # camera waiting for a trigger that never comes.
+                                    if event.get_sequence()[i].get_timeout_ms() is not None:
+                                        if (time.time() - start_copy_time) * 1000 > event.get_sequence()[i].get_timeout_ms():
+                                            timeout = True
+                                            self.core.stop_sequence_acquisition()
+                                            while self.core.is_sequence_running():
+                                                time.sleep(0.001)
+                                            break
+                                    # continue waiting
+                                    self.image_waiter.wait()
+                                    continue
+                                try:
+                                    ti = self.core.pop_next_tagged_image()
+                                    camera_name = ti.tags["Camera"]
+                                except Exception as e:
+                                    # continue waiting
+                                    ti = None
+                                    self.image_waiter.wait()
+                            else:
+                                try:
+                                    # TODO: probably there should be a timeout here too, but I'm
+                                    #  not sure the snap_image system supports it (as opposed to sequences)
+                                    # This is a little different from the java version due to differences in metadata
+                                    # handling in the SWIG wrapper
+                                    camera_name = self.cached_core.get_camera_device()
+                                    ti = self.core.get_tagged_image(cam_index, camera_name, height, width)
+                                except Exception as e:
+                                    # continue waiting
+                                    self.image_waiter.wait()
+                        except Exception as ex:
+                            # Sequence buffer overflow
+                            e = HardwareControlException(str(ex))
+                            event.acquisition_.abort(e)
+                            raise e
+                    self.image_waiter.image_arrived()
+                    if need_to_run_after_exposure_hooks:
+                        for camera_device_name in camera_image_counts.keys():
+                            if self.core.is_sequence_running(camera_device_name):
+                                # all of the sequences are not yet done, so this will need to be handled
+                                # on another iteration of the loop
+                                break
+                        event.acquisition_.post_notification(AcqNotification(
+                            AcqNotification.Camera, event.axisPositions_, AcqNotification.Camera.POST_EXPOSURE))
+                        for h in event.acquisition_.get_after_exposure_hooks():
+                            self.run_hook(h, event)
+                        need_to_run_after_exposure_hooks = False
+
+                    if timeout:
+                        break
+                    # Doesn't seem to be a version in the API in which you don't have to do this
+                    actual_cam_index = cam_index
+                    if "Multi Camera-CameraChannelIndex" in ti.tags.keys() :
+                        actual_cam_index = ti.tags["Multi Camera-CameraChannelIndex"]
+                        if num_cam_channels == 1:
+                            # probably a mistake in the core....
+                            actual_cam_index = 0  # Override index because not using multi cam mode right now
+
+                    corresponding_event = event
+                    if event.get_sequence() is not None:
+                        # Find the event that corresponds to the camera that captured this image.
+                        # This assumes that the images from a single camera are in order
+                        # in the sequence, though different camera images may be interleaved
+                        if event.get_sequence()[0].get_camera_device_name() is not None:
+                            # camera is specified in the acquisition event. Find the first event that matches
+                            # this camera name.
+                            the_camera_name = camera_name
+                            corresponding_event = next(filter(lambda
+                                                                  e: e.get_camera_device_name() is not None and e.get_camera_device_name() == the_camera_name,
+                                                              multi_cam_adapter_camera_event_lists.get(actual_cam_index)))
+                            multi_cam_adapter_camera_event_lists.get(actual_cam_index).remove(corresponding_event)
+                        else:
+                            # multi camera adapter or just using the default camera
+                            corresponding_event = multi_cam_adapter_camera_event_lists.get(actual_cam_index).pop(0)
+                    # Time of the frame within the sequence, as reported by the camera
+                    camera_elapsed_ms = ti.tags.get(AcqEngMetadata.ELAPSED_TIME_MS)
+                    # add standard metadata
+                    AcqEngMetadata.add_image_metadata(self.core, ti.tags, corresponding_event,
+                                                      current_time_ms - corresponding_event.acquisition_.get_start_time_ms(),
+                                                      exposure, metadata_template)
+                    if event.get_sequence_interval_ms():
+                        self.add_frame_times(ti.tags, corresponding_event, camera_elapsed_ms,
+                                             sequence_start_time_ms - corresponding_event.acquisition_.get_start_time_ms())
+                    # add user metadata specified in the event
+                    corresponding_event.acquisition_.add_tags_to_tagged_image(ti.tags, corresponding_event.get_tags())
+                    corresponding_event.acquisition_.add_to_image_metadata(ti.tags)
+                    corresponding_event.acquisition_.add_to_output(ti)
 
         self.stop_hardware_sequences(hardware_sequences_in_progress)
 
@@ -408,6 +584,90 @@ class Engine:
         if timeout:
             raise TimeoutError("Timeout waiting for images to arrive in circular buffer")
 
+    def is_batch_drainable(self, event: AcquisitionEvent) -> bool:
+        """
+        Images of a sequence can be taken out of the circular buffer in batches if they all come from the
+        Core-Camera, in order, and no hooks need to run between them
+        """
+        return event.get_sequence() is not None and len(event.get_sequence()) > 1 and \
+            event.get_sequence()[0].get_camera_device_name() is None and \
+            not event.acquisition_.get_after_exposure_hooks() and \
+            self.cached_core.get_number_of_camera_channels() == 1
+
+    def drain_sequence_images(self, event: AcquisitionEvent, hardware_sequences_in_progress: HardwareSequences,
+                              current_time_ms, start_copy_time, sequence_start_time_ms) -> bool:
+        """
+        Collect the images of a sequence from a single camera. Every image that is ready is taken out of the
+        circular buffer at once, its metadata is filled in from a template made once for the sequence, and
+        the batch is passed on to the acquisition together. Returns True if the sequence timed out
+        """
+        acq = event.acquisition_
+        sequence = event.get_sequence()
+        template = AcqEngMetadata.make_sequence_metadata_template(self.cached_core)
+        default_exposure = self.core.get_exposure() if event.get_exposure() is None else event.get_exposure()
+        elapsed_ms = current_time_ms - acq.get_start_time_ms()
+        interval_timed = bool(event.get_sequence_interval_ms())
+        index = 0
+        while index < len(sequence):
+            if acq.is_abort_requested():
+                return False
+            try:
+                if self.core.is_buffer_overflowed():
+                    raise Exception("Sequence buffer overflow")
+                sequence_running = self.core.is_sequence_running()
+                num_ready = self.core.get_remaining_image_count()
+                if num_ready == 0:
+                    if not sequence_running:
+                        raise Exception("Expected images did not arrive in circular buffer")
+                    # check if timeout has been exceeded. This is used in the case of a
+                    # camera waiting for a trigger that never comes.
+                    if sequence[index].get_timeout_ms() is not None and \
+                            (time.time() - start_copy_time) * 1000 > sequence[index].get_timeout_ms():
+                        self.core.stop_sequence_acquisition()
+                        while self.core.is_sequence_running():
+                            time.sleep(0.001)
+                        self.stop_hardware_sequences(hardware_sequences_in_progress)
+                        return True
+                    self.image_waiter.wait()
+                    continue
+                batch = []
+                for _ in range(min(num_ready, len(sequence) - index)):
+                    batch.append(self.core.pop_next_tagged_image())
+            except Exception as ex:
+                e = HardwareControlException(str(ex))
+                acq.abort(e)
+                raise e
+            self.image_waiter.image_arrived()
+            for ti in batch:
+                corresponding_event = sequence[index]
+                index += 1
+                camera_elapsed_ms = ti.tags.get(AcqEngMetadata.ELAPSED_TIME_MS)
+                exposure = default_exposure if corresponding_event.get_exposure() is None else \
+                    corresponding_event.get_exposure()
+                AcqEngMetadata.add_image_metadata(self.core, ti.tags, corresponding_event, elapsed_ms, exposure,
+                                                  template)
+                if interval_timed:
+                    self.add_frame_times(ti.tags, corresponding_event, camera_elapsed_ms,
+                                         sequence_start_time_ms - acq.get_start_time_ms())
+                acq.add_tags_to_tagged_image(ti.tags, corresponding_event.get_tags())
+                acq.add_to_image_metadata(ti.tags)
+            acq.add_to_output(batch)
+        return False
+
+    def add_frame_times(self, tags, event: AcquisitionEvent, camera_elapsed_ms, sequence_start_ms):
+        """
+        Record when a frame of a camera-timed sequence was planned to be taken, and when it was actually taken,
+        both in ms since the start of the acquisition. The actual time comes from the camera's own time stamp if
+        it provides one, and otherwise is the time the image arrived
+        """
+        planned_ms = event.get_minimum_start_time_absolute() - event.acquisition_.get_start_time_ms()
+        try:
+            actual_ms = sequence_start_ms + float(camera_elapsed_ms)
+        except (TypeError, ValueError):
+            actual_ms = time.time() * 1000 - event.acquisition_.get_start_time_ms()
+        AcqEngMetadata.set_frame_time_planned_ms(tags, planned_ms)
+        AcqEngMetadata.set_frame_time_ms(tags, actual_ms)
+
     def abort_if_requested(self, event: AcquisitionEvent, hardware_sequences_in_progress: HardwareSequences) -> None:
         if event.acquisition_.is_abort_requested():
             if hardware_sequences_in_progress is not None:
@@ -433,38 +693,137 @@ class Engine:
                                             hardware_sequences_in_progress.property_names[i])
             except Exception as ee:
                 traceback.print_exc()
-                self.core.logMessage("Error stopping property sequence: " + ee)
+                self.core.logMessage("Error stopping property sequence: " + str(ee))
         self.core.clear_circular_buffer()
 
+    def get_pipelinable_hardware(self, event: AcquisitionEvent) -> list:
+        """
+        Get the hardware changes of an event that can be made while a previous event is still being read
+        out. Returns a list containing stage device names and/or 'xy', 'z' and 'config'. Nothing is
+        pipelined if a hook could modify or cancel the event before the hardware change would normally
+        happen, and nothing that touches the camera or a device declared as conflicting is moved early.
+        """
+        acq = event.acquisition_
+        if event.is_acquisition_finished_event() or event.is_acquisition_sequence_end_event() or \
+                acq.get_before_hardware_hooks():
+            return []
+        conflicting_devices = set(acq.get_pipelining_conflict_devices())
+        conflicting_devices.add(self.cached_core.get_camera_device())
+        if event.get_camera_device_name() is not None:
+            conflicting_devices.add(event.get_camera_device_name())
+
+        parts = [name for name in event.get_stage_device_names() if name not in conflicting_devices]
+        if event.get_x_position() is not None and event.get_y_position() is not None and \
+                self.cached_core.get_xy_stage_device() not in conflicting_devices:
+            parts.append('xy')
+        if event.get_config_preset() is not None:
+            settings = self.device_capabilities.get_config_settings(event.get_config_group(), event.get_config_preset())
+            if not any(device_name in conflicting_devices for device_name, _ in settings):
+                parts.append('config')
+        # The Z drive is moved after the before-Z hooks, which are typically used for autofocus
+        if event.get_z_position() is not None and not acq.get_before_z_hooks() and \
+                self.cached_core.get_focus_device() not in conflicting_devices:
+            parts.append('z')
+        return parts
+
+    def start_pipelined_hardware(self, current_event: AcquisitionEvent, next_event: AcquisitionEvent) -> None:
+        """
+        Start the hardware changes for next_event that are safe to make while the images of current_event
+        are read out. They run on a separate thread, and the next call to execute_acquisition_event waits for
+        them to finish. prepare_hardware and start_z_drive then skip whatever has already been done.
+        """
+        acq = current_event.acquisition_
+        if not acq.is_pipelined_hardware() or next_event.acquisition_ is not acq or acq.is_abort_requested():
+            return
+        try:
+            parts = self.get_pipelinable_hardware(next_event)
+        except Exception:
+            traceback.print_exc()
+            return
+        if not parts:
+            return
+
+        def move_hardware_early():
+            done = set()
+            try:
+                for part in parts:
+                    if part == 'xy':
+                        xy_stage = self.cached_core.get_xy_stage_device()
+                        self.core.wait_for_device(xy_stage)
+                        self.core.set_xy_position(xy_stage, next_event.get_x_position(), next_event.get_y_position())
+                        self.hardware_state.set(('xy', xy_stage), (next_event.get_x_position(),
+                                                                   next_event.get_y_position()))
+                        self.core.wait_for_device(xy_stage)
+                    elif part == 'config':
+                        self.core.set_config(next_event.get_config_group(), next_event.get_config_preset())
+                        self.hardware_state.set(('config', next_event.get_config_group()),
+                                                next_event.get_config_preset())
+                        self.core.wait_for_config(next_event.get_config_group(), next_event.get_config_preset())
+                    elif part == 'z':
+                        z_stage = self.cached_core.get_focus_device()
+                        self.core.wait_for_device(z_stage)
+                        self.core.set_position(z_stage, float(next_event.get_z_position()))
+                        self.hardware_state.set(('stage', z_stage), float(next_event.get_z_position()))
+                        self.core.wait_for_device(z_stage)
+                    else:
+                        self.core.wait_for_device(part)
+                        self.core.set_position(part, next_event.get_stage_single_axis_stage_position(part))
+                        self.hardware_state.set(('stage', part), next_event.get_stage_single_axis_stage_position(part))
+                        self.core.wait_for_device(part)
+                    done.add(part)
+            except Exception:
+                self.hardware_state.invalidate()
+                # Anything not done here will be done the normal way when the event executes
+                self.core.log_message(traceback.format_exc())
+            return next_event, done
+
+        if acq.is_debug_mode():
+            self.core.log_message("starting pipelined hardware changes: " + str(parts))
+        self.pipelined_hardware_future = self.pipelined_hardware_executor.submit(move_hardware_early)
+
+    def await_pipelined_hardware(self) -> None:
+        """
+        Block until hardware changes that were started early have finished
+        """
+        if self.pipelined_hardware_future is None:
+            return
+        self.pipelined_hardware = self.pipelined_hardware_future.result()
+        self.pipelined_hardware_future = None
+
+    def is_pipelined(self, event: AcquisitionEvent, part: str) -> bool:
+        """
+        Check whether a hardware change (see get_pipelinable_hardware) for this event was already made early
+        """
+        if self.pipelined_hardware is None:
+            return False
+        pipelined_event, done = self.pipelined_hardware
+        first_event = event if event.get_sequence() is None else event.get_sequence()[0]
+        return pipelined_event is first_event and part in done
 
     def prepare_hardware(self, event: AcquisitionEvent, hardware_sequences_in_progress: HardwareSequences) -> None:
         def move_xy_stage(event):
             try:
                 if event.is_xy_sequenced():
-                    self.core.start_xy_stage_sequence(xy_stage)
+                    self.hardware_state.invalidate(('xy', xy_stage))
+                    dispatch(lambda: self.core.start_xy_stage_sequence(xy_stage))
+                elif self.is_pipelined(event, 'xy'):
+                    return  # already moved while the previous image was read out
                 else:
                     # Could be sequenced over other devices, in that case get xy position from first in sequence
-                    prev_x_position = None if self.last_event is None else None if self.last_event.get_sequence() is None else \
-                        self.last_event.get_sequence()[0].get_x_position()
                     x_position = event.get_sequence()[
                         0].get_x_position() if event.get_sequence() is not None else event.get_x_position()
-                    prev_y_position = None if self.last_event is None else None if self.last_event.get_sequence() is None else \
-                        self.last_event.get_sequence()[0].get_y_position()
                     y_position = event.get_sequence()[
                         0].get_y_position() if event.get_sequence() is not None else event.get_y_position()
-                    previous_xy_defined = event is not None and prev_x_position is not None and prev_y_position is not None
                     current_xy_defined = event is not None and x_position is not None and y_position is not None
                     if not current_xy_defined:
                         return
-                    xy_changed = not previous_xy_defined or not prev_x_position == x_position or not prev_y_position == y_position
-                    if not xy_changed:
+                    if is_current(('xy', xy_stage), (x_position, y_position)):
                         return
-                    # Wait for it to not be busy (is this even needed?)
-                    self.core.wait_for_device(xy_stage)
-                    # Move XY
-                    self.core.set_xy_position(xy_stage, x_position, y_position)
-                    # Wait for move to finish
-                    self.core.wait_for_device(xy_stage)
+                    # Wait for it to not be busy (is this even needed?), move XY, and wait for move to finish
+                    dispatch(lambda: self.core.set_xy_position(xy_stage, x_position, y_position), [xy_stage],
+                             wait_before=lambda: self.core.wait_for_device(xy_stage),
+                             wait_after=lambda: self.core.wait_for_device(xy_stage),
+                             state=(('xy', xy_stage), (x_position, y_position)))
             except Exception as ex:
                 self.core.log_message(traceback.format_exc())
                 raise HardwareControlException()
@@ -476,56 +835,65 @@ class Engine:
                     0].get_config_preset() if event.get_sequence() is not None else event.get_config_preset()
                 current_group = event.get_sequence()[
                     0].get_config_group() if event.get_sequence() is not None else event.get_config_group()
-                previous_config = None if self.last_event is None else None if self.last_event.get_sequence() is None else \
-                    self.last_event.get_sequence()[0].get_config_preset()
-                new_channel = current_config is not None and (
-                        previous_config is None or not previous_config == current_config)
+                new_channel = current_config is not None and not is_current(('config', current_group), current_config)
                 if new_channel:
                     # Set exposure
-                    if event.get_exposure() is not None:
-                        self.core.set_exposure(event.get_exposure())
-                    # Set other channel props
-                    self.core.set_config(current_group, current_config)
-                    # TODO: haven't tested if this is actually needed
-                    self.core.wait_for_config(current_group, current_config)
+                    if event.get_exposure() is not None and not event.is_exposure_sequenced():
+                        exposure = event.get_exposure()
+                        if not is_current(('exposure', camera), exposure):
+                            dispatch(lambda: self.core.set_exposure(exposure), state=(('exposure', camera), exposure))
+                    # Set other channel props, unless already done while the previous image was read out
+                    if not self.is_pipelined(event, 'config'):
+                        config_devices = []
+                        if concurrent:
+                            config_devices = [device_name for device_name, _ in
+                                              self.device_capabilities.get_config_settings(current_group,
+                                                                                           current_config)]
+                        # TODO: haven't tested if waiting is actually needed
+                        dispatch(lambda: self.core.set_config(current_group, current_config), config_devices,
+                                 wait_after=lambda: self.core.wait_for_config(current_group, current_config),
+                                 state=(('config', current_group), current_config))
                 if event.is_config_group_sequenced():
                     # Channels
-                    group = event.get_sequence()[0].get_config_group()
-                    config = self.core.get_config_data(group, event.get_sequence()[0].get_config_preset())
-                    for i in range(config.size()):
-                        ps = config.getSetting(i)
-                        device_name = ps.getDeviceLabel()
-                        prop_name = ps.getPropertyName()
-                        if self.core.is_property_sequenceable(device_name, prop_name):
-                            self.core.start_property_sequence(device_name, prop_name)
+                    for device_name, prop_name in zip(hardware_sequences_in_progress.property_device_names,
+                                                      hardware_sequences_in_progress.property_names):
+                        self.hardware_state.invalidate_property(device_name, prop_name)
+                        dispatch(lambda d=device_name, p=prop_name: self.core.start_property_sequence(d, p))
             except Exception as ex:
-                ex.print_stack_trace()
-                raise HardwareControlException(ex.get_message())
+                raise HardwareControlException(ex)
 
         def move_other_stage_devices(event):
             try:
-                for stage_device_name in event.get_stage_device_names():
-                    # Wait for it to not be busy
-                    self.core.wait_for_device(stage_device_name)
-                    # Move stage device
-                    self.core.set_position(stage_device_name,
-                                           event.get_stage_single_axis_stage_position(stage_device_name))
-                    # Wait for move to finish
-                    self.core.wait_for_device(stage_device_name)
+                first_event = event if event.get_sequence() is None else event.get_sequence()[0]
+                for stage_device_name in first_event.get_stage_device_names():
+                    if event.is_stage_device_sequenced(stage_device_name):
+                        self.hardware_state.invalidate(('stage', stage_device_name))
+                        dispatch(lambda d=stage_device_name: self.core.start_stage_sequence(d), [stage_device_name],
+                                 wait_before=lambda d=stage_device_name: self.core.wait_for_device(d))
+                        continue
+                    if self.is_pipelined(event, stage_device_name):
+                        continue
+                    # Wait for it to not be busy, move stage device, and wait for move to finish
+                    position = first_event.get_stage_single_axis_stage_position(stage_device_name)
+                    if is_current(('stage', stage_device_name), position):
+                        continue
+                    dispatch(lambda d=stage_device_name, p=position: self.core.set_position(d, p), [stage_device_name],
+                             wait_before=lambda d=stage_device_name: self.core.wait_for_device(d),
+                             wait_after=lambda d=stage_device_name: self.core.wait_for_device(d),
+                             state=(('stage', stage_device_name), position))
             except Exception as ex:
                 raise HardwareControlException(ex)
 
         def change_exposure(event):
             try:
                 if event.is_exposure_sequenced():
-                    self.core.start_exposure_sequence(self.core.get_camera_device())
+                    self.hardware_state.invalidate(('exposure', camera))
+                    dispatch(lambda: self.core.start_exposure_sequence(camera))
                 else:
                     current_exposure = event.get_exposure()
-                    prev_exposure = None if self.last_event is None else self.last_event.get_exposure()
-                    change_exposure = current_exposure is not None and (prev_exposure is None or
-                                                                        not prev_exposure == current_exposure)
-                    if change_exposure:
-                        self.core.setExposure(current_exposure)
+                    if current_exposure is not None and not is_current(('exposure', camera), current_exposure):
+                        dispatch(lambda: self.core.setExposure(current_exposure),
+                                 state=(('exposure', camera), current_exposure))
             except Exception as ex:
                 raise HardwareControlException(ex)
 
@@ -534,9 +902,9 @@ class Engine:
                 slm_image = event.get_slm_image()
                 if slm_image is not None:
                     if isinstance(slm_image, bytes):
-                        self.core.get_slm_image(slm, slm_image)
+                        dispatch(lambda: self.core.get_slm_image(slm, slm_image))
                     elif isinstance(slm_image, list) and all(isinstance(i, int) for i in slm_image):
-                        self.core.get_slm_image(slm, slm_image)
+                        dispatch(lambda: self.core.get_slm_image(slm, slm_image))
                     else:
                         raise ValueError("SLM api only supports 8 bit and 32 bit patterns")
             except Exception as ex:
@@ -544,94 +912,111 @@ class Engine:
 
         def loop_hardware_command_retries(r, command_name):
             for i in range(HARDWARE_ERROR_RETRIES):
+                num_queued = len(queued_commands)
                 try:
                     r()
                     return
                 except Exception as e:
+                    # Don't queue the same commands twice on a retry
+                    del queued_commands[num_queued:]
+                    # Whatever the failed command did to the hardware is unknown
+                    self.hardware_state.invalidate()
                     self.core.log_message(traceback.format_exc())
                     print(self.get_current_date_and_time() + ": Problem " + command_name + "\n Retry #" + str(
                         i) + " in " + str(DELAY_BETWEEN_RETRIES_MS) + " ms")
                     time.sleep(DELAY_BETWEEN_RETRIES_MS / 1000)
             raise HardwareControlException(command_name + " unsuccessful")
 
+        def dispatch(command, device_names=(), wait_before=None, wait_after=None, state=None):
+            """
+            Send a command to the hardware. Normally this waits for the devices before and after the command.
+            In concurrent dispatch mode the command is queued instead, and the devices it moves are waited on
+            together with all others once every command for the event has been issued. state is a
+            (key, value) of the hardware state the command puts the hardware in
+            """
+            if state is not None:
+                def command(command=command):
+                    command()
+                    self.hardware_state.set(*state)
+            if not concurrent:
+                if wait_before is not None:
+                    wait_before()
+                command()
+                if wait_after is not None:
+                    wait_after()
+            else:
+                queued_commands.append((command, [d for d in device_names if d != 'Core']))
+
+        def is_current(key, value):
+            return not resend_hardware and self.hardware_state.is_current(key, value)
+
         def change_additional_properties(event):
             try:
                 for s in event.get_additional_properties():
-                    self.core.setProperty(s[0], s[1], s[2])
+                    if is_current(('property', s[0], s[1]), str(s[2])):
+                        continue
+                    dispatch(lambda s=s: self.core.setProperty(s[0], s[1], s[2]), [s[0]],
+                             state=(('property', s[0], s[1]), str(s[2])))
             except Exception as ex:
-                raise HardwareControlException(ex.getMessage())
+                raise HardwareControlException(ex)
 
+        concurrent = event.acquisition_.is_concurrent_hardware_dispatch()
+        resend_hardware = event.acquisition_.is_resend_hardware()
+        queued_commands = []
         try:
             # Get the hardware specific to this acquisition
-            xy_stage = self.core.get_xy_stage_device()
-            slm = self.core.get_slm_device()
+            xy_stage = self.cached_core.get_xy_stage_device()
+            slm = self.cached_core.get_slm_device()
+            camera = self.cached_core.get_camera_device()
 
             # Prepare sequences if applicable
             if event.get_sequence() is not None:
-                z_sequence = pymmcore.DoubleVector() if event.is_z_sequenced() else None
-                x_sequence = pymmcore.DoubleVector() if event.is_xy_sequenced() else None
-                y_sequence = pymmcore.DoubleVector() if event.is_xy_sequenced() else None
-                exposure_sequence_ms = pymmcore.DoubleVector() if event.is_exposure_sequenced() else None
-                group = event.get_sequence()[0].get_config_group()
-                config = self.core.get_config_data(group, event.get_sequence()[0].get_config_preset()) if event.get_sequence()[0].get_config_preset() is not None else None
-                prop_sequences = [] if event.is_config_group_sequenced() else None
+                x_sequence = [] if event.is_xy_sequenced() else None
+                y_sequence = [] if event.is_xy_sequenced() else None
+                exposure_sequence_ms = [] if event.is_exposure_sequenced() else None
+                stage_sequences = {stage_device_name: [] for stage_device_name in event.get_sequenced_stage_device_names()}
+                prop_sequences = self.build_property_sequences(event) if event.is_config_group_sequenced() else None
 
                 for e in event.get_sequence():
-                    if z_sequence is not None:
-                        z_sequence.append(e.get_z_position())
                     if x_sequence is not None:
                         x_sequence.append(e.get_x_position())
                     if y_sequence is not None:
                         y_sequence.append(e.get_y_position())
                     if exposure_sequence_ms is not None:
                         exposure_sequence_ms.append(e.get_exposure())
+                    for stage_device_name, stage_sequence in stage_sequences.items():
+                        stage_sequence.append(e.get_stage_single_axis_stage_position(stage_device_name))
 
-                    # Set sequences for all channel properties
-                    if prop_sequences is not None:
-                        for i in range(config.size()):
-                            ps = config.getSetting(i)
-                            device_name = ps.getDeviceLabel()
-                            prop_name = ps.getPropertyName()
-
-                            if e == event.get_sequence()[0]:  # First property
-                                raise NotImplementedError("Property sequences not yet implemented")
-                                # TODO: what is this in pymmcore
-                                prop_sequences.add(StrVector())
-
-                            channel_preset_config = self.core.get_config_data(group, e.get_config_preset())
-                            prop_value = channel_preset_config.getSetting(device_name, prop_name).getPropertyValue()
-
-                            if self.core.is_property_sequenceable(device_name, prop_name):
-                                prop_sequences.get(i).add(prop_value)
+                hardware_sequences_in_progress.device_names.append(camera)
 
-                hardware_sequences_in_progress.device_names.append(self.core.get_camera_device())
-
-                # Now have built up all the sequences, apply them
+                # Now have built up all the sequences, apply them. Devices that already hold the
+                # same sequence (e.g. from the previous time point) aren't sent it again
                 if event.is_exposure_sequenced():
-                    self.core.load_exposure_sequence(self.core.get_camera_device(), exposure_sequence_ms)
+                    self.loaded_sequences.load(('exposure', camera), exposure_sequence_ms,
+                        lambda: self.core.load_exposure_sequence(camera, pymmcore.DoubleVector(exposure_sequence_ms)))
                     # Already added camera
 
                 if event.is_xy_sequenced():
-                    self.core.load_xy_stage_sequence(xy_stage, x_sequence, y_sequence)
-                    hardware_sequences_in_progress.device_names.add(xy_stage)
-
-                if event.is_config_group_sequenced():
-                    for i in range(config.size()):
-                        ps = config.getSetting(i)
-                        device_name = ps.getDeviceLabel()
-                        prop_name = ps.getPropertyName()
-
-                        if prop_sequences.get(i).size() > 0:
-                            self.core.load_property_sequence(device_name, prop_name, prop_sequences.get(i))
-                            hardware_sequences_in_progress.property_names.add(prop_name)
-                            hardware_sequences_in_progress.property_device_names.add(device_name)
-
-                self.core.prepare_sequence_acquisition(self.core.get_camera_device())
-
-                # Compare to last event to see what needs to change
-                if self.last_event is not None and self.last_event.acquisition_ != event.acquisition_:
-                    self.last_event = None  # Update all hardware if switching to a new acquisition
-
+                    self.loaded_sequences.load(('xy', xy_stage), zip(x_sequence, y_sequence),
+                        lambda: self.core.load_xy_stage_sequence(xy_stage, pymmcore.DoubleVector(x_sequence),
+                                                                 pymmcore.DoubleVector(y_sequence)))
+                    hardware_sequences_in_progress.device_names.append(xy_stage)
+
+                for stage_device_name, stage_sequence in stage_sequences.items():
+                    self.loaded_sequences.load(('stage', stage_device_name), stage_sequence,
+                        lambda d=stage_device_name, v=stage_sequence: self.core.load_stage_sequence(
+                            d, pymmcore.DoubleVector(v)))
+                    hardware_sequences_in_progress.device_names.append(stage_device_name)
+
+                if prop_sequences is not None:
+                    for (device_name, prop_name), prop_sequence in prop_sequences.items():
+                        self.loaded_sequences.load(('property', device_name, prop_name), prop_sequence,
+                            lambda d=device_name, p=prop_name, v=prop_sequence: self.core.load_property_sequence(
+                                d, p, pymmcore.StrVector(v)))
+                        hardware_sequences_in_progress.property_names.append(prop_name)
+                        hardware_sequences_in_progress.property_device_names.append(device_name)
+
+                self.core.prepare_sequence_acquisition(camera)
 
             # Other stage devices
             loop_hardware_command_retries(lambda: move_other_stage_devices(event), "Moving other stage devices")
@@ -645,12 +1030,102 @@ class Engine:
             loop_hardware_command_retries(lambda: set_slm_pattern(event), "Setting SLM pattern")
             # Arbitrary Properties
             loop_hardware_command_retries(lambda: change_additional_properties(event), "Changing additional properties")
+            if concurrent:
+                self.dispatch_concurrently(event, queued_commands)
             # Keep track of last event
             self.last_event = event if event.get_sequence() is None else event.get_sequence()[-1]
         except:
             traceback.print_exc()
             raise HardwareControlException("Error executing event")
 
+    def build_property_sequences(self, event: AcquisitionEvent) -> dict:
+        """
+        Build the value sequences for the config group properties that change over a sequence event.
+        Returns a dict mapping (device, property) to a list of values, one per event. Events without
+        a config preset keep the preset of the event before them
+        """
+        sequence = event.get_sequence()
+        group = next(e.get_config_group() for e in sequence if e.get_config_group() is not None)
+        preset = next(e.get_config_preset() for e in sequence if e.get_config_preset() is not None)
+        preset_settings = []
+        for e in sequence:
+            if e.get_config_preset() is not None:
+                preset = e.get_config_preset()
+            preset_settings.append(self.device_capabilities.get_config_settings(group, preset))
+        # Properties that are the same in every preset are set with the config of the first event
+        prop_sequences = {}
+        for key in dict.fromkeys(key for settings in preset_settings for key in settings):
+            if any(key not in settings for settings in preset_settings):
+                # The sequence planner doesn't merge such presets, as the property would be left unset
+                raise HardwareControlException("Presets of config group {} in a sequence set different "
+                                               "properties".format(group))
+            prop_sequence = [settings[key] for settings in preset_settings]
+            if any(value != prop_sequence[0] for value in prop_sequence):
+                prop_sequences[key] = prop_sequence
+        return prop_sequences
+
+    def dispatch_concurrently(self, event: AcquisitionEvent, queued_commands: list) -> None:
+        """
+        Issue hardware commands without waiting for the devices in between, then wait for all of them together.
+        queued_commands is a list of (command, device_names) tuples in the order they would be run serially.
+        Commands for devices that depend on other devices being commanded for this event (see
+        Acquisition.set_concurrent_hardware_dispatch) are held back until those devices have settled.
+        """
+        acq = event.acquisition_
+        issue_times = {}
+        settle_times = {}
+        start_time = time.time()
+        remaining = list(queued_commands)
+        while remaining:
+            pending_devices = {d for _, device_names in remaining for d in device_names}
+            wave = [(command, device_names) for command, device_names in remaining
+                    if not any(prerequisite in pending_devices and prerequisite not in device_names
+                               for d in device_names for prerequisite in acq.get_device_dependencies(d))]
+            if not wave:
+                raise HardwareControlException("Circular dependency between devices " + str(pending_devices))
+            for command, device_names in wave:
+                for i in range(HARDWARE_ERROR_RETRIES):
+                    try:
+                        command()
+                        break
+                    except Exception:
+                        self.core.log_message(traceback.format_exc())
+                        time.sleep(DELAY_BETWEEN_RETRIES_MS / 1000)
+                else:
+                    raise HardwareControlException("Hardware command unsuccessful")
+                for device_name in device_names:
+                    issue_times[device_name] = time.time()
+                    settle_times.pop(device_name, None)
+            remaining = [c for c in remaining if c not in wave]
+            # Devices in later waves depend on these having settled
+            settle_times.update(self.wait_for_devices(
+                {d: t for d, t in issue_times.items() if d not in settle_times}))
+        # Compare to waiting on each device right after its own command
+        saved_ms = (sum(settle_times.values()) - (time.time() - start_time)) * 1000
+        acq.add_settle_time_saved_ms(max(saved_ms, 0))
+        if acq.is_debug_mode():
+            self.core.log_message("concurrent hardware dispatch saved {:.1f} ms".format(saved_ms))
+
+    def wait_for_devices(self, issue_times: dict) -> dict:
+        """
+        Wait for all devices in issue_times (device name -> time its command was issued) to stop being
+        busy. Returns how long (in s) each device took to settle after its command
+        """
+        settle_times = {}
+        poll_start = time.time()
+        while len(settle_times) < len(issue_times) and time.time() - poll_start < SETTLE_TIME_POLL_TIMEOUT_S:
+            for device_name, issue_time in issue_times.items():
+                if device_name not in settle_times and not self.core.device_busy(device_name):
+                    settle_times[device_name] = time.time() - issue_time
+            if len(settle_times) < len(issue_times):
+                time.sleep(0.0005)
+        # This also applies device delays and the core's timeout
+        for device_name in issue_times:
+            self.core.wait_for_device(device_name)
+            if device_name not in settle_times:
+                settle_times[device_name] = time.time() - issue_times[device_name]
+        return settle_times
+
     def start_z_drive(self, event: AcquisitionEvent, hardware_sequences_in_progress: HardwareSequences) -> None:
         def loop_hardware_command_retries(r, command_name):
             for i in range(HARDWARE_ERROR_RETRIES):
@@ -667,40 +1142,43 @@ class Engine:
         def move_z_device(event):
             try:
                 if event.is_z_sequenced():
+                    self.hardware_state.invalidate(('stage', z_stage))
                     self.core.start_stage_sequence(z_stage)
+                elif self.is_pipelined(event, 'z'):
+                    return  # already moved while the previous image was read out
                 else:
-                    previous_z = None if self.last_event is None else None if self.last_event.get_sequence() is None else \
-                        self.last_event.get_sequence()[0].get_z_position()
                     current_z = event.get_z_position() if event.get_sequence() is None else \
                         event.get_sequence()[0].get_z_position()
                     if current_z is None:
                         return
-                    change = previous_z is None or previous_z != current_z
-                    if not change:
+                    if not event.acquisition_.is_resend_hardware() and \
+                            self.hardware_state.is_current(('stage', z_stage), float(current_z)):
                         return
 
                     # Wait for it to not be busy
                     self.core.wait_for_device(z_stage)
                     # Move Z
                     self.core.set_position(z_stage, float(current_z))
+                    self.hardware_state.set(('stage', z_stage), float(current_z))
                     # Wait for move to finish
                     self.core.wait_for_device(z_stage)
             except Exception as ex:
+                self.hardware_state.invalidate(('stage', z_stage))
                 raise HardwareControlException(ex)
 
         try:
-            z_stage = self.core.get_focus_device()
+            z_stage = self.cached_core.get_focus_device()
             if event.get_sequence() is not None:
-                z_sequence = pymmcore.DoubleVector() if event.is_z_sequenced() else None
-                for e in event.get_sequence():
-                    if z_sequence is not None:
-                        z_sequence.append(e.get_z_position())
                 if event.is_z_sequenced():
-                    self.core.load_stage_sequence(z_stage, z_sequence)
+                    z_sequence = [e.get_z_position() for e in event.get_sequence()]
+                    self.loaded_sequences.load(('stage', z_stage), z_sequence,
+                        lambda: self.core.load_stage_sequence(z_stage, pymmcore.DoubleVector(z_sequence)))
                     hardware_sequences_in_progress.device_names.append(z_stage)
 
             # Z stage
             loop_hardware_command_retries(lambda: move_z_device(event), "Moving Z device")
+            # All pipelined hardware changes for this event have now been accounted for
+            self.pipelined_hardware = None
         except:
             traceback.print_exc()
             raise HardwareControlException("Error executing event")
@@ -711,82 +1189,19 @@ class Engine:
     def get_current_date_and_time(self):
         return datetime.datetime.now().strftime("%Y/%m/%d %H:%M:%S")
 
-    def is_sequencable(self, previous_events, next_event, new_seq_length):
+    def is_sequencable(self, previous_events, next_event, new_seq_length=None):
         try:
-            if next_event.is_acquisition_sequence_end_event() or next_event.is_acquisition_finished_event():
-                return False
-
-            previous_event = previous_events[-1]
-
-            # check all properties in group
-            if previous_event.get_config_preset() is not None and next_event.get_config_preset() is not None and \
-                    previous_event.get_config_preset() != next_event.get_config_preset():
-                # check all properties in the channel
-                config1 = self.core.get_config_data(previous_event.get_config_group(),
-                                                    previous_event.get_config_preset())
-                config2 = self.core.get_config_data(next_event.get_config_group(), next_event.get_config_preset())
-                for i in range(config1.size()):
-                    ps1 = config1.getSetting(i)
-                    device_name = ps1.getDeviceLabel()
-                    prop_name = ps1.getPropertyName()
-                    prop_value1 = ps1.getPropertyValue()
-                    ps2 = config2.getSetting(i)
-                    prop_value2 = ps2.getPropertyValue()
-                    if prop_value1 != prop_value2:
-                        if not self.core.is_property_sequenceable(device_name, prop_name):
-                            return False
-                        if self.core.get_property_sequence_max_length(device_name, prop_name) < new_seq_length:
-                            return False
-
-            # TODO check for arbitrary additional properties in the acq event for being sequencable
-
-            # z stage
-            if previous_event.get_z_position() is not None and next_event.get_z_position() is not None and \
-                    previous_event.get_z_position() != next_event.get_z_position():
-                if not self.core.is_stage_sequenceable(self.core.get_focus_device()):
-                    return False
-                if new_seq_length > self.core.get_stage_sequence_max_length(self.core.get_focus_device()):
-                    return False
-
-            # arbitrary z stages
-            # TODO implement sequences along arbitrary other stage devices
-            for stage_device in previous_event.get_stage_device_names():
-                return False
-
-            # xy stage
-            if (previous_event.get_x_position() is not None and next_event.get_x_position() is not None and
-                previous_event.get_x_position() != next_event.get_x_position()) or \
-                    (previous_event.get_y_position() is not None and next_event.get_y_position() is not None and
-                     previous_event.get_y_position() != next_event.get_y_position()):
-                if not self.core.is_xy_stage_sequenceable(self.core.get_xy_stage_device()):
-                    return False
-                if new_seq_length > self.core.get_xy_stage_sequence_max_length(self.core.get_xy_stage_device()):
-                    return False
-
-            if previous_event.get_camera_device_name() is None:
-                # Using the Core-Camera, the default
-
-                # camera exposure
-                if previous_event.get_exposure() is not None and next_event.get_exposure() is not None and \
-                        previous_event.get_exposure() != next_event.get_exposure() and \
-                        not self.core.is_exposure_sequenceable(self.core.get_camera_device()):
-                    return False
-                if self.core.is_exposure_sequenceable(self.core.get_camera_device()) and \
-                        new_seq_length > self.core.get_exposure_sequence_max_length(self.core.get_camera_device()):
-                    return False
-
-            # If there is a nonzero delay between events, then its not sequencable
-            if previous_event.get_t_index() is not None and next_event.get_t_index() is not None and \
-                    previous_event.get_t_index() != next_event.get_t_index():
-                if previous_event.get_minimum_start_time_absolute() is not None and \
-                        next_event.get_minimum_start_time_absolute() is not None and \
-                        previous_event.get_minimum_start_time_absolute() != next_event.get_minimum_start_time_absolute():
-                    return False
-
-            return True
+            return self.sequence_planner.is_sequencable(previous_events, next_event, new_seq_length)
         except Exception as ex:
             raise RuntimeError(ex)
 
+    def plan_sequences(self, events):
+        """
+        Dry run of how the given AcquisitionEvents would be split into hardware sequences.
+        See SequencePlanner.plan
+        """
+        return self.sequence_planner.plan(events)
+
     def merge_sequence_event(self, event_list):
         if len(event_list) == 1:
             return event_list[0]
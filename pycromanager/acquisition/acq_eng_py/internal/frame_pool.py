@@ -0,0 +1,131 @@
+import threading
+import time
+
+import numpy as np
+
+
+class FramePool:
+    """
+    A fixed number of preallocated pixel buffers that images are copied into as they come out of the core,
+    and that are passed by reference to the image processors and the data sink. A buffer is returned to the
+    pool once the data sink has written it (or a processor has dropped or replaced it), and taking a buffer
+    blocks while all of them are in use, so the memory held by images waiting to be processed or saved is
+    bounded by the size of the pool.
+
+    Buffers are allocated the first time an image of a given shape and data type arrives. Free buffers of
+    another shape are discarded to make room if the image size changes. An image sent to several branches of
+    a processor graph is passed to each of them as a view of its buffer, and the buffer is returned to the
+    pool once each view has been released
+    """
+
+    # How often a blocked lease checks whether the acquisition was aborted
+    ABORT_CHECK_INTERVAL_S = 0.05
+
+    def __init__(self, size):
+        if size < 1:
+            raise ValueError("Frame pool size must be at least 1")
+        self.size = size
+        self._condition = threading.Condition()
+        # (shape, dtype) -> list of free buffers
+        self._free = {}
+        # id of each buffer currently in use -> buffer
+        self._leased = {}
+        # id of each buffer in use -> number of releases still needed before it is free
+        self._references = {}
+        self._num_allocated = 0
+        self.allocations = 0
+        self.leases = 0
+        self.blocked_time_s = 0.0
+
+    def lease(self, pix, abort_event=None):
+        """
+        Copy pix into a buffer from the pool and return the buffer. Blocks until a buffer is free. If
+        abort_event is set while waiting, pix is returned as is
+        """
+        key = (pix.shape, pix.dtype)
+        with self._condition:
+            blocked_since = None
+            while True:
+                buffer = self._take(key)
+                if buffer is not None:
+                    break
+                if abort_event is not None and abort_event.is_set():
+                    return pix
+                if blocked_since is None:
+                    blocked_since = time.perf_counter()
+                self._condition.wait(self.ABORT_CHECK_INTERVAL_S)
+            if blocked_since is not None:
+                self.blocked_time_s += time.perf_counter() - blocked_since
+            self._leased[id(buffer)] = buffer
+            self._references[id(buffer)] = 1
+            self.leases += 1
+        np.copyto(buffer, pix)
+        return buffer
+
+    def retain(self, pix, count=1):
+        """
+        Require count more releases of a buffer (or of views of it) before it is returned to the pool. Returns
+        False (and does nothing) if pix is not one of the pool's buffers
+        """
+        with self._condition:
+            buffer = self._find(pix)
+            if buffer is None:
+                return False
+            self._references[id(buffer)] += count
+            return True
+
+    def release(self, pix):
+        """
+        Return a buffer to the pool, given the buffer or a view of it. Returns False (and does nothing) if pix
+        is not one of the pool's buffers
+        """
+        with self._condition:
+            buffer = self._find(pix)
+            if buffer is None:
+                return False
+            self._references[id(buffer)] -= 1
+            if self._references[id(buffer)] > 0:
+                return True
+            del self._leased[id(buffer)]
+            del self._references[id(buffer)]
+            self._free.setdefault((buffer.shape, buffer.dtype), []).append(buffer)
+            self._condition.notify()
+            return True
+
+    def is_leased(self, pix):
+        with self._condition:
+            return self._find(pix) is not None
+
+    def get_counters(self):
+        """
+        Return a dict with the number of buffers allocated ('allocations'), the number of images copied into
+        the pool ('leases'), the number of buffers in use ('in_use') and the time spent waiting for a free
+        buffer ('blocked_time_s')
+        """
+        with self._condition:
+            return {'allocations': self.allocations, 'leases': self.leases, 'in_use': len(self._leased),
+                    'blocked_time_s': self.blocked_time_s}
+
+    def _find(self, pix):
+        # Buffers in use are referenced from _leased, so no other object can share their id
+        for candidate in (pix, getattr(pix, 'base', None)):
+            if candidate is not None and self._leased.get(id(candidate)) is candidate:
+                return candidate
+        return None
+
+    def _take(self, key):
+        free = self._free.get(key)
+        if free:
+            return free.pop()
+        if self._num_allocated >= self.size:
+            # Make room by discarding a free buffer of a different shape
+            for other_key, other_free in self._free.items():
+                if other_free:
+                    other_free.pop()
+                    self._num_allocated -= 1
+                    break
+            else:
+                return None
+        self._num_allocated += 1
+        self.allocations += 1
+        return np.empty(key[0], dtype=key[1])
@@ -0,0 +1,110 @@
+import threading
+
+# Stage positions (in um) that differ by less than this are the same, as devices may report a position
+# rounded to their resolution after they were commanded to move
+POSITION_TOLERANCE_UM = 0.01
+
+
+class HardwareState:
+    """
+    Shadow of the state the hardware was last put in, so that commands that wouldn't change anything (e.g.
+    setting the config preset that is already set, or moving a stage to where it already is) can be skipped,
+    across events and across acquisitions. Entries are keyed by what they describe:
+
+    - ('xy', xy stage) -> (x, y)
+    - ('stage', stage device) -> position, including the focus device
+    - ('config', group) -> preset
+    - ('exposure', camera) -> exposure
+    - ('property', device, property) -> value
+
+    Entries are recorded when the engine sends a command, and kept up to date from the core's callbacks, so
+    that changes made outside the engine are seen. Positions are compared within POSITION_TOLERANCE_UM.
+    Devices that don't report their changes to the core can't be tracked this way, so the state is also
+    forgotten after hooks that declare they change such devices, when a device runs a hardware sequence or
+    when a command fails, and it can be forgotten explicitly with invalidate
+    """
+
+    def __init__(self, capabilities):
+        self.capabilities = capabilities
+        self._lock = threading.Lock()
+        self._state = {}
+        # Number of commands that were skipped because the hardware was already in the requested state
+        self.skipped = 0
+
+    def is_current(self, key, value):
+        """
+        Check whether the hardware is known to be in a state already, counting the command that is skipped
+        """
+        with self._lock:
+            if key in self._state and self._matches(key, self._state[key], value):
+                self.skipped += 1
+                return True
+            return False
+
+    @staticmethod
+    def _matches(key, current, value):
+        if key[0] == 'stage':
+            return value is not None and current is not None and abs(current - value) < POSITION_TOLERANCE_UM
+        if key[0] == 'xy':
+            return all(v is not None and c is not None and abs(c - v) < POSITION_TOLERANCE_UM
+                       for c, v in zip(current, value))
+        return current == value
+
+    def set(self, key, value):
+        with self._lock:
+            self._state[key] = value
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._state.clear()
+            else:
+                self._state.pop(key, None)
+
+    def invalidate_property(self, device_name, prop_name):
+        """
+        Forget the value of a property, and of any config group whose preset sets it
+        """
+        with self._lock:
+            self._state.pop(('property', device_name, prop_name), None)
+            configs = [(key[1], preset) for key, preset in self._state.items() if key[0] == 'config']
+        for group, preset in configs:
+            if (device_name, prop_name) in self.capabilities.get_config_settings(group, preset):
+                self.invalidate(('config', group))
+
+    def get_skipped_count(self):
+        with self._lock:
+            return self.skipped
+
+    ########  Core callbacks ###########
+
+    def onSystemConfigurationLoaded(self):
+        self.invalidate()
+
+    def onPropertiesChanged(self):
+        self.invalidate()
+
+    def onPropertyChanged(self, device_name, prop_name, prop_value):
+        with self._lock:
+            self._state[('property', device_name, prop_name)] = prop_value
+            configs = [(key[1], preset) for key, preset in self._state.items() if key[0] == 'config']
+        # A config group stays in its preset as long as the property has the value the preset gives it
+        for group, preset in configs:
+            settings = self.capabilities.get_config_settings(group, preset)
+            if (device_name, prop_name) in settings and settings[(device_name, prop_name)] != prop_value:
+                self.invalidate(('config', group))
+
+    def onConfigGroupChanged(self, group_name, new_config_name):
+        if new_config_name:
+            self.set(('config', group_name), new_config_name)
+        else:
+            self.invalidate(('config', group_name))
+
+    def onStagePositionChanged(self, device_name, pos):
+        self.set(('stage', device_name), pos)
+
+    def onXYStagePositionChanged(self, device_name, x_pos, y_pos):
+        self.set(('xy', device_name), (x_pos, y_pos))
+
+    def onExposureChanged(self, device_name, new_exposure):
+        self.set(('exposure', device_name), new_exposure)
@@ -0,0 +1,121 @@
+import queue
+import threading
+import time
+
+
+def image_nbytes(image):
+    pix = image.pix
+    return getattr(pix, 'nbytes', 0) if pix is not None else 0
+
+
+class ImageMemoryBudget:
+    """
+    Maximum number of bytes of pixels held by all the image queues of an acquisition (between the core, the
+    image processors and the data sinks), so that the queues hold many small images (e.g. from a small ROI at
+    a high frame rate) but few large ones. Putting an image waits while the budget is used up, unless the queue
+    it goes to is empty: otherwise the queues before a processor could fill the budget and leave no room for
+    its output, which would stop the images flowing. The budget can therefore be exceeded by at most one image
+    per queue
+    """
+
+    def __init__(self, max_bytes):
+        if max_bytes <= 0:
+            raise ValueError("Image queue memory budget must be positive")
+        self.max_bytes = max_bytes
+        self._condition = threading.Condition()
+        self.bytes_in_flight = 0
+        self.peak_bytes_in_flight = 0
+
+    def reserve(self, nbytes, target_queue, block=True, timeout=None):
+        """
+        Wait until nbytes fit in the budget (or target_queue is empty) and count them. Returns False if they
+        don't fit within the timeout, or straight away if block is False
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # The queue's size is read without its lock, which could otherwise be taken in the opposite order
+            while self.bytes_in_flight + nbytes > self.max_bytes and target_queue._qsize() > 0:
+                if not block:
+                    return False
+                remaining_s = None if deadline is None else deadline - time.monotonic()
+                if remaining_s is not None and remaining_s <= 0:
+                    return False
+                self._condition.wait(remaining_s)
+            self.bytes_in_flight += nbytes
+            self.peak_bytes_in_flight = max(self.peak_bytes_in_flight, self.bytes_in_flight)
+            return True
+
+    def release(self, nbytes):
+        with self._condition:
+            self.bytes_in_flight -= nbytes
+            self._condition.notify_all()
+
+    def get_bytes_in_flight(self):
+        with self._condition:
+            return self.bytes_in_flight
+
+
+class ImageQueue(queue.Queue):
+    """
+    Queue of TaggedImages between two stages of an acquisition's image pipeline. It is bounded either by a
+    number of images, or (when it has a budget) by the bytes of pixels held by all of the acquisition's image
+    queues together. Keeps track of the images and bytes it holds and of the time spent waiting to put images
+    """
+
+    def __init__(self, maxsize=0, budget=None):
+        super().__init__(maxsize=maxsize)
+        self.budget = budget
+        self.bytes = 0
+        self.last_image_nbytes = 0
+        self.blocked_put_time_s = 0.0
+
+    def put(self, image, block=True, timeout=None):
+        nbytes = image_nbytes(image) if self.budget is not None else 0
+        start = time.perf_counter() if self.full() else None
+        if nbytes and not self.budget.reserve(nbytes, self, block=False):
+            if start is None:
+                start = time.perf_counter()
+            if not block or not self.budget.reserve(nbytes, self, timeout=timeout):
+                self._add_blocked_time(start)
+                raise queue.Full
+        try:
+            super().put(image, block, timeout)
+        except queue.Full:
+            if nbytes:
+                self.budget.release(nbytes)
+            raise
+        finally:
+            if start is not None:
+                self._add_blocked_time(start)
+
+    def get(self, block=True, timeout=None):
+        image = super().get(block, timeout)
+        if self.budget is not None:
+            nbytes = image_nbytes(image)
+            if nbytes:
+                self.budget.release(nbytes)
+        return image
+
+    def get_metrics(self):
+        """
+        Return a dict with the number of images in the queue ('depth'), the bytes of their pixels ('bytes') and
+        the total time spent waiting to put images ('blocked_put_time_s')
+        """
+        with self.mutex:
+            return {'depth': self._qsize(), 'bytes': self.bytes, 'blocked_put_time_s': self.blocked_put_time_s}
+
+    def _put(self, image):
+        super()._put(image)
+        nbytes = image_nbytes(image)
+        self.bytes += nbytes
+        if nbytes:
+            self.last_image_nbytes = nbytes
+
+    def _get(self):
+        image = super()._get()
+        self.bytes -= image_nbytes(image)
+        return image
+
+    def _add_blocked_time(self, start):
+        with self.mutex:
+            self.blocked_put_time_s += time.perf_counter() - start
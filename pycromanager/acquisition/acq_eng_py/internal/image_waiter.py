@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+class ImageWaiter:
+    """
+    Decides how long the engine sleeps while waiting for images, instead of polling the core continuously.
+    The wait before looking again starts at a fraction of the observed time between images, and doubles each
+    time nothing has arrived, up to a maximum. The core has no callback for each image of a sequence, so this
+    is driven by the rate at which images have been arriving.
+
+    Counters of the CPU and wall clock time spent waiting, and of the number of polls, are kept so that this
+    can be compared with busy polling (busy_poll = True)
+    """
+
+    MIN_WAIT_S = 0.00005
+    MAX_WAIT_S = 0.005
+    # Fraction of the expected time between images to wait before looking again
+    FIRST_WAIT_FRACTION = 0.25
+
+    def __init__(self, busy_poll=False):
+        self.busy_poll = busy_poll
+        self._lock = threading.Lock()
+        self._next_wait_s = self.MIN_WAIT_S
+        self._image_interval_s = None
+        self._last_image_time = None
+        self._wait_start = None
+        self.polls = 0
+        self.wait_cpu_time_s = 0.0
+        self.wait_wall_time_s = 0.0
+
+    def start_sequence(self, expected_interval_ms=None):
+        """
+        Called before images start arriving. expected_interval_ms is the expected time between images (e.g. the
+        exposure time), used until the actual rate is known
+        """
+        self._image_interval_s = None if not expected_interval_ms else expected_interval_ms / 1000
+        self._last_image_time = None
+        self._reset_wait()
+
+    def wait(self):
+        """
+        Called each time the core has no image yet
+        """
+        if self._wait_start is None:
+            self._wait_start = (time.perf_counter(), time.thread_time())
+        with self._lock:
+            self.polls += 1
+        if self.busy_poll:
+            return
+        time.sleep(self._next_wait_s)
+        self._next_wait_s = min(self._next_wait_s * 2, self.MAX_WAIT_S)
+
+    def image_arrived(self):
+        now = time.perf_counter()
+        if self._wait_start is not None:
+            wall_start, cpu_start = self._wait_start
+            with self._lock:
+                self.wait_wall_time_s += now - wall_start
+                self.wait_cpu_time_s += time.thread_time() - cpu_start
+            self._wait_start = None
+        if self._last_image_time is not None:
+            interval = now - self._last_image_time
+            # Smooth over jitter in when images are taken out of the buffer
+            self._image_interval_s = interval if self._image_interval_s is None else \
+                0.8 * self._image_interval_s + 0.2 * interval
+        self._last_image_time = now
+        self._reset_wait()
+
+    def _reset_wait(self):
+        if self._image_interval_s is None:
+            self._next_wait_s = self.MIN_WAIT_S
+        else:
+            self._next_wait_s = min(max(self._image_interval_s * self.FIRST_WAIT_FRACTION, self.MIN_WAIT_S),
+                                    self.MAX_WAIT_S)
+
+    def get_counters(self):
+        """
+        Return a dict with the number of times the core was polled for an image ('polls'), and the CPU time
+        ('wait_cpu_time_s') and wall clock time ('wait_wall_time_s') the engine spent waiting for images
+        """
+        with self._lock:
+            return {'polls': self.polls, 'wait_cpu_time_s': self.wait_cpu_time_s,
+                    'wait_wall_time_s': self.wait_wall_time_s}
+
+    def reset_counters(self):
+        with self._lock:
+            self.polls = 0
+            self.wait_cpu_time_s = 0.0
+            self.wait_wall_time_s = 0.0
@@ -0,0 +1,56 @@
+import threading
+
+
+class LoadedSequences:
+    """
+    Keeps track of the sequence each device currently holds, so that uploading the same sequence again (e.g. the
+    same z-stack at every time point) can be skipped. Sequences are identified by a key naming the device (and
+    property), and compared by their values. The hits and misses attributes count skipped and performed uploads.
+
+    Everything is forgotten when an acquisition starts and when the core reports a change to its configuration,
+    since devices may lose their sequences when they are reinitialized
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = {}
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, key, values, load_fn):
+        """
+        Call load_fn to upload a sequence of values, unless the device identified by key already holds it
+        """
+        values = tuple(values)
+        with self._lock:
+            if self._loaded.get(key) == values:
+                self.hits += 1
+                return
+            # Whatever the device held before is unknown if the upload fails
+            self._loaded.pop(key, None)
+        load_fn()
+        with self._lock:
+            self._loaded[key] = values
+            self.misses += 1
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._loaded.clear()
+            else:
+                self._loaded.pop(key, None)
+
+    def get_counts(self):
+        """
+        Return a dict with the number of uploads that were skipped ('hits') and performed ('misses')
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses}
+
+    ########  Core callbacks ###########
+
+    def onSystemConfigurationLoaded(self):
+        self.invalidate()
+
+    def onPropertiesChanged(self):
+        self.invalidate()
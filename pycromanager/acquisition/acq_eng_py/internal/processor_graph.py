@@ -0,0 +1,84 @@
+import copy
+import queue
+import threading
+
+from pycromanager.acquisition.acq_eng_py.internal.image_queue import ImageQueue
+
+
+def is_end_of_images(image):
+    return image.tags is None and image.pix is None
+
+
+class NodeInputQueue(ImageQueue):
+    """
+    Input queue of a node of an acquisition's processor graph. A node with several inputs is sent the end of
+    the images (a TaggedImage with no tags and pixels) by each of them, and only the last one is passed on, so
+    that the node ends once all of its inputs have. If drop_when_full is True, images put while the queue is
+    full are dropped rather than waiting, so that a slow branch of the graph doesn't hold up the others. The
+    end of the images is never dropped
+    """
+
+    def __init__(self, maxsize, num_inputs, drop_when_full=False, release_frame=None, budget=None):
+        super().__init__(maxsize, budget)
+        self.drop_when_full = drop_when_full
+        self._inputs_remaining = num_inputs
+        self._release_frame = release_frame
+        # Number of images dropped because the queue was full
+        self.dropped = 0
+
+    def put(self, image, block=True, timeout=None):
+        if is_end_of_images(image):
+            with self.mutex:
+                self._inputs_remaining -= 1
+                if self._inputs_remaining > 0:
+                    return
+            super().put(image, block, timeout)
+        elif self.drop_when_full:
+            try:
+                super().put(image, block=False)
+            except queue.Full:
+                with self.mutex:
+                    self.dropped += 1
+                if self._release_frame is not None:
+                    self._release_frame(image.pix)
+        else:
+            super().put(image, block, timeout)
+
+
+class FanOut:
+    """
+    Output of a node of an acquisition's processor graph (or of the camera), which passes each image on to
+    the input queues of all the nodes that read from it. Images sent to more than one node share their
+    pixels, as read-only views so that no node can change them under another, and each node is given its own
+    copy of the metadata. Images of a node that no other node reads from are discarded
+    """
+
+    def __init__(self, retain_frame=None, release_frame=None):
+        self.consumers = []
+        self._retain_frame = retain_frame
+        self._release_frame = release_frame
+        # Set once the end of the images has been passed on
+        self.finished = threading.Event()
+
+    def add_consumer(self, input_queue):
+        self.consumers.append(input_queue)
+
+    def put(self, image, block=True, timeout=None):
+        if is_end_of_images(image):
+            for consumer in self.consumers:
+                consumer.put(image)
+            self.finished.set()
+            return
+        if len(self.consumers) == 1:
+            self.consumers[0].put(image)
+            return
+        if not self.consumers:
+            if self._release_frame is not None:
+                self._release_frame(image.pix)
+            return
+        if self._retain_frame is not None:
+            self._retain_frame(image.pix, len(self.consumers) - 1)
+        for consumer in self.consumers:
+            pix = image.pix.view()
+            pix.flags.writeable = False
+            consumer.put(type(image)(copy.deepcopy(image.tags), pix))
@@ -0,0 +1,307 @@
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+
+# Maximum number of events in a hardware sequence, as the events are held back while it is built up. A
+# sequence that reaches this length is executed, and the following events start a new one
+DEFAULT_MAX_SEQUENCE_LENGTH = 10000
+# Minimum start times are stored in whole ms, so evenly spaced time points can be off by this much
+INTERVAL_TOLERANCE_MS = 1
+
+
+class _SequenceState:
+    """
+    Values taken on by each part of the hardware over the events of a sequence that is being built up, so that
+    a new event can be checked against the whole sequence without going back over all of its events
+    """
+
+    def __init__(self, first_event, config_settings):
+        self.events = [first_event]
+        self.z_positions = {first_event.get_z_position()} - {None}
+        self.x_positions = {first_event.get_x_position()} - {None}
+        self.y_positions = {first_event.get_y_position()} - {None}
+        self.exposures = {first_event.get_exposure()} - {None}
+        self.config_presets = {first_event.get_config_preset()} - {None}
+        self.stage_positions = {stage_device: {first_event.get_stage_single_axis_stage_position(stage_device)}
+                                for stage_device in first_event.get_stage_device_names()}
+        self.first_config_settings = config_settings
+        # Time between images when the time points of a sequence are timed by the camera
+        self.interval_ms = None
+        # (device, property) of config group settings that differ between the presets in the sequence
+        self.varying_properties = set()
+
+    def __len__(self):
+        return len(self.events)
+
+
+class SequencePlanner:
+    """
+    Partitions a stream of acquisition events into the longest runs that the hardware can execute as sequences.
+    Each new event is checked against the whole sequence being built up: every device that would take on more
+    than one value must be sequenceable, with a maximum sequence length covering the full sequence. Events
+    that wait for a different start time, have a different timeout or set different additional properties are
+    not merged.
+
+    Events are added one at a time. A sequence is returned once an event that can't be added to it arrives (or
+    reaches max_sequence_length), and that event then starts the next sequence
+    """
+
+    def __init__(self, capabilities, max_sequence_length=DEFAULT_MAX_SEQUENCE_LENGTH):
+        self.capabilities = capabilities
+        self.max_sequence_length = max_sequence_length
+        self._state = None
+        self.last_break_reason = None
+
+    def clear(self):
+        self._state = None
+
+    def get_pending_events(self):
+        """
+        The events of the sequence currently being built up
+        """
+        return [] if self._state is None else list(self._state.events)
+
+    def add(self, event):
+        """
+        Add an event to the plan. Returns the events of the sequence that was completed by it, or None if the
+        event was merged into the current sequence
+        """
+        if self._state is None:
+            self._state = self._new_state(event)
+            return None
+        self.last_break_reason = self.sequencing_conflict(self._state, event)
+        if self.last_break_reason is None:
+            self._merge(self._state, event)
+            return None
+        completed = self._state.events
+        self._state = self._new_state(event)
+        return completed
+
+    def flush(self):
+        """
+        Return the events of the sequence currently being built up (or None), and start over
+        """
+        if self._state is None:
+            return None
+        completed = self._state.events
+        self._state = None
+        self.last_break_reason = None
+        return completed
+
+    def is_sequencable(self, previous_events, next_event, new_seq_length=None):
+        """
+        Whether next_event can be added to the sequence of previous_events. The maximum sequence lengths of the
+        devices are checked against new_seq_length, by default the length of the sequence with next_event
+        """
+        state = self._new_state(previous_events[0])
+        for event in previous_events[1:]:
+            self._merge(state, event)
+        return self.sequencing_conflict(state, next_event, new_seq_length) is None
+
+    def plan(self, events):
+        """
+        Dry run of how a list of events would be split into hardware sequences. Nothing is sent to the hardware.
+
+        Returns a list with one dict per sequence, giving the index of its first event, its number of events,
+        the parts of the hardware that would be sequenced, and the reason the following event could not be added
+        to it (None for the last sequence)
+        """
+        planner = SequencePlanner(self.capabilities, self.max_sequence_length)
+        report = []
+        index = 0
+
+        def add_to_report(sequence_events, break_reason):
+            nonlocal index
+            report.append({'first_event_index': index, 'num_events': len(sequence_events),
+                           'sequenced': self.sequenced_hardware(sequence_events), 'break_reason': break_reason})
+            index += len(sequence_events)
+
+        for event in events:
+            completed = planner.add(event)
+            if completed is not None:
+                add_to_report(completed, planner.last_break_reason)
+        remaining = planner.flush()
+        if remaining is not None:
+            add_to_report(remaining, None)
+        return report
+
+    def sequenced_hardware(self, events):
+        """
+        The names of the parts of the hardware that would be run as a sequence to execute the given events
+        """
+        if len(events) < 2:
+            return []
+        merged = AcquisitionEvent(events[0].acquisition_, events)
+        sequenced = []
+        if merged.is_z_sequenced():
+            sequenced.append('z')
+        if merged.is_xy_sequenced():
+            sequenced.append('xy')
+        if merged.is_exposure_sequenced():
+            sequenced.append('exposure')
+        if merged.is_config_group_sequenced():
+            sequenced.append('config group ' + str(events[0].get_config_group()))
+        sequenced.extend(sorted(merged.get_sequenced_stage_device_names()))
+        if merged.get_sequence_interval_ms():
+            sequenced.append('camera interval')
+        return sequenced
+
+    def sequencing_conflict(self, state, event, length=None):
+        """
+        Return a description of why an event can't be added to a sequence, or None if it can. length is the
+        length of the sequence with the event, if it is to be checked for a longer sequence than that
+        """
+        if event.is_acquisition_sequence_end_event() or event.is_acquisition_finished_event():
+            return 'end of events'
+        if length is None:
+            length = len(state) + 1
+        if length > self.max_sequence_length:
+            return 'maximum sequence length of {} events reached'.format(self.max_sequence_length)
+        first_event = state.events[0]
+        if event.acquisition_ is not first_event.acquisition_:
+            return 'event belongs to a different acquisition'
+        capabilities = self.capabilities
+
+        # Config group
+        if event.get_config_preset() is not None and state.config_presets:
+            if event.get_config_group() != first_event.get_config_group():
+                return 'config group changes from {} to {}'.format(first_event.get_config_group(),
+                                                                   event.get_config_group())
+            settings = capabilities.get_config_settings(event.get_config_group(), event.get_config_preset())
+            if set(settings) != set(state.first_config_settings):
+                return 'preset {} of config group {} sets different properties than the presets before it'.format(
+                    event.get_config_preset(), event.get_config_group())
+            varying_properties = state.varying_properties | self._changed_properties(state, event)
+            for device_name, prop_name in varying_properties:
+                if not capabilities.is_property_sequenceable(device_name, prop_name):
+                    return 'property {}-{} is not sequenceable'.format(device_name, prop_name)
+                max_length = capabilities.get_property_sequence_max_length(device_name, prop_name)
+                if max_length < length:
+                    return 'property {}-{} has a maximum sequence length of {}'.format(
+                        device_name, prop_name, max_length)
+
+        # Other single axis stage devices
+        if event.get_stage_device_names() != first_event.get_stage_device_names():
+            return 'stage devices change from {} to {}'.format(sorted(first_event.get_stage_device_names()),
+                                                               sorted(event.get_stage_device_names()))
+        for stage_device, positions in state.stage_positions.items():
+            if self._varies(positions, event.get_stage_single_axis_stage_position(stage_device)):
+                if not capabilities.is_stage_sequenceable(stage_device):
+                    return 'stage {} is not sequenceable'.format(stage_device)
+                max_length = capabilities.get_stage_sequence_max_length(stage_device)
+                if max_length < length:
+                    return 'stage {} has a maximum sequence length of {}'.format(stage_device, max_length)
+
+        # Z stage
+        if self._varies(state.z_positions, event.get_z_position()):
+            z_stage = capabilities.get_focus_device()
+            if not capabilities.is_stage_sequenceable(z_stage):
+                return 'z stage {} is not sequenceable'.format(z_stage)
+            max_length = capabilities.get_stage_sequence_max_length(z_stage)
+            if max_length < length:
+                return 'z stage {} has a maximum sequence length of {}'.format(z_stage, max_length)
+
+        # XY stage
+        if self._varies(state.x_positions, event.get_x_position()) or \
+                self._varies(state.y_positions, event.get_y_position()):
+            xy_stage = capabilities.get_xy_stage_device()
+            if not capabilities.is_xy_stage_sequenceable(xy_stage):
+                return 'xy stage {} is not sequenceable'.format(xy_stage)
+            max_length = capabilities.get_xy_stage_sequence_max_length(xy_stage)
+            if max_length < length:
+                return 'xy stage {} has a maximum sequence length of {}'.format(xy_stage, max_length)
+
+        # Camera exposure, when using the Core-Camera
+        if first_event.get_camera_device_name() is None and self._varies(state.exposures, event.get_exposure()):
+            camera = capabilities.get_camera_device()
+            if not capabilities.is_exposure_sequenceable(camera):
+                return 'exposure of camera {} is not sequenceable'.format(camera)
+            max_length = capabilities.get_exposure_sequence_max_length(camera)
+            if max_length < length:
+                return 'exposure of camera {} has a maximum sequence length of {}'.format(camera, max_length)
+
+        # A sequence can't wait between its images, unless they are evenly spaced time points that the
+        # camera can time itself
+        if first_event.get_t_index() is not None and event.get_t_index() is not None and \
+                first_event.get_t_index() != event.get_t_index() and \
+                first_event.get_minimum_start_time_absolute() is not None and \
+                event.get_minimum_start_time_absolute() is not None and \
+                first_event.get_minimum_start_time_absolute() != event.get_minimum_start_time_absolute():
+            if not first_event.acquisition_.is_camera_timed_intervals():
+                return 'minimum start time changes'
+            conflict = self._interval_conflict(state, event)
+            if conflict is not None:
+                return conflict
+        elif state.interval_ms is not None:
+            return 'time points of the sequence are timed by the camera'
+
+        if event.get_timeout_ms() != first_event.get_timeout_ms():
+            return 'timeout changes'
+
+        if set(event.get_additional_properties()) != set(first_event.get_additional_properties()):
+            return 'additional properties change'
+
+        return None
+
+    def _interval_conflict(self, state, event):
+        """
+        Check whether an event can be added to a sequence whose images are spaced by the camera's interval
+        """
+        last_event = state.events[-1]
+        if (state.interval_ms is None and len(state) > 1) or last_event.get_t_index() == event.get_t_index() or \
+                last_event.get_minimum_start_time_absolute() is None:
+            return 'time points of a camera-timed sequence must each have one image'
+        hardware_changes = [self._varies(state.z_positions, event.get_z_position()),
+                            self._varies(state.x_positions, event.get_x_position()),
+                            self._varies(state.y_positions, event.get_y_position()),
+                            self._varies(state.exposures, event.get_exposure()),
+                            self._varies(state.config_presets, event.get_config_preset())]
+        hardware_changes += [self._varies(positions, event.get_stage_single_axis_stage_position(stage_device))
+                             for stage_device, positions in state.stage_positions.items()]
+        if any(hardware_changes):
+            return 'hardware changes between time points, so they cannot be timed by the camera'
+        interval_ms = event.get_minimum_start_time_absolute() - last_event.get_minimum_start_time_absolute()
+        if interval_ms <= 0:
+            return 'minimum start time goes backwards'
+        if state.interval_ms is not None and abs(interval_ms - state.interval_ms) > INTERVAL_TOLERANCE_MS:
+            return 'time points are not evenly spaced'
+        return None
+
+    @staticmethod
+    def _varies(values, new_value):
+        return len(values) > 1 or (new_value is not None and bool(values) and new_value not in values)
+
+    def _new_state(self, event):
+        config_settings = None
+        if event.get_config_preset() is not None:
+            config_settings = self.capabilities.get_config_settings(event.get_config_group(),
+                                                                    event.get_config_preset())
+        return _SequenceState(event, config_settings)
+
+    def _changed_properties(self, state, event):
+        if event.get_config_preset() in state.config_presets:
+            return set()
+        settings = self.capabilities.get_config_settings(event.get_config_group(), event.get_config_preset())
+        first_settings = state.first_config_settings
+        return {key for key in set(settings) | set(first_settings) if settings.get(key) != first_settings.get(key)}
+
+    def _merge(self, state, event):
+        last_event = state.events[-1]
+        if state.interval_ms is None and len(state) == 1 and last_event.get_minimum_start_time_absolute() is not None \
+                and event.get_minimum_start_time_absolute() is not None and \
+                last_event.get_minimum_start_time_absolute() != event.get_minimum_start_time_absolute() and \
+                last_event.get_t_index() != event.get_t_index():
+            state.interval_ms = event.get_minimum_start_time_absolute() - last_event.get_minimum_start_time_absolute()
+        if event.get_config_preset() is not None:
+            if state.first_config_settings is None:
+                state.first_config_settings = self.capabilities.get_config_settings(
+                    event.get_config_group(), event.get_config_preset())
+            state.varying_properties |= self._changed_properties(state, event)
+            state.config_presets.add(event.get_config_preset())
+        state.events.append(event)
+        for values, value in ((state.z_positions, event.get_z_position()),
+                              (state.x_positions, event.get_x_position()),
+                              (state.y_positions, event.get_y_position()),
+                              (state.exposures, event.get_exposure())):
+            if value is not None:
+                values.add(value)
+        for stage_device, positions in state.stage_positions.items():
+            positions.add(event.get_stage_single_axis_stage_position(stage_device))
@@ -1,12 +1,14 @@
-import json
-import queue
 import traceback
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 from pycromanager.acquisition.acq_eng_py.main.acq_eng_metadata import AcqEngMetadata
-from pycromanager.acquisition.acq_eng_py.internal.engine import Engine
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine, HOOK_BARRIERS
+from pycromanager.acquisition.acq_eng_py.internal.frame_pool import FramePool
 from pycromanager.acquisition.acq_eng_py.main.acq_notification import AcqNotification
 from pycromanager.acquisition.acq_eng_py.internal.notification_handler import NotificationHandler
+from pycromanager.acquisition.acq_eng_py.internal.processor_graph import NodeInputQueue, FanOut, is_end_of_images
+from pycromanager.acquisition.acq_eng_py.internal.image_queue import ImageQueue, ImageMemoryBudget
 
 
 class Acquisition():
@@ -28,14 +30,24 @@ class Acquisition():
     # and availability of the images in memory).
     AFTER_EXPOSURE_HOOK = 5
 
+    # Points at which the engine waits for a hook running asynchronously: 'hardware', 'z_drive', 'camera',
+    # 'event_end' or 'acquisition_end'
+    HOOK_BARRIERS = HOOK_BARRIERS
+
+    # Number of images each image queue holds, unless the queues have a memory budget
     IMAGE_QUEUE_SIZE = 30
 
-    def __init__(self, sink, summary_metadata_processor=None, initialize=True):
+    # Name of the node of the processor graph that images come out of the core from
+    CAMERA_NODE = 'camera'
+
+    def __init__(self, sink, summary_metadata_processor=None, initialize=True, engine=None):
         self.xy_stage_ = None
         self.events_finished_ = threading.Event()
         self.abort_requested_ = threading.Event()
         self.start_time_ms_ = -1
         self.paused_ = False
+        self.unpaused_ = threading.Event()
+        self.unpaused_.set()
         self.event_generation_hooks_ = []
         self.before_hardware_hooks_ = []
         self.before_z_hooks_ = []
@@ -43,14 +55,43 @@ class Acquisition():
         self.after_camera_hooks_ = []
         self.after_exposure_hooks_ = []
         self.image_processors_ = []
-        self.first_dequeue_ = queue.Queue(maxsize=self.IMAGE_QUEUE_SIZE)
+        self.image_queue_budget_ = None
+        self.first_dequeue_ = ImageQueue(self.IMAGE_QUEUE_SIZE)
         self.processor_output_queues_ = {}
+        # Where images from the core go: the first image processor or the data sink, and the processor graph
+        self.camera_output_ = self.first_dequeue_
+        # name of each node of the processor graph -> its output, or None for a sink
+        self.graph_outputs_ = {}
+        self.graph_input_queues_ = {}
+        self.graph_sinks_ = {}
+        self.graph_sink_threads_ = []
         self.debug_mode_ = False
+        self.pipelined_hardware_ = False
+        self.pipelining_conflict_devices_ = set()
+        self.concurrent_hardware_dispatch_ = False
+        self.device_dependencies_ = {}
+        self.settle_time_saved_ms_ = []
+        self.camera_timed_intervals_ = False
+        self.resend_hardware_ = False
+        self.frame_pool_ = None
+        self.priority_ = 0
+        self.max_events_per_second_ = None
+        self.priority_latencies_ms_ = []
+        self.core_round_trips_saved_ = 0
+        self.async_hook_workers_ = 1
+        self.async_hook_executor_ = None
+        self.async_hook_slots_ = None
+        self.pending_hook_futures_ = []
         self.abort_exception_ = None
         self.image_metadata_processor_ = None
         self.notification_handler_ = NotificationHandler()
         self.started_ = False
-        self.core_ = Engine.get_core()
+        # The engine of the core this acquisition runs on. If not given, the default engine is used
+        self.engine_ = engine if engine is not None else Engine.get_instance()
+        if self.engine_ is None:
+            raise RuntimeError("No acquisition engine has been created. Start the core with start_headless, "
+                               "or pass an engine")
+        self.core_ = self.engine_.core
         self.summary_metadata_processor_ = summary_metadata_processor
         self.data_sink_ = sink
         if initialize:
@@ -62,6 +103,9 @@ class Acquisition():
     def add_acq_notification_listener(self, post_notification_fn):
         self.notification_handler_.add_listener(post_notification_fn)
 
+    def get_engine(self):
+        return self.engine_
+
     def get_data_sink(self):
         return self.data_sink_
 
@@ -71,6 +115,183 @@ class Acquisition():
     def is_debug_mode(self):
         return self.debug_mode_
 
+    def set_pipelined_hardware(self, pipelined, conflicting_devices=None):
+        """
+        Allow the engine to start hardware changes for the next event while the images of the
+        current event are read out. Devices in conflicting_devices are never moved early.
+        """
+        if self.started_:
+            raise RuntimeError("Cannot change pipelining after acquisition started")
+        self.pipelined_hardware_ = pipelined
+        self.pipelining_conflict_devices_ = set(conflicting_devices) if conflicting_devices else set()
+
+    def is_pipelined_hardware(self):
+        return self.pipelined_hardware_
+
+    def get_pipelining_conflict_devices(self):
+        return self.pipelining_conflict_devices_
+
+    def set_concurrent_hardware_dispatch(self, concurrent, device_dependencies=None):
+        """
+        Issue the commands for all devices of an event before waiting for any of them, and then wait for
+        them together. device_dependencies maps a device name to the names of devices that must have
+        finished moving before it is commanded.
+        """
+        if self.started_:
+            raise RuntimeError("Cannot change hardware dispatch after acquisition started")
+        self.concurrent_hardware_dispatch_ = concurrent
+        self.device_dependencies_ = {device: list(prerequisites) for device, prerequisites in
+                                     (device_dependencies or {}).items()}
+
+    def is_concurrent_hardware_dispatch(self):
+        return self.concurrent_hardware_dispatch_
+
+    def get_device_dependencies(self, device_name):
+        return self.device_dependencies_.get(device_name, [])
+
+    def add_settle_time_saved_ms(self, saved_ms):
+        self.settle_time_saved_ms_.append(saved_ms)
+
+    def get_settle_time_saved_ms(self):
+        """
+        Time saved for each event by concurrent hardware dispatch, relative to waiting for each device in turn
+        """
+        return list(self.settle_time_saved_ms_)
+
+    def set_camera_timed_intervals(self, camera_timed):
+        """
+        Allow evenly spaced time points with no other hardware changes to be acquired as one camera
+        sequence, using the camera's interval between images instead of software timing
+        """
+        if self.started_:
+            raise RuntimeError("Cannot change interval timing after acquisition started")
+        self.camera_timed_intervals_ = camera_timed
+
+    def is_camera_timed_intervals(self):
+        return self.camera_timed_intervals_
+
+    def set_resend_hardware(self, resend):
+        """
+        Send every hardware command, even when the engine's record of the hardware state says the device
+        is already where the command would put it
+        """
+        self.resend_hardware_ = resend
+
+    def is_resend_hardware(self):
+        return self.resend_hardware_
+
+    def set_frame_pool(self, size):
+        """
+        Copy images into a pool of size preallocated buffers as they come out of the core, and pass these
+        buffers by reference to the image processors and data sink. A buffer is reused once the data sink has
+        written it, so the data sink must not keep a reference to the array it is given. The engine blocks
+        while all buffers are in use. None or 0 turns the pool off
+        """
+        if self.started_:
+            raise RuntimeError("Cannot change frame pool after acquisition started")
+        self.frame_pool_ = FramePool(size) if size else None
+
+    def get_frame_pool(self):
+        return self.frame_pool_
+
+    def retain_frame(self, pix, count=1):
+        """
+        Require count more calls to release_frame before the buffer holding an image is returned to the frame
+        pool, when the image is sent to several nodes of the processor graph
+        """
+        if self.frame_pool_ is not None and pix is not None:
+            self.frame_pool_.retain(pix, count)
+
+    def release_frame(self, pix):
+        """
+        Return the buffer holding an image to the frame pool, when an image processor drops the image or
+        replaces its pixels. Does nothing if pix does not come from the pool
+        """
+        if self.frame_pool_ is not None and pix is not None:
+            self.frame_pool_.release(pix)
+
+    def set_priority(self, priority):
+        """
+        When several acquisitions run on the same engine, the one with the highest priority whose next
+        hardware sequence is ready runs first. Can be changed while the acquisition runs
+        """
+        self.priority_ = priority
+
+    def get_priority(self):
+        return self.priority_
+
+    def set_max_events_per_second(self, max_events_per_second):
+        """
+        Limit the rate at which this acquisition's events are run, leaving time on the engine for other
+        acquisitions. None for no limit
+        """
+        self.max_events_per_second_ = max_events_per_second
+
+    def get_max_events_per_second(self):
+        return self.max_events_per_second_
+
+    def add_priority_latency_ms(self, latency_ms):
+        self.priority_latencies_ms_.append(latency_ms)
+
+    def get_priority_latencies_ms(self):
+        """
+        Time from the submission of each priority event until the engine started changing the hardware for it
+        """
+        return list(self.priority_latencies_ms_)
+
+    def add_core_round_trips_saved(self, count):
+        self.core_round_trips_saved_ += count
+
+    def get_core_round_trips_saved(self):
+        """
+        Number of calls to the core for device roles and image size that the engine answered from its cache
+        """
+        return self.core_round_trips_saved_
+
+    def set_async_hook_workers(self, num_workers):
+        """
+        Number of threads that run hooks asynchronously. At most twice as many hooks can be waiting or
+        running at once, after which starting another one blocks until one finishes
+        """
+        if self.started_:
+            raise RuntimeError("Cannot change async hook workers after acquisition started")
+        self.async_hook_workers_ = num_workers
+
+    def submit_async_hook(self, fn):
+        """
+        Run fn on the acquisition's bounded pool of hook threads, and return its Future
+        """
+        if self.async_hook_executor_ is None:
+            self.async_hook_executor_ = ThreadPoolExecutor(max_workers=self.async_hook_workers_,
+                                                           thread_name_prefix='Acq async hook')
+            self.async_hook_slots_ = threading.BoundedSemaphore(2 * self.async_hook_workers_)
+        self.async_hook_slots_.acquire()
+        try:
+            future = self.async_hook_executor_.submit(fn)
+        except Exception:
+            self.async_hook_slots_.release()
+            raise
+        future.add_done_callback(lambda f: self.async_hook_slots_.release())
+        return future
+
+    def add_pending_hook_future(self, future):
+        self.pending_hook_futures_.append(future)
+
+    def await_hook_futures(self):
+        """
+        Wait for the hooks that run asynchronously until the end of the acquisition, and shut down their
+        threads. A hook that failed is reported as the exception of the acquisition
+        """
+        pending, self.pending_hook_futures_ = self.pending_hook_futures_, []
+        for future in pending:
+            try:
+                future.result()
+            except Exception as ex:
+                traceback.print_exc()
+                self.abort_exception_ = ex
+        if self.async_hook_executor_ is not None:
+            self.async_hook_executor_.shutdown()
+
     def is_abort_requested(self):
         return self.abort_requested_.is_set()
 
@@ -82,7 +303,7 @@ class Acquisition():
         self.abort_requested_.set()
         if self.is_paused():
             self.set_paused(False)
-        Engine.get_instance().finish_acquisition(self)
+        self.engine_.finish_acquisition(self)
 
     def check_for_exceptions(self):
         if self.abort_exception_:
@@ -99,20 +320,19 @@ class Acquisition():
     def add_tags_to_tagged_image(self, tags, more_tags):
         if not more_tags:
             return
-        more_tags_object = json.loads(json.dumps(more_tags))
-        tags['AcqEngMetadata.TAGS'] = more_tags_object
+        tags['AcqEngMetadata.TAGS'] = AcqEngMetadata.tags_to_json(more_tags)
 
-    def submit_event_iterator(self, evt):
+    def submit_event_iterator(self, evt, priority=False):
         if not self.started_:
             self.start()
-        return Engine.get_instance().submit_event_iterator(evt)
+        return self.engine_.submit_event_iterator(evt, self, priority)
 
     def start_saving_thread(self):
         def saving_thread(acq):
             try:
                 while True:
                     if acq.debug_mode_:
-                        acq.core_.log_message(f"Image queue size: {len(acq.first_dequeue_)}")
+                        acq.core_.log_message(f"Image queue size: {acq.first_dequeue_.qsize()}")
                     if not acq.image_processors_:
                         if acq.debug_mode_:
                             acq.core_.log_message("waiting for image to save")
@@ -144,13 +364,144 @@ class Acquisition():
         if self.started_:
             raise RuntimeError("Cannot add processor after acquisition started")
         self.image_processors_.append(p)
-        self.processor_output_queues_[p] = queue.Queue(maxsize=self.IMAGE_QUEUE_SIZE)
+        self.processor_output_queues_[p] = self._create_image_queue()
         if len(self.image_processors_) == 1:
             p.set_acq_and_queues(self, self.first_dequeue_, self.processor_output_queues_[p])
         else:
             p.set_acq_and_queues(self, self.processor_output_queues_[self.image_processors_[-2]],
                                    self.processor_output_queues_[self.image_processors_[-1]])
 
+    def set_image_queue_memory_budget(self, max_bytes):
+        """
+        Bound the image queues (from the core to the image processors and data sinks) by the total bytes of the
+        images they hold, rather than by IMAGE_QUEUE_SIZE images each. Must be called before any processors
+        are added. None removes the budget
+        """
+        if self.started_ or self.image_processors_ or self.graph_outputs_:
+            raise RuntimeError("Cannot change image queue memory budget after processors are added")
+        self.image_queue_budget_ = ImageMemoryBudget(max_bytes) if max_bytes else None
+        self.first_dequeue_ = self._create_image_queue()
+        self.camera_output_ = self.first_dequeue_
+
+    def _create_image_queue(self):
+        if self.image_queue_budget_ is None:
+            return ImageQueue(self.IMAGE_QUEUE_SIZE)
+        return ImageQueue(budget=self.image_queue_budget_)
+
+    def get_image_queues(self):
+        """
+        Return a dict of the image queues by name: 'camera' for the images from the core, 'processor <i>' for the
+        output of each image processor added with add_image_processor, and the name of each node of the processor
+        graph for its input
+        """
+        queues = {self.CAMERA_NODE: self.first_dequeue_}
+        for i, processor in enumerate(self.image_processors_):
+            queues['processor {}'.format(i)] = self.processor_output_queues_[processor]
+        queues.update(self.graph_input_queues_)
+        return queues
+
+    def get_image_queue_metrics(self):
+        """
+        Return a dict with the number of images waiting in all image queues ('depth'), the bytes of their
+        pixels ('bytes_in_flight'), the total time spent waiting to put images in a full queue
+        ('blocked_put_time_s'), and these values for each queue ('queues', see get_image_queues). Images sent to
+        several nodes of the processor graph are counted in each of their queues
+        """
+        queue_metrics = {name: image_queue.get_metrics() for name, image_queue in self.get_image_queues().items()}
+        return {'depth': sum(m['depth'] for m in queue_metrics.values()),
+                'bytes_in_flight': sum(m['bytes'] for m in queue_metrics.values()),
+                'blocked_put_time_s': sum(m['blocked_put_time_s'] for m in queue_metrics.values()),
+                'queues': queue_metrics}
+
+    def add_processor_node(self, name, processor, inputs, queue_size=None, drop_when_full=False):
+        """
+        Add an image processor to the processor graph, which runs alongside the chain of processors added with
+        add_image_processor. It is given the images from the nodes named in inputs, either CAMERA_NODE (the
+        images as they come out of the core) or processor nodes added before it, so the graph can't have
+        cycles. Each node has its own input queue of queue_size images (by default IMAGE_QUEUE_SIZE, or as many
+        as fit in the memory budget if the image queues have one). If drop_when_full is True, images arriving
+        while it is full are dropped, so that a slow node doesn't hold up the saving of images by the data
+        sink. The output of a processor is sent to all nodes that take it as input, and is discarded if there
+        are none
+        """
+        output = FanOut(self.retain_frame, self.release_frame)
+        input_queue = self._add_graph_node(name, output, inputs, queue_size, drop_when_full)
+        processor.set_acq_and_queues(self, input_queue, output)
+
+    def add_sink_node(self, name, sink, inputs, queue_size=None, drop_when_full=False):
+        """
+        Add a data sink (e.g. a second dataset) to the processor graph, which saves the images from the nodes
+        named in inputs on its own thread. See add_processor_node for the other arguments
+        """
+        input_queue = self._add_graph_node(name, None, inputs, queue_size, drop_when_full)
+        self.graph_sinks_[name] = sink
+        if hasattr(sink, 'initialize'):
+            sink.initialize(AcqEngMetadata.make_summary_metadata(self.core_, self))
+        self.graph_sink_threads_.append(threading.Thread(target=self._save_to_sink_node, args=(sink, input_queue),
+                                                         name='Sink node {}'.format(name)))
+
+    def _add_graph_node(self, name, output, inputs, queue_size, drop_when_full):
+        if self.started_:
+            raise RuntimeError("Cannot add processor graph node after acquisition started")
+        if name == self.CAMERA_NODE or name in self.graph_outputs_:
+            raise ValueError("There is already a processor graph node named {}".format(name))
+        if not inputs:
+            raise ValueError("Processor graph node {} has no inputs".format(name))
+        for input_name in inputs:
+            if input_name != self.CAMERA_NODE and self.graph_outputs_.get(input_name) is None:
+                raise ValueError("Input {} of processor graph node {} must be the camera or a processor node "
+                                 "added before it".format(input_name, name))
+        if not queue_size:
+            queue_size = self.IMAGE_QUEUE_SIZE if self.image_queue_budget_ is None else 0
+        input_queue = NodeInputQueue(queue_size, len(inputs), drop_when_full, self.release_frame,
+                                     self.image_queue_budget_)
+        for input_name in inputs:
+            if input_name == self.CAMERA_NODE:
+                if self.camera_output_ is self.first_dequeue_:
+                    self.camera_output_ = FanOut(self.retain_frame, self.release_frame)
+                    self.camera_output_.add_consumer(self.first_dequeue_)
+                self.camera_output_.add_consumer(input_queue)
+            else:
+                self.graph_outputs_[input_name].add_consumer(input_queue)
+        self.graph_outputs_[name] = output
+        self.graph_input_queues_[name] = input_queue
+        return input_queue
+
+    def _save_to_sink_node(self, sink, input_queue):
+        failed = False
+        while True:
+            img = input_queue.get()
+            if is_end_of_images(img):
+                break
+            try:
+                if not failed:
+                    sink.put_image(AcqEngMetadata.get_axes(img.tags), img.pix, img.tags)
+            except Exception as ex:
+                # keep taking images, so that the nodes sending them aren't blocked
+                traceback.print_exc()
+                failed = True
+                self.abort(ex)
+            self.release_frame(img.pix)
+        sink.finish()
+
+    def get_dropped_image_counts(self):
+        """
+        Return a dict with the number of images each node of the processor graph has dropped because its input
+        queue was full
+        """
+        return {name: input_queue.dropped for name, input_queue in self.graph_input_queues_.items()}
+
+    def block_until_graph_finished(self):
+        """
+        Block until all nodes of the processor graph have processed or saved their last image
+        """
+        for output in self.graph_outputs_.values():
+            if output is not None:
+                output.finished.wait()
+        for thread in self.graph_sink_threads_:
+            if thread.is_alive():
+                thread.join()
+
     def add_hook(self, h, type_):
         if self.started_:
             raise RuntimeError("Cannot add hook after acquisition started")
@@ -174,8 +525,16 @@ class Acquisition():
             self.data_sink_.initialize(summary_metadata)
 
     def start(self):
+        # Hardware may have been reconfigured or used elsewhere since the last acquisition. While other
+        # acquisitions are running on the engine, nothing else has used it and what is cached is still current
+        if not any(acq is not self for acq in self.engine_.scheduler.get_acquisitions()):
+            self.engine_.device_capabilities.invalidate()
+            self.engine_.cached_core.invalidate()
+            self.engine_.loaded_sequences.invalidate()
         if self.data_sink_:
             self.start_saving_thread()
+        for thread in self.graph_sink_threads_:
+            thread.start()
         self.post_notification(AcqNotification.create_acq_started_notification())
         self.started_ = True
 
@@ -187,6 +546,7 @@ class Acquisition():
             pixels, metadata = image.pix, image.tags
             axes = AcqEngMetadata.get_axes(metadata)
             self.data_sink_.put_image(axes, pixels, metadata)
+            self.release_frame(pixels)
             self.post_notification(AcqNotification.create_image_saved_notification(axes))
 
     def get_start_time_ms(self):
@@ -203,6 +563,14 @@ class Acquisition():
 
     def set_paused(self, pause):
         self.paused_ = pause
+        if pause:
+            self.unpaused_.clear()
+        else:
+            self.unpaused_.set()
+
+    def block_while_paused(self):
+        """Blocks until the acquisition is not paused."""
+        self.unpaused_.wait()
 
     def get_summary_metadata(self):
         return self.summary_metadata_
@@ -236,15 +604,21 @@ class Acquisition():
         return self.after_exposure_hooks_
 
     def add_to_output(self, ti):
+        """
+        Pass on a TaggedImage, or a list of them, to the image processors and data sink
+        """
         try:
-            if ti.tags is None and ti.pix is None:
-                self.events_finished_.set()
-            self.first_dequeue_.put(ti)
+            for image in (ti if isinstance(ti, list) else [ti]):
+                if image.tags is None and image.pix is None:
+                    self.events_finished_.set()
+                elif self.frame_pool_ is not None and image.pix is not None:
+                    image.pix = self.frame_pool_.lease(image.pix, self.abort_requested_)
+                self.camera_output_.put(image)
         except Exception as ex:
             raise RuntimeError(ex)
 
     def finish(self):
-        Engine.get_instance().finish_acquisition(self)
+        self.engine_.finish_acquisition(self)
 
     def are_events_finished(self):
         return self.events_finished_.is_set()
@@ -259,9 +633,17 @@ class Acquisition():
 
 
     def get_image_transfer_queue_size(self):
-        return self.IMAGE_QUEUE_SIZE
+        """
+        Number of images the queue from the core holds. With a memory budget, the number of images of the size
+        last acquired that fit in the budget
+        """
+        if self.image_queue_budget_ is None:
+            return self.first_dequeue_.maxsize
+        if not self.first_dequeue_.last_image_nbytes:
+            return 0
+        return self.image_queue_budget_.max_bytes // self.first_dequeue_.last_image_nbytes
 
     def get_image_transfer_queue_count(self):
-        return len(self.first_dequeue_)
+        return self.first_dequeue_.qsize()
 
 
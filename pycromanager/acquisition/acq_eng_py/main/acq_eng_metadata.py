@@ -1,5 +1,7 @@
 import datetime
+import functools
 import json
+import time
 import traceback
 import numpy as np
 
@@ -34,6 +36,8 @@ class AcqEngMetadata:
     PIX_TYPE = "PixelType"
     BIT_DEPTH = "BitDepth"
     ELAPSED_TIME_MS = "ElapsedTime-ms"
+    FRAME_TIME_PLANNED_MS = "FrameTimePlanned-ms"
+    FRAME_TIME_MS = "FrameTime-ms"
     Z_STEP_UM = "z-step_um"
     EXPLORE_ACQUISITION = "ExploreAcquisition"
     AXES_GRID_COL = "column"
@@ -53,21 +57,68 @@ class AcqEngMetadata:
     TAGS = "tags"
     ACQUISITION_EVENT = "Event"
 
+    # Most recent image time stamp, as (whole second, formatted string), so that the date is only formatted
+    # once per second
+    _image_time_cache = (None, None)
+    # Number of sets of user tags whose conversion to JSON is cached
+    TAGS_JSON_CACHE_SIZE = 256
+
+    @staticmethod
+    def make_sequence_metadata_template(core):
+        """
+        Values of the image metadata that are the same for all images of a sequence, so that they
+        only have to be read from the core once
+        """
+        return {'pixel_size_um': core.get_pixel_size_um(), 'focus_device': core.get_focus_device()}
+
+    @staticmethod
+    def get_image_time_string():
+        second = int(time.time())
+        cached_second, time_string = AcqEngMetadata._image_time_cache
+        if cached_second != second:
+            time_string = datetime.datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S -')
+            AcqEngMetadata._image_time_cache = (second, time_string)
+        return time_string
+
+    @staticmethod
+    def tags_to_json(tags):
+        """
+        Convert the user tags of an event to plain JSON types. Events usually share the same few sets of
+        tags, so the conversion is cached for tags whose values are hashable. A new dict is returned each time
+        """
+        # The types are part of the key, as e.g. 1 and True are equal but are converted differently
+        key = tuple((name, type(value), value) for name, value in tags.items())
+        try:
+            hash(key)
+        except TypeError:
+            return json.loads(json.dumps(tags))
+        return dict(AcqEngMetadata._cached_tags_json(key))
+
+    @staticmethod
+    @functools.lru_cache(maxsize=TAGS_JSON_CACHE_SIZE)
+    def _cached_tags_json(key):
+        return json.loads(json.dumps({name: value for name, _, value in key}))
+
     @staticmethod
-    def add_image_metadata(core, tags, event, elapsed_ms, exposure):
+    def add_image_metadata(core, tags, event, elapsed_ms, exposure, template=None):
         try:
-            AcqEngMetadata.set_pixel_size_um(tags, core.get_pixel_size_um())
+            if template is None:
+                template = AcqEngMetadata.make_sequence_metadata_template(core)
+            AcqEngMetadata.set_pixel_size_um(tags, template['pixel_size_um'])
 
             # Date and time
             AcqEngMetadata.set_elapsed_time_ms(tags, elapsed_ms)
-            AcqEngMetadata.set_image_time(tags, datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S -'))
-
-            # Info about all hardware that the core specifically knows about
-            AcqEngMetadata.create_axes(tags)
+            AcqEngMetadata.set_image_time(tags, AcqEngMetadata.get_image_time_string())
 
             # Axes positions
-            for s in event.get_defined_axes():
-                AcqEngMetadata.set_axis_position(tags, s, event.get_axis_position(s))
+            axes = {}
+            for axis, position in event.get_axis_positions().items():
+                if position is None:
+                    continue
+                if not isinstance(position, (str, int, np.int64, np.int32)):
+                    raise ValueError("position must be String or Integer")
+                axes[axis] = position
+            tags[AcqEngMetadata.AXES] = axes
 
             # XY Stage Positions
             if event.get_x_position() is not None and event.get_y_position() is not None:
@@ -76,14 +127,14 @@ class AcqEngMetadata:
             if event.get_position_name() is not None:
                 AcqEngMetadata.set_position_name(tags, event.get_position_name())
 
+            focus_device = template['focus_device']
             if event.get_z_position() is not None:
                 AcqEngMetadata.set_stage_z_intended(tags, event.get_z_position())
-            elif event.get_stage_single_axis_stage_position(core.get_focus_device()) is not None:
-                AcqEngMetadata.set_stage_z_intended(tags,
-                                                    event.get_stage_single_axis_stage_position(core.get_focus_device()))
+            elif event.get_stage_single_axis_stage_position(focus_device) is not None:
+                AcqEngMetadata.set_stage_z_intended(tags, event.get_stage_single_axis_stage_position(focus_device))
 
             for name in event.get_stage_device_names():
-                if name != core.get_focus_device():
+                if name != focus_device:
                     AcqEngMetadata.set_stage_position_intended(tags, name,
                                                                event.get_stage_single_axis_stage_position(name))
 
@@ -458,6 +509,28 @@ class AcqEngMetadata:
         except KeyError:
             raise ValueError("Couldn't set elapsed time")
 
+    @staticmethod
+    def set_frame_time_planned_ms(map, val):
+        map[AcqEngMetadata.FRAME_TIME_PLANNED_MS] = val
+
+    @staticmethod
+    def get_frame_time_planned_ms(map):
+        try:
+            return map[AcqEngMetadata.FRAME_TIME_PLANNED_MS]
+        except KeyError:
+            raise RuntimeError("missing planned frame time tag")
+
+    @staticmethod
+    def set_frame_time_ms(map, val):
+        map[AcqEngMetadata.FRAME_TIME_MS] = val
+
+    @staticmethod
+    def get_frame_time_ms(map):
+        try:
+            return map[AcqEngMetadata.FRAME_TIME_MS]
+        except KeyError:
+            raise RuntimeError("missing frame time tag")
+
     @staticmethod
     def has_elapsed_time_ms(map):
         return AcqEngMetadata.ELAPSED_TIME_MS in map
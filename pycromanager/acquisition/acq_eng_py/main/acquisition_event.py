@@ -1,4 +1,5 @@
 from collections import namedtuple
+from collections.abc import MutableMapping
 import json
 from pycromanager.acquisition.acq_eng_py.main.acq_eng_metadata import AcqEngMetadata
 
@@ -30,7 +31,11 @@ class AcquisitionEvent:
         self.zSequenced_ = False
         self.exposureSequenced_ = False
         self.configGroupSequenced_ = False
+        self.stageDevicesSequenced_ = set()
+        self.sequenceInterval_ms_ = 0
         self.specialFlag_ = None
+        # time.perf_counter() when a priority event was submitted, to measure its latency
+        self.prioritySubmitTime_ = None
 
         if sequence:
             self.acquisition_ = sequence[0].acquisition_
@@ -41,6 +46,7 @@ class AcquisitionEvent:
             yPosSet = set()
             exposureSet = set()
             configSet = set()
+            stagePosSets = {}
             for event in self.sequence_:
                 if event.zPosition_ is not None:
                     zPosSet.add(event.get_z_position())
@@ -52,10 +58,19 @@ class AcquisitionEvent:
                     exposureSet.add(event.get_exposure())
                 if event.configPreset_ is not None:
                     configSet.add(event.get_config_preset())
+                for stageDevice, position in event.stageCoordinates_.items():
+                    stagePosSets.setdefault(stageDevice, set()).add(position)
             self.exposureSequenced_ = len(exposureSet) > 1
             self.configGroupSequenced_ = len(configSet) > 1
-            self.xySequenced_ = len(xPosSet) > 1 and len(yPosSet) > 1
+            self.xySequenced_ = len(xPosSet) > 1 or len(yPosSet) > 1
             self.zSequenced_ = len(zPosSet) > 1
+            self.stageDevicesSequenced_ = {stageDevice for stageDevice, positions in stagePosSets.items()
+                                           if len(positions) > 1}
+            # Evenly spaced time points, one image each, are timed by the camera if the acquisition asked for it
+            startTimes = [event.miniumumStartTime_ms_ for event in self.sequence_]
+            if self.acquisition_ is not None and self.acquisition_.is_camera_timed_intervals() and \
+                    None not in startTimes and len(set(startTimes)) == len(startTimes) and len(startTimes) > 1:
+                self.sequenceInterval_ms_ = (startTimes[-1] - startTimes[0]) / (len(startTimes) - 1)
             if sequence[0].exposure_ and not self.exposureSequenced_:
                 self.exposure_ = sequence[0].exposure_
 
@@ -76,7 +91,7 @@ class AcquisitionEvent:
         e.properties_ = set(self.properties_)
         e.camera_ = self.camera_
         e.timeout_ms_ = self.timeout_ms_
-        e.setTags(self.tags_)  # Assuming setTags is a method in the class
+        e.set_tags(self.tags_)
         return e
 
     @staticmethod
@@ -126,8 +141,8 @@ class AcquisitionEvent:
         if e.camera_:
             data["camera"] = e.camera_
 
-        if e.get_tags() and e.get_tags():  # Assuming getTags is a method in the class
-            data["tags"] = {key: value for key, value in e.getTags().items()}
+        if e.get_tags():
+            data["tags"] = {key: value for key, value in e.get_tags().items()}
 
         props = [[t.dev, t.prop, t.val] for t in e.properties_]
         if props:
@@ -176,9 +191,7 @@ class AcquisitionEvent:
             deviceName = data["stage"]["device_name"]
             position = data["stage"]["position"]
             event.axisPositions_[deviceName] = float(position)
-            if "axis_name" in data["stage"]:
-                axisName = data["stage"]["axis_name"]
-                event.stageDeviceNamesToAxisNames_[deviceName] = axisName
+            event.set_stage_coordinate(deviceName, float(position), data["stage"].get("axis_name"))
 
         # # Assuming XYTiledAcquisition is a class and AcqEngMetadata is a class or module with constants
         # if isinstance(event.acquisition_, XYTiledAcquisition):
@@ -203,7 +216,7 @@ class AcquisitionEvent:
 
         if "tags" in data:
             tags = {key: value for key, value in data["tags"].items()}
-            event.setTags(tags)
+            event.set_tags(tags)
 
         if "properties" in data:
             for trip in data["properties"]:
@@ -361,6 +374,15 @@ class AcquisitionEvent:
     def is_z_sequenced(self):
         return self.zSequenced_
 
+    def get_sequence_interval_ms(self):
+        return self.sequenceInterval_ms_
+
+    def is_stage_device_sequenced(self, deviceName):
+        return deviceName in self.stageDevicesSequenced_
+
+    def get_sequenced_stage_device_names(self):
+        return set(self.stageDevicesSequenced_)
+
     def get_x_position(self):
         return self.xPosition_
 
@@ -419,6 +441,12 @@ class AcquisitionEvent:
         if tags:
             self.tags_.update(tags)
 
+    def set_priority_submit_time(self, submit_time):
+        self.prioritySubmitTime_ = submit_time
+
+    def get_priority_submit_time(self):
+        return self.prioritySubmitTime_
+
     def get_tags(self):
         return dict(self.tags_)
 
@@ -449,3 +477,82 @@ class AcquisitionEvent:
 
 
 ThreeTuple = namedtuple('ThreeTuple', ['dev', 'prop', 'val'])
+
+
+class AcquisitionEventView(MutableMapping):
+    """
+    A view of an AcquisitionEvent with the same keys and values as its JSON form (see
+    AcquisitionEvent.to_json), given to hooks so that an event doesn't need to be converted to a dict and
+    back when a hook only reads it. Values are read straight from the event. The dict is only made the first
+    time a key is set or deleted, and get_event then converts it back into a new event. The 'axes' and
+    'tags' dicts are the event's own, so changing them in place changes the event
+    """
+
+    _FIELDS = {
+        'min_start_time': lambda e: e.miniumumStartTime_ms_ / 1000 if e.miniumumStartTime_ms_ else None,
+        'config_group': lambda e: [e.configGroup_, e.configPreset_] if e.has_config_group() else None,
+        'exposure': lambda e: e.exposure_,
+        'slm_pattern': lambda e: e.slmImage_ if e.slmImage_ else None,
+        'timeout_ms': lambda e: e.timeout_ms_,
+        'axes': lambda e: e.axisPositions_ if e.axisPositions_ else None,
+        'stage_positions': lambda e: [[device, e.get_stage_single_axis_stage_position(device)]
+                                      for device in e.get_stage_device_names()] or None,
+        'z': lambda e: e.zPosition_,
+        'x': lambda e: e.xPosition_,
+        'y': lambda e: e.yPosition_,
+        'camera': lambda e: e.camera_ if e.camera_ else None,
+        'tags': lambda e: e.tags_ if e.tags_ else None,
+        'properties': lambda e: [[t.dev, t.prop, t.val] for t in e.properties_] or None,
+    }
+
+    def __init__(self, event):
+        self._event = event
+        self._data = None
+
+    def _get_data(self):
+        if self._data is None:
+            self._data = AcquisitionEvent.event_to_json(self._event)
+        return self._data
+
+    def __getitem__(self, key):
+        if self._data is not None:
+            return self._data[key]
+        field = self._FIELDS.get(key)
+        value = None if field is None else field(self._event)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        self._get_data()[key] = value
+
+    def __delitem__(self, key):
+        del self._get_data()[key]
+
+    def __iter__(self):
+        if self._data is not None:
+            return iter(self._data)
+        return iter([key for key, field in self._FIELDS.items() if field(self._event) is not None])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def is_modified(self):
+        return self._data is not None
+
+    def to_json(self):
+        return dict(self._get_data())
+
+    def get_event(self):
+        """
+        The event as the view describes it: the original event if no key was set or deleted, otherwise a new
+        one made from the view's dict
+        """
+        if self._data is None:
+            return self._event
+        event = AcquisitionEvent.event_from_json(self._data, self._event.acquisition_)
+        event.set_priority_submit_time(self._event.get_priority_submit_time())
+        return event
@@ -13,6 +13,8 @@ import queue
 import weakref
 from pycromanager.acquisition.acq_future import AcqNotification, AcquisitionFuture
 import threading
+import time
+from collections import deque
 from inspect import signature
 from types import GeneratorType
 
@@ -24,13 +26,30 @@ class EventQueue(Queue):
     """
     A queue that can hold both events/lists of events and generators of events/lists of events. When a generator is
     retrieved from the queue, it will be automatically expanded and its elements will be the output of queue.get
+
+    Events added with put_priority (e.g. by an image processor reacting to an image) are retrieved before any
+    other events in the queue, including the rest of a generator that is being expanded
     """
     def __init__(self, maxsize=0):
         super().__init__(maxsize)
         self.current_generator: Union[Generator[Dict, None, None], None] = None
 
+    def _init(self, maxsize):
+        super()._init(maxsize)
+        # (event or list of events, time.perf_counter() when it was added)
+        self.priority_queue = deque()
+
+    def _qsize(self):
+        return len(self.queue) + len(self.priority_queue)
+
+    def _get(self):
+        if self.priority_queue:
+            return self.priority_queue.popleft()
+        return self.queue.popleft()
+
     def clear(self):
         self.queue.clear()
+        self.priority_queue.clear()
         self.current_generator = None
 
     def put(self, item: Union[Dict, Generator[Dict, None, None]], block=True, timeout=None):
@@ -47,17 +66,38 @@ class EventQueue(Queue):
         else:
             raise TypeError("Event must be a dictionary, list or generator")
 
+    def put_priority(self, item: Union[Dict, list]):
+        """
+        Add an event or list of events ahead of all other events in the queue. Events in a list can still be
+        merged into a hardware sequence
+        """
+        if not isinstance(item, (dict, list)):
+            raise TypeError("Priority event must be a dictionary or list")
+        with self.not_empty:
+            self.priority_queue.append((item, time.perf_counter()))
+            self.unfinished_tasks += 1
+            self.not_empty.notify()
+
     def get(self, block=True, timeout=None) -> Dict:
+        return self.get_with_priority(block, timeout)[0]
+
+    def get_with_priority(self, block=True, timeout=None):
+        """
+        Like get, but returns a tuple of the event (or list of events) and, for priority events, the
+        time.perf_counter() when it was added (otherwise None)
+        """
         while True:
-            if self.current_generator is None:
+            if self.current_generator is None or self.priority_queue:
                 item = super().get(block, timeout)
+                if isinstance(item, tuple):
+                    return item
                 if isinstance(item, Generator):
                     self.current_generator = item
                 else:
-                    return item
+                    return item, None
             else:
                 try:
-                    return next(self.current_generator)
+                    return next(self.current_generator), None
                 except StopIteration:
                     self.current_generator = None
 
@@ -144,6 +184,65 @@ class Acquisition(metaclass=Meta):
             they are waiting to save (Java backend only)
         timeout :
             Timeout in ms for connecting to Java side (Java backend only)
+        pipeline_hardware : bool
+            If True, start the hardware changes for the next event while the current image is read out (Python
+            backend only)
+        concurrent_hardware_dispatch : bool
+            If True, command all devices that change for an event before waiting for any of them (Python backend only)
+        device_dependencies : dict
+            Used with concurrent_hardware_dispatch. Maps a device name to the devices that must finish moving before
+            it is commanded, e.g. {'Z': ['XY']} (Python backend only)
+        camera_timed_intervals : bool
+            If True, acquire evenly spaced time points as one camera sequence timed by the camera (Python backend only)
+        frame_pool_size : int
+            Number of preallocated buffers that images are copied into and reused from once saved. Ignored unless all
+            images are saved to disk, including by image_process_graph sinks (Python backend only)
+        core :
+            The core to acquire with, e.g. one of several started with start_headless (Python backend only)
+        engine :
+            The acquisition engine to use, as an alternative to passing its core (Python backend only)
+        priority : int
+            Acquisitions running at the same time on one core are interleaved, highest priority first (Python
+            backend only)
+        max_events_per_second : float
+            Maximum rate at which the events of this acquisition are run (Python backend only)
+        resend_unchanged_hardware : bool
+            If True, send hardware commands even when the device is known to be in that state already (Python
+            backend only)
+        event_generation_hook_batch_size : int
+            If set, event_generation_hook_fn is called with lists of up to this many events (Python backend only)
+        hook_event_views : bool
+            If True, hook functions are given an AcquisitionEventView of each event instead of a dict (Python
+            backend only)
+        async_hooks : dict
+            Maps 'pre_hardware', 'post_hardware' or 'post_camera' to the barrier ('hardware', 'z_drive', 'camera',
+            'event_end' or 'acquisition_end') at which the engine waits for that hook to finish (Python backend only)
+        async_hook_workers : int
+            Number of threads that run asynchronous hooks (Python backend only)
+        untracked_hardware_hooks : tuple
+            Names of the hooks ('pre_hardware', 'post_hardware' or 'post_camera') that change devices which don't
+            report their changes to the core. The engine forgets the hardware state it has recorded after each of
+            them runs, so that no commands are skipped based on it (Python backend only)
+        image_process_workers : int
+            Number of threads (or processes) that run image_process_fn. Images are still saved in order (Python
+            backend only)
+        image_process_reorder_window : int
+            Maximum number of images being processed at once, by default twice image_process_workers (Python
+            backend only)
+        image_process_backend : str
+            'thread' (default) or 'process', to run a picklable two argument image_process_fn in separate processes
+            (Python backend only)
+        image_process_graph : dict
+            Maps node names to dicts with an image processing 'fn' or a dataset 'sink', and optionally 'inputs',
+            'queue_size', 'drop_when_full' and 'workers' (Python backend only)
+        image_process_batch_size : int
+            If set, image_process_fn is called with a stack of up to this many images and a list of their metadata
+            (Python backend only)
+        image_process_batch_latency_ms : float
+            Maximum time the first image of a batch waits for the others (Python backend only)
+        image_queue_memory_mb : float
+            If set, all image queues of the acquisition share this memory budget instead of holding 30 images
+            each (Python backend only)
         port :
             Allows overriding the default port for using Java backends on a different port. Use this
             after calling start_headless with the same non-default port (Java backend only)
@@ -157,6 +256,8 @@ class Acquisition(metaclass=Meta):
         self._image_notification_queue = queue.Queue(100)
         self._acq_futures = []
         self._image_process_fn = image_process_fn
+        # image processing function -> its number of parameters, so its signature is only inspected once
+        self._process_fn_num_params = {}
 
         pass
 
@@ -227,7 +328,7 @@ class Acquisition(metaclass=Meta):
             # this should shut down storage and viewer as appropriate
             self._event_queue.put(None)
 
-    def acquire(self, event_or_events: dict or list or Generator) -> AcquisitionFuture:
+    def acquire(self, event_or_events: dict or list or Generator, priority: bool=False) -> AcquisitionFuture:
         """
         Submit an event or a list of events for acquisition. A single event is a python dictionary
         with a specific structure. The acquisition engine will determine if multiple events can
@@ -241,6 +342,11 @@ class Acquisition(metaclass=Meta):
         event_or_events  : list, dict, Generator
             A single acquistion event (a dict), a list of acquisition events, or a generator that yields
             acquisition events.
+        priority : bool
+            If True, the events go ahead of all events that are waiting to be acquired, for example to respond
+            quickly to something seen in an image. A list of priority events can still be merged into a hardware
+            sequence. Generators can't be submitted with priority. Within an image_process_fn, the same can be done
+            with event_queue.put_priority
 
         """
         try:
@@ -253,6 +359,8 @@ class Acquisition(metaclass=Meta):
                 self._event_queue.put(None)
                 return
 
+            if priority and isinstance(event_or_events, GeneratorType):
+                raise TypeError("Generators of events can't be submitted with priority")
             if isinstance(event_or_events, GeneratorType):
                 acq_future = AcquisitionFuture(self)
 
@@ -276,7 +384,10 @@ class Acquisition(metaclass=Meta):
             # clear out old weakrefs
             self._acq_futures = [f for f in self._acq_futures if f() is not None]
 
-            self._event_queue.put(event_or_events)
+            if priority:
+                self._event_queue.put_priority(event_or_events)
+            else:
+                self._event_queue.put(event_or_events)
             return acq_future
         except Exception as e:
             self.abort(e)
@@ -343,15 +454,20 @@ class Acquisition(metaclass=Meta):
         """Create thread safe queue for events so they can be passed from multiple processes"""
         self._event_queue = EventQueue()
 
-    def _call_image_process_fn(self, image, metadata):
-        params = signature(self._process_fn).parameters
+    def _call_image_process_fn(self, image, metadata, process_fn=None):
+        if process_fn is None:
+            process_fn = self._process_fn
+        num_params = self._process_fn_num_params.get(process_fn)
+        if num_params is None:
+            num_params = len(signature(process_fn).parameters)
+            self._process_fn_num_params[process_fn] = num_params
         processed = None
-        if len(params) == 2 or len(params) == 3:
+        if num_params == 2 or num_params == 3:
             try:
-                if len(params) == 2:
-                    processed = self._process_fn(image, metadata)
-                elif len(params) == 3:
-                    processed = self._process_fn(image, metadata, self._event_queue)
+                if num_params == 2:
+                    processed = process_fn(image, metadata)
+                elif num_params == 3:
+                    processed = process_fn(image, metadata, self._event_queue)
             except Exception as e:
                 self.abort(Exception("exception in image processor: {}".format(e)))
 
@@ -2,11 +2,20 @@ import warnings
 from docstring_inheritance import NumpyDocstringInheritanceMeta
 from pycromanager.acquisition.acq_eng_py.main.AcqEngPy_Acquisition import Acquisition as pymmcore_Acquisition
 from pycromanager.acquisition.acquisition_superclass import _validate_acq_events, Acquisition
-from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent, AcquisitionEventView
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine
 from pycromanager.acquisition.acq_future import AcqNotification
+import asyncio
+import multiprocessing
+import pickle
+import queue
 import threading
-from inspect import signature
+import time
+from concurrent.futures import Future
+from inspect import signature, isawaitable
 import traceback
+from multiprocessing import shared_memory
+import numpy as np
 
 from ndstorage.ndram_dataset import NDRAMDataset
 from ndstorage.ndtiff_dataset import NDTiffDataset
@@ -32,6 +41,28 @@ class PythonBackendAcquisition(Acquisition, metaclass=NumpyDocstringInheritanceM
         notification_callback_fn: callable=None,
         napari_viewer=None,
         image_saved_fn: callable=None,
+        pipeline_hardware: bool=False,
+        concurrent_hardware_dispatch: bool=False,
+        device_dependencies: dict=None,
+        camera_timed_intervals: bool=False,
+        frame_pool_size: int=None,
+        core=None,
+        engine=None,
+        priority: int=0,
+        max_events_per_second: float=None,
+        resend_unchanged_hardware: bool=False,
+        event_generation_hook_batch_size: int=None,
+        hook_event_views: bool=False,
+        async_hooks: dict=None,
+        async_hook_workers: int=1,
+        untracked_hardware_hooks: tuple=None,
+        image_process_workers: int=1,
+        image_process_reorder_window: int=None,
+        image_process_backend: str='thread',
+        image_process_graph: dict=None,
+        image_process_batch_size: int=None,
+        image_process_batch_latency_ms: float=None,
+        image_queue_memory_mb: float=None,
         debug: int=False,
 
     ):
@@ -41,35 +72,81 @@ class PythonBackendAcquisition(Acquisition, metaclass=NumpyDocstringInheritanceM
         named_args = {arg_name: (l[arg_name] if arg_name in l else
                                      dict(signature(PythonBackendAcquisition.__init__).parameters.items())[arg_name].default)
                                      for arg_name in arg_names }
-        super().__init__(**named_args)
+        superclass_arg_names = [k for k in signature(Acquisition.__init__).parameters.keys() if k != 'self']
+        superclass_args = {key: named_args[key] for key in superclass_arg_names}
+        super().__init__(**superclass_args)
+        # Check the arguments before starting any threads, which would otherwise be left waiting
+        if engine is not None and core is not None and engine.core is not core:
+            raise ValueError("engine does not drive the given core")
+        if image_process_backend not in ('thread', 'process'):
+            raise ValueError("image_process_backend must be 'thread' or 'process'")
+        if image_process_fn is not None and image_process_backend == 'process':
+            try:
+                pickle.dumps(image_process_fn)
+            except Exception as e:
+                raise ValueError("image_process_fn must be picklable to run in a separate process, so it can't be a "
+                                 "lambda or a function defined inside another function ({})".format(e)) from e
+        _validate_image_process_graph(image_process_graph or {})
+        if image_process_batch_size and (image_process_workers > 1 or image_process_backend != 'thread'):
+            raise ValueError("image_process_batch_size can't be combined with image_process_workers or "
+                             "image_process_backend")
+        async_hooks = async_hooks or {}
+        for hook_name, barrier in async_hooks.items():
+            if hook_name not in ('pre_hardware', 'post_hardware', 'post_camera'):
+                raise ValueError("Only pre_hardware, post_hardware and post_camera hooks can run asynchronously")
+            if barrier is not None and barrier not in pymmcore_Acquisition.HOOK_BARRIERS:
+                raise ValueError("Unknown barrier {}, must be one of {}".format(
+                    barrier, pymmcore_Acquisition.HOOK_BARRIERS))
+        untracked_hardware_hooks = tuple(untracked_hardware_hooks or ())
+        for hook_name in untracked_hardware_hooks:
+            if hook_name not in ('pre_hardware', 'post_hardware', 'post_camera'):
+                raise ValueError("untracked_hardware_hooks can only contain pre_hardware, post_hardware and "
+                                 "post_camera")
+        if image_queue_memory_mb is not None and image_queue_memory_mb <= 0:
+            raise ValueError("image_queue_memory_mb must be positive")
+        if frame_pool_size is not None and frame_pool_size < 0:
+            raise ValueError("frame_pool_size must be positive")
         self._dataset = NDRAMDataset() if not directory else NDTiffDataset(directory, name=name, writable=True)
         self._finished = False
         self._notifications_finished = False
         self._create_event_queue()
 
         self._process_fn = image_process_fn
-        self._image_processor = ImageProcessor(self) if image_process_fn is not None else None
-
-
-        # create a thread that submits events
-        # events can be added to the queue through image processors, hooks, or the acquire method
-        def submit_events():
-            while True:
-                event_or_events = self._event_queue.get()
-                if event_or_events is None:
-                    self._acq.finish()
-                    self._acq.block_until_events_finished()
-                    break
-                _validate_acq_events(event_or_events)
-                if isinstance(event_or_events, dict):
-                    event_or_events = [event_or_events]
-                # convert to objects
-                event_or_events = [AcquisitionEvent.from_json(event, self._acq) for event in event_or_events]
-                self._acq.submit_event_iterator(iter(event_or_events))
-        self._event_thread = threading.Thread(target=submit_events)
-        self._event_thread.start()
-
-        self._acq = pymmcore_Acquisition(self._dataset)
+        if image_process_fn is None:
+            self._image_processor = None
+        elif image_process_batch_size:
+            self._image_processor = BatchImageProcessor(self, image_process_batch_size,
+                                                        image_process_batch_latency_ms)
+        elif image_process_backend == 'process':
+            if len(signature(image_process_fn).parameters) != 2:
+                raise ValueError("image_process_fn must take 2 arguments to run in a separate process")
+            self._image_processor = ProcessImageProcessor(self, image_process_workers, image_process_reorder_window)
+        elif image_process_workers > 1:
+            self._image_processor = ParallelImageProcessor(self, image_process_workers, image_process_reorder_window)
+        else:
+            self._image_processor = ImageProcessor(self)
+
+
+        if engine is None and core is not None:
+            engine = Engine.for_core(core)
+        self._acq = pymmcore_Acquisition(self._dataset, engine=engine)
+        self._engine = self._acq.get_engine()
+        self._acq.set_priority(priority)
+        self._acq.set_max_events_per_second(max_events_per_second)
+        self._acq.set_pipelined_hardware(pipeline_hardware)
+        self._acq.set_concurrent_hardware_dispatch(concurrent_hardware_dispatch, device_dependencies)
+        self._acq.set_camera_timed_intervals(camera_timed_intervals)
+        self._acq.set_resend_hardware(resend_unchanged_hardware)
+        self._acq.set_async_hook_workers(async_hook_workers)
+        if image_queue_memory_mb:
+            self._acq.set_image_queue_memory_budget(int(image_queue_memory_mb * 1024 ** 2))
+        if frame_pool_size:
+            graph_sinks = [node['sink'] for node in (image_process_graph or {}).values() if 'sink' in node]
+            if directory is None or not all(isinstance(sink, NDTiffDataset) for sink in graph_sinks):
+                # Images held in RAM keep a reference to their array, so the buffers could not be reused
+                warnings.warn("frame_pool_size is ignored unless all images are saved to disk as NDTiff datasets")
+            else:
+                self._acq.set_frame_pool(frame_pool_size)
 
         # receive notifications from the acquisition engine. Unlike the java_backend analog
         # of this, the python backend does not have a separate thread for notifications because
@@ -88,16 +165,27 @@ class PythonBackendAcquisition(Acquisition, metaclass=NumpyDocstringInheritanceM
         self._notification_dispatch_thread = self._start_notification_dispatcher(notification_callback_fn)
 
         # add hooks and image processor
+        def make_hook(hook_fn, hook_name):
+            return AcquisitionHook(hook_fn, hook_event_views, run_async=hook_name in async_hooks,
+                                   barrier=async_hooks.get(hook_name),
+                                   untracked_hardware=hook_name in untracked_hardware_hooks)
         if pre_hardware_hook_fn is not None:
-            self._acq.add_hook(AcquisitionHook(pre_hardware_hook_fn), self._acq.BEFORE_HARDWARE_HOOK)
+            self._acq.add_hook(make_hook(pre_hardware_hook_fn, 'pre_hardware'), self._acq.BEFORE_HARDWARE_HOOK)
         if post_hardware_hook_fn is not None:
-            self._acq.add_hook(AcquisitionHook(post_hardware_hook_fn), self._acq.AFTER_HARDWARE_HOOK)
+            self._acq.add_hook(make_hook(post_hardware_hook_fn, 'post_hardware'), self._acq.AFTER_HARDWARE_HOOK)
         if post_camera_hook_fn is not None:
-            self._acq.add_hook(AcquisitionHook(post_camera_hook_fn), self._acq.AFTER_CAMERA_HOOK)
+            self._acq.add_hook(make_hook(post_camera_hook_fn, 'post_camera'), self._acq.AFTER_CAMERA_HOOK)
         if event_generation_hook_fn is not None:
-            self._acq.add_hook(AcquisitionHook(event_generation_hook_fn), self._acq.EVENT_GENERATION_HOOK)
+            if event_generation_hook_batch_size and hook_event_views:
+                hook = BatchEventViewAcquisitionHook(event_generation_hook_fn, event_generation_hook_batch_size)
+            elif event_generation_hook_batch_size:
+                hook = BatchAcquisitionHook(event_generation_hook_fn, event_generation_hook_batch_size)
+            else:
+                hook = AcquisitionHook(event_generation_hook_fn, hook_event_views)
+            self._acq.add_hook(hook, self._acq.EVENT_GENERATION_HOOK)
         if self._image_processor is not None:
             self._acq.add_image_processor(self._image_processor)
+        self._add_image_process_graph(image_process_graph or {})
 
         # Monitor image arrival so they can be loaded on python side, but with no callback function
         # Need to do this regardless of whether you use it, so that notifcation handling shuts down
@@ -114,6 +202,27 @@ class PythonBackendAcquisition(Acquisition, metaclass=NumpyDocstringInheritanceM
             assert isinstance(napari_viewer, napari.Viewer), 'napari_viewer must be an instance of napari.Viewer'
             self._napari_viewer = napari_viewer
             start_napari_signalling(self._napari_viewer, self.get_dataset())
+
+        # create a thread that submits events, once nothing else can fail
+        # events can be added to the queue through image processors, hooks, or the acquire method
+        def submit_events():
+            while True:
+                event_or_events, priority_submit_time = self._event_queue.get_with_priority()
+                if event_or_events is None:
+                    self._acq.finish()
+                    self._acq.block_until_events_finished()
+                    break
+                _validate_acq_events(event_or_events)
+                if isinstance(event_or_events, dict):
+                    event_or_events = [event_or_events]
+                # convert to objects
+                event_or_events = [AcquisitionEvent.from_json(event, self._acq) for event in event_or_events]
+                if priority_submit_time is not None:
+                    for event in event_or_events:
+                        event.set_priority_submit_time(priority_submit_time)
+                self._acq.submit_event_iterator(iter(event_or_events), priority=priority_submit_time is not None)
+        self._event_thread = threading.Thread(target=submit_events)
+        self._event_thread.start()
         self._acq.start()
 
 
@@ -133,10 +242,112 @@ class PythonBackendAcquisition(Acquisition, metaclass=NumpyDocstringInheritanceM
             self._event_thread.join()
             self._notification_dispatch_thread.join()
             self._storage_monitor_thread.join()
-
+            self._acq.block_until_graph_finished()
+
+            self._dropped_image_counts = self._acq.get_dropped_image_counts()
+            self._image_queue_metrics = self._acq.get_image_queue_metrics()
+            self._settle_time_saved_ms = self._acq.get_settle_time_saved_ms()
+            self._priority_latencies_ms = self._acq.get_priority_latencies_ms()
+            self._core_round_trips_saved = self._acq.get_core_round_trips_saved()
+            if self._image_processor is not None:
+                self._image_processor.stop_measuring()
             self._acq = None
             self._finished = True
 
+    def get_settle_time_saved_ms(self):
+        """
+        Return a list with the time (in ms) saved on each event by concurrent_hardware_dispatch, compared to
+        commanding and waiting for each device in turn
+        """
+        if self._acq is None:
+            return self._settle_time_saved_ms
+        return self._acq.get_settle_time_saved_ms()
+
+    def get_priority_latencies_ms(self):
+        """
+        Return a list with the time (in ms) from submitting each priority event (with acquire(..., priority=True)
+        or event_queue.put_priority) until the engine started changing the hardware for it. For a list of
+        priority events merged into a hardware sequence, one time is recorded for the sequence
+        """
+        if self._acq is None:
+            return self._priority_latencies_ms
+        return self._acq.get_priority_latencies_ms()
+
+    def get_core_round_trips_saved(self):
+        """
+        Return the number of calls to the core (for the devices assigned to the core's roles and the size of
+        its images) that were answered from the engine's cache during this acquisition
+        """
+        if self._acq is None:
+            return self._core_round_trips_saved
+        return self._acq.get_core_round_trips_saved()
+
+    def get_image_processor_utilization(self):
+        """
+        Return a list with the fraction of time each image_process_fn worker thread spent processing images,
+        from the first image until the last one was processed (or until now). None if there is no
+        image_process_fn
+        """
+        if self._image_processor is None:
+            return None
+        return self._image_processor.get_utilization()
+
+    def get_image_queue_metrics(self):
+        """
+        Return a dict with the number of images waiting to be processed or saved ('depth'), the bytes of their
+        pixels ('bytes_in_flight'), the total time the acquisition engine and image processors spent waiting for
+        room in a full queue ('blocked_put_time_s'), and these values for each queue ('queues'). Can be called
+        while the acquisition is running
+        """
+        if self._acq is None:
+            return self._image_queue_metrics
+        return self._acq.get_image_queue_metrics()
+
+    def get_dropped_image_counts(self):
+        """
+        Return a dict with the number of images each node of image_process_graph dropped because its queue
+        was full
+        """
+        if self._acq is None:
+            return self._dropped_image_counts
+        return self._acq.get_dropped_image_counts()
+
+    def force_hardware_resend(self):
+        """
+        Forget the state the engine last put the hardware in, so that the next event sends all of its hardware
+        commands even if they match what was last commanded. Use this after changing devices in a way the core
+        is not notified of outside of a hook (hooks that do so can be listed in untracked_hardware_hooks)
+        """
+        self._engine.forget_hardware_state()
+
+    def get_skipped_hardware_command_count(self):
+        """
+        Return the number of hardware commands the engine of this acquisition's core has skipped because the
+        hardware was already in the requested state
+        """
+        return self._engine.hardware_state.get_skipped_count()
+
+    def plan_sequences(self, events):
+        """
+        Dry run of how the acquisition engine will split events into hardware sequences, without acquiring
+        anything. Useful to see why events are being acquired one at a time rather than as a sequence
+
+        Parameters
+        ----------
+        events : dict, list
+            a single acquisition event or a list of them, in the same form as passed to acquire
+
+        Returns
+        -------
+        A list with one dict per sequence, containing the index of its first event ('first_event_index'), its
+        number of events ('num_events'), the parts of the hardware that will be sequenced ('sequenced') and why
+        the following event could not be added to it ('break_reason', None for the last sequence)
+        """
+        events = [events] if isinstance(events, dict) else list(events)
+        _validate_acq_events(events)
+        return self._engine.plan_sequences([AcquisitionEvent.from_json(event, self._acq)
+                                                     for event in events])
+
     def get_viewer(self):
         """
         Return a reference to the current viewer, if the show_display argument
@@ -163,12 +374,49 @@ class PythonBackendAcquisition(Acquisition, metaclass=NumpyDocstringInheritanceM
         if self._exception is not None:
             raise self._exception
 
+    def _add_image_process_graph(self, graph):
+        """
+        Add the nodes of image_process_graph to the acquisition engine, in the order they are given
+        """
+        for name, node in graph.items():
+            inputs = node.get('inputs', [self._acq.CAMERA_NODE])
+            if 'sink' in node:
+                self._acq.add_sink_node(name, node['sink'], inputs, node.get('queue_size'),
+                                        node.get('drop_when_full', False))
+                continue
+            workers = node.get('workers', 1)
+            if workers > 1:
+                processor = ParallelImageProcessor(self, workers, process_fn=node['fn'])
+            else:
+                processor = ImageProcessor(self, process_fn=node['fn'])
+            self._acq.add_processor_node(name, processor, inputs, node.get('queue_size'),
+                                         node.get('drop_when_full', False))
+
     def _are_acquisition_notifications_finished(self):
         """
         Called by the storage to check if all notifications have been processed
         """
         return self._notifications_finished
 
+def _validate_image_process_graph(graph):
+    """
+    Check the nodes of image_process_graph before anything is started
+    """
+    processor_names = set()
+    for name, node in graph.items():
+        unknown_keys = set(node) - {'fn', 'sink', 'inputs', 'queue_size', 'drop_when_full', 'workers'}
+        if unknown_keys:
+            raise ValueError("Unknown keys {} for image_process_graph node {}".format(unknown_keys, name))
+        if ('fn' in node) == ('sink' in node):
+            raise ValueError("image_process_graph node {} must have either 'fn' or 'sink'".format(name))
+        for input_name in node.get('inputs', ['camera']):
+            if input_name != 'camera' and input_name not in processor_names:
+                raise ValueError("Input {} of image_process_graph node {} must be 'camera' or a processor node "
+                                 "given before it".format(input_name, name))
+        if 'fn' in node:
+            processor_names.add(name)
+
+
 class ImageProcessor:
     """
     This is the equivalent of RemoteImageProcessor in the Java version.
@@ -177,8 +425,15 @@ class ImageProcessor:
     """
 
 
-    def __init__(self, pycromanager_acq):
+    def __init__(self, pycromanager_acq, num_workers=1, process_fn=None):
         self._pycromanager_acq = pycromanager_acq
+        self._process_fn = process_fn if process_fn is not None else pycromanager_acq._process_fn
+        self._num_workers = num_workers
+        self._busy_lock = threading.Lock()
+        # thread id -> time spent in the process function
+        self._busy_time_s = {}
+        self._first_image_time = None
+        self._last_image_time = None
 
     def set_acq_and_queues(self, acq, input, output):
         self.input_queue = input
@@ -195,43 +450,531 @@ class ImageProcessor:
                 # this is a signal to stop
                 self.output_queue.put(tagged_image)
                 break
-            process_fn_result = self._pycromanager_acq._call_image_process_fn(tagged_image.pix, tagged_image.tags)
+            self._output(self._process_image(tagged_image))
+
+    def _process_image(self, tagged_image):
+        """
+        Call the process function on an image. Returns the processed image, or None if it was dropped
+        """
+        start = self._start_busy()
+        process_fn_result = self._call_process_fn(tagged_image)
+        self._check_for_exceptions()
+        self._end_busy(start)
+        if process_fn_result is not None:
+            # turn it into the expected tagged_image
+            # TODO: change this on later unification of acq engines
+            original_pix = tagged_image.pix
+            tagged_image.pix, tagged_image.tags = process_fn_result
+            self._release_replaced_frame(tagged_image, original_pix)
+            return tagged_image
+        else:
+            # the image processor intercepted the image, so its buffer can be reused
+            self._acq.release_frame(tagged_image.pix)
+
+    def _release_replaced_frame(self, tagged_image, original_pix):
+        """
+        Return the buffer of an image to the frame pool once the process function has replaced its pixels. If
+        the new pixels are a view of the buffer (e.g. a crop), the buffer stays in use until the view is released
+        """
+        if tagged_image.pix is original_pix or original_pix is None:
+            return
+        frame_pool = self._acq.get_frame_pool()
+        if frame_pool is None:
+            return
+        if isinstance(tagged_image.pix, np.ndarray) and np.shares_memory(tagged_image.pix, original_pix):
+            if frame_pool.is_leased(tagged_image.pix):
+                return
+            # The pool can't tell which buffer this view belongs to, so it is copied out of the buffer
+            tagged_image.pix = tagged_image.pix.copy()
+        self._acq.release_frame(original_pix)
+
+    def _call_process_fn(self, tagged_image):
+        return self._pycromanager_acq._call_image_process_fn(tagged_image.pix, tagged_image.tags, self._process_fn)
+
+    def _check_for_exceptions(self):
+        try:
+            self._pycromanager_acq._check_for_exceptions()
+        except Exception as e:
+            # unclear if this is functioning properly, check later
+            self._acq.abort()
+
+    def _start_busy(self):
+        start = time.perf_counter()
+        if self._first_image_time is None:
+            self._first_image_time = start
+        return start
+
+    def _end_busy(self, start):
+        with self._busy_lock:
+            self._busy_time_s[threading.get_ident()] = \
+                self._busy_time_s.get(threading.get_ident(), 0) + time.perf_counter() - start
+
+    def _output(self, tagged_image):
+        if tagged_image is not None:
+            self.output_queue.put(tagged_image)
+
+    def stop_measuring(self):
+        """
+        End the period over which utilization is measured
+        """
+        if self._last_image_time is None:
+            self._last_image_time = time.perf_counter()
+
+    def get_utilization(self):
+        """
+        Fraction of the time since the first image arrived that each worker thread spent processing images
+        """
+        with self._busy_lock:
+            busy_time_s = list(self._busy_time_s.values())
+        if self._first_image_time is None:
+            return [0.0] * self._num_workers
+        end = self._last_image_time if self._last_image_time is not None else time.perf_counter()
+        elapsed = max(end - self._first_image_time, 1e-9)
+        busy_time_s += [0.0] * (self._num_workers - len(busy_time_s))
+        return [min(busy / elapsed, 1.0) for busy in busy_time_s]
+
+
+class BatchImageProcessor(ImageProcessor):
+    """
+    Calls the process function with a stack of images (an array of shape (N, height, width)) and a list of
+    their metadata, so that vectorized processing (e.g. flat-field correction) runs once for many images. A
+    batch holds the images waiting in the input queue, up to batch_size of them, and is processed as soon as
+    it is full or its first image has waited latency_ms (by default, once no more images are waiting). Images
+    of a different shape or type start a new batch. The images are copied into the stack, so their buffers are
+    released before the process function is called. It returns a stack (or list) of images and a list of
+    their metadata, which can be shorter than the batch, or None to drop the whole batch
+    """
+
+    def __init__(self, pycromanager_acq, batch_size, latency_ms=None, process_fn=None):
+        super().__init__(pycromanager_acq, 1, process_fn)
+        if batch_size < 1:
+            raise ValueError("image_process_batch_size must be at least 1")
+        self._batch_size = batch_size
+        self._latency_s = latency_ms / 1000 if latency_ms else 0
+
+    def _process(self):
+        batch = []
+        deadline = None
+        while True:
             try:
-                self._pycromanager_acq._check_for_exceptions()
-            except Exception as e:
-                # unclear if this is functioning properly, check later
-                self._acq.abort()
-            if process_fn_result is not None:
-                # turn it into the expected tagged_image
-                # TODO: change this on later unification of acq engines
-                tagged_image.pix, tagged_image.tags = process_fn_result
+                if not batch:
+                    tagged_image = self.input_queue.get()
+                else:
+                    remaining_s = deadline - time.perf_counter()
+                    if remaining_s > 0:
+                        tagged_image = self.input_queue.get(timeout=remaining_s)
+                    else:
+                        tagged_image = self.input_queue.get(block=False)
+            except queue.Empty:
+                self._process_batch(batch)
+                batch = []
+                continue
+            if tagged_image.tags is None and tagged_image.pix is None:
+                self._process_batch(batch)
+                # this is a signal to stop
                 self.output_queue.put(tagged_image)
-            # otherwise the image processor intercepted the image and nothing to do here
+                break
+            if batch and (tagged_image.pix.shape != batch[0].pix.shape or
+                          tagged_image.pix.dtype != batch[0].pix.dtype):
+                self._process_batch(batch)
+                batch = []
+            if not batch:
+                deadline = time.perf_counter() + self._latency_s
+            batch.append(tagged_image)
+            if len(batch) >= self._batch_size:
+                self._process_batch(batch)
+                batch = []
+
+    def _process_batch(self, batch):
+        if not batch:
+            return
+        start = self._start_busy()
+        stack = np.stack([tagged_image.pix for tagged_image in batch])
+        metadata = [tagged_image.tags for tagged_image in batch]
+        for tagged_image in batch:
+            self._acq.release_frame(tagged_image.pix)
+        process_fn_result = self._pycromanager_acq._call_image_process_fn(stack, metadata, self._process_fn)
+        self._check_for_exceptions()
+        self._end_busy(start)
+        if process_fn_result is None:
+            return
+        processed_stack, processed_metadata = process_fn_result
+        if len(processed_stack) != len(processed_metadata):
+            self._pycromanager_acq.abort(Exception(
+                "Batch image processing function returned {} images and {} metadata dicts".format(
+                    len(processed_stack), len(processed_metadata))))
+            return
+        for pix, tags in zip(processed_stack, processed_metadata):
+            self._output(type(batch[0])(tags, pix))
+
+
+class ParallelImageProcessor(ImageProcessor):
+    """
+    Runs the process function on several worker threads at once, for processing that takes longer than the
+    time between images. Results are put in the output queue in the order the images arrived, so the data
+    sink and image_saved_fn see them in acquisition order. At most reorder_window images are taken from
+    the input queue before the oldest of them has been output, so a slow image holds up the others for at
+    most that many images
+    """
+
+    def __init__(self, pycromanager_acq, num_workers, reorder_window=None, process_fn=None):
+        super().__init__(pycromanager_acq, num_workers, process_fn)
+        self._reorder_window = reorder_window if reorder_window else 2 * num_workers
+        if self._reorder_window < num_workers:
+            raise ValueError("image_process_reorder_window must be at least the number of workers")
+        self._condition = threading.Condition()
+        self._output_lock = threading.Lock()
+        # sequence number -> processed image (None if dropped) waiting for the images before it
+        self._results = {}
+        self._next_in = 0
+        self._next_out = 0
+
+    def _process(self):
+        work_queue = queue.Queue()
+        workers = [threading.Thread(target=self._work, args=(work_queue,), name='Image processor {}'.format(i))
+                   for i in range(self._num_workers)]
+        for worker in workers:
+            worker.start()
+        while True:
+            tagged_image = self.input_queue.get()
+            if tagged_image.tags is None and tagged_image.pix is None:
+                break
+            with self._condition:
+                while self._next_in - self._next_out >= self._reorder_window:
+                    self._condition.wait()
+                sequence_number = self._next_in
+                self._next_in += 1
+            work_queue.put((sequence_number, tagged_image))
+        for _ in workers:
+            work_queue.put(None)
+        for worker in workers:
+            worker.join()
+        # this is a signal to stop
+        self.output_queue.put(tagged_image)
+
+    def _work(self, work_queue):
+        while True:
+            item = work_queue.get()
+            if item is None:
+                return
+            sequence_number, tagged_image = item
+            result = self._process_image(tagged_image)
+            with self._condition:
+                self._results[sequence_number] = result
+            # Output the images that are now in order. Only one thread outputs at a time, so they stay in order
+            with self._output_lock:
+                while True:
+                    with self._condition:
+                        if self._next_out not in self._results:
+                            break
+                        result = self._results.pop(self._next_out)
+                    self._output(result)
+                    with self._condition:
+                        self._next_out += 1
+                        self._condition.notify_all()
+
+
+class ProcessImageProcessor(ParallelImageProcessor):
+    """
+    Runs the process function in worker processes, so that processing that holds the GIL doesn't slow down
+    the acquisition engine and saving threads. Each worker process is driven by a thread of the parallel
+    processor, and has a block of shared memory that frames are copied into, so that only the metadata is
+    pickled. The processed frame is written back into the same block and copied out of it, into the original
+    frame if it has the same shape and type. Processed frames that don't fit in the block are pickled instead.
+    A worker process that exits unexpectedly aborts the acquisition
+    """
+
+    def __init__(self, pycromanager_acq, num_workers, reorder_window=None, process_fn=None):
+        super().__init__(pycromanager_acq, num_workers, reorder_window, process_fn)
+        self._local = threading.local()
+
+    def _work(self, work_queue):
+        # Forking this process, which has many threads, could copy a lock that another thread is holding
+        context = multiprocessing.get_context(
+            'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
+        connection, child_connection = context.Pipe()
+        process = context.Process(target=_run_image_process_worker,
+                                  args=(child_connection, self._process_fn),
+                                  name='Image processor', daemon=True)
+        process.start()
+        child_connection.close()
+        self._local.connection = connection
+        self._local.process = process
+        self._local.slot = None
+        self._local.exited = False
+        try:
+            # wait for the process to start, so that its start up isn't counted as processing time
+            connection.recv()
+        except (EOFError, OSError):
+            self._report_exit()
+        try:
+            super()._work(work_queue)
+        finally:
+            if process.is_alive():
+                try:
+                    connection.send(None)
+                except (OSError, ValueError):
+                    pass
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+            connection.close()
+            if self._local.slot is not None:
+                self._local.slot.close()
+                self._local.slot.unlink()
+
+    def _call_process_fn(self, tagged_image):
+        if self._local.exited:
+            # already reported, drop the rest of the images
+            return None
+        pix = np.ascontiguousarray(tagged_image.pix)
+        slot = self._get_slot(pix.nbytes)
+        np.ndarray(pix.shape, pix.dtype, buffer=slot.buf)[...] = pix
+        try:
+            self._local.connection.send((slot.name, slot.size, pix.shape, pix.dtype.str, tagged_image.tags))
+            result = self._local.connection.recv()
+        except (EOFError, OSError):
+            self._report_exit()
+            return None
+        if result is None:
+            return None
+        kind, value, metadata = result
+        if kind == 'error':
+            self._pycromanager_acq.abort(Exception("exception in image processor: {}".format(value)))
+            return None
+        if kind == 'array':
+            return value, metadata
+        shape, dtype = value
+        processed = np.ndarray(shape, np.dtype(dtype), buffer=slot.buf)
+        if shape == tagged_image.pix.shape and processed.dtype == tagged_image.pix.dtype \
+                and tagged_image.pix.flags.writeable:
+            tagged_image.pix[...] = processed
+            return tagged_image.pix, metadata
+        return processed.copy(), metadata
+
+    def _report_exit(self):
+        self._local.exited = True
+        self._local.process.join(5)
+        self._pycromanager_acq.abort(Exception("image processor process exited unexpectedly (exit code {})".format(
+            self._local.process.exitcode)))
+
+    def _get_slot(self, nbytes):
+        """
+        The shared memory block of this worker thread, replaced by a larger one if the frame doesn't fit
+        """
+        slot = self._local.slot
+        if slot is None or slot.size < nbytes:
+            if slot is not None:
+                slot.close()
+                slot.unlink()
+            slot = shared_memory.SharedMemory(create=True, size=max(nbytes, 1))
+            self._local.slot = slot
+        return slot
+
+
+def _run_image_process_worker(connection, process_fn):
+    """
+    Main function of an image processor worker process. Receives (shared memory name, size, shape, dtype,
+    metadata) for each frame, and replies with None if the frame was dropped, ('slot', (shape, dtype),
+    metadata) if the processed frame was written back to shared memory, ('array', frame, metadata) if it
+    didn't fit, or ('error', message, None)
+    """
+    slot = None
+    try:
+        connection.send(None)
+        while True:
+            # drop the views of the last frame, so that its block can be closed
+            image = processed = result = None
+            message = connection.recv()
+            if message is None:
+                break
+            name, size, shape, dtype, metadata = message
+            if slot is None or slot.name != name:
+                if slot is not None:
+                    slot.close()
+                slot = shared_memory.SharedMemory(name=name)
+            image = np.ndarray(shape, np.dtype(dtype), buffer=slot.buf)
+            try:
+                result = process_fn(image, metadata)
+            except Exception as e:
+                connection.send(('error', '{}: {}'.format(type(e).__name__, e), None))
+                continue
+            if result is None:
+                connection.send(None)
+                continue
+            processed, metadata = result
+            processed = np.asarray(processed)
+            if processed.nbytes <= size:
+                # The parent reads the block as a C-contiguous array, so the frame only stays where it is if it
+                # already has that layout, e.g. when it was changed in place
+                in_place = processed is image or (processed.flags.c_contiguous and
+                                                  processed.ctypes.data == image.ctypes.data)
+                if not in_place:
+                    if np.may_share_memory(processed, image):
+                        # e.g. a crop, whose pixels would be overwritten while they are copied into the block
+                        processed = processed.copy()
+                    np.ndarray(processed.shape, processed.dtype, buffer=slot.buf)[...] = processed
+                connection.send(('slot', (processed.shape, processed.dtype.str), metadata))
+            else:
+                connection.send(('array', processed, metadata))
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        if slot is not None:
+            slot.close()
 
 class AcquisitionHook:
     """
-    Lightweight wrapper to convert function pointers to AcqEng hooks
+    Lightweight wrapper to convert function pointers to AcqEng hooks. If event_views is True, the function is
+    given an AcquisitionEventView (or a list of them for a hardware sequence) rather than the event's JSON.
+
+    If run_async is True, the function runs on the acquisition's async hook threads, and the engine carries
+    on until the barrier. A function that returns a Future or an awaitable (e.g. a coroutine function) is
+    waited for at the barrier in the same way. The events returned by functions that run asynchronously are
+    ignored.
+
+    If untracked_hardware is True, the function changes devices that don't report their changes to the core,
+    so the engine forgets the state it last put the hardware in once the function has finished
     """
 
-    def __init__(self, hook_fn):
+    def __init__(self, hook_fn, event_views=False, run_async=False, barrier=None, untracked_hardware=False):
         self._hook_fn = hook_fn
+        self._event_views = event_views
+        self._run_async = run_async
+        self._barrier = barrier
+        self._untracked_hardware = untracked_hardware
+
+    def get_barrier(self):
+        return self._barrier
+
+    def changes_untracked_hardware(self):
+        return self._untracked_hardware
 
     def run(self, event):
         if AcquisitionEvent.is_acquisition_finished_event(event):
             return event
         acq = event.acquisition_
+        if self._event_views:
+            hook_input = AcquisitionEventView(event) if event.get_sequence() is None else \
+                [AcquisitionEventView(e) for e in event.get_sequence()]
+        else:
+            hook_input = event.to_json()
+        if self._run_async:
+            return acq.submit_async_hook(lambda: _await_if_needed(self._hook_fn(hook_input)))
         try:
-            output = self._hook_fn(event.to_json())
+            output = self._hook_fn(hook_input)
         except Exception as e:
             acq.abort()
             traceback.print_exc()
             return # cancel event and let the shutdown process handle the exception
+        if isinstance(output, Future):
+            return output
+        if isawaitable(output):
+            return acq.submit_async_hook(lambda: _await_if_needed(output))
         if output is not None:
-            return AcquisitionEvent.from_json(output, acq)
+            return _event_from_hook_output(output, event)
 
     def close(self):
         pass # nothing to do here
 
+
+def _await_if_needed(output):
+    """
+    Run an awaitable returned by a hook to completion, on the calling thread
+    """
+    if isawaitable(output):
+        async def await_output():
+            return await output
+        return asyncio.run(await_output())
+    if isinstance(output, Future):
+        return output.result()
+    return output
+
+
+def _event_from_hook_output(output, event):
+    """
+    Convert what a hook returned (JSON, an AcquisitionEventView or a list of either for a sequence) back into
+    an event, reusing the original event when the hook returned its views unchanged
+    """
+    if isinstance(output, AcquisitionEventView):
+        return output.get_event()
+    if not isinstance(output, list) or not any(isinstance(e, AcquisitionEventView) for e in output):
+        return AcquisitionEvent.from_json(output, event.acquisition_)
+    events = [e.get_event() if isinstance(e, AcquisitionEventView) else
+              AcquisitionEvent.event_from_json(e, event.acquisition_) for e in output]
+    sequence = event.get_sequence()
+    if sequence is not None and len(events) == len(sequence) and all(a is b for a, b in zip(events, sequence)):
+        return event
+    return AcquisitionEvent(event.acquisition_, sequence=events)
+
+
+class BatchAcquisitionHook(AcquisitionHook):
+    """
+    Wrapper for event generation hook functions that take a list of events and return a list of events,
+    so that the function is called once for up to batch_size events rather than for every event
+    """
+
+    def __init__(self, hook_fn, batch_size):
+        super().__init__(hook_fn)
+        self._batch_size = batch_size
+
+    def get_batch_size(self):
+        return self._batch_size
+
+    def run(self, event):
+        if AcquisitionEvent.is_acquisition_finished_event(event):
+            return event
+        output = self.run_batch([event])
+        if output:
+            return output[0]
+
+    def run_batch(self, events):
+        acq = events[0].acquisition_
+        output = self.run_batch_json([event.to_json() for event in events], acq)
+        if output is not None:
+            return [AcquisitionEvent.from_json(event, acq) for event in output]
+
+    def run_batch_json(self, events, acq):
+        try:
+            output = self._hook_fn(events)
+        except Exception as e:
+            acq.abort()
+            traceback.print_exc()
+            return # cancel events and let the shutdown process handle the exception
+        if output is not None:
+            return list(output)
+
+class BatchEventViewAcquisitionHook(AcquisitionHook):
+    """
+    Wrapper for event generation hook functions that take a list of up to batch_size AcquisitionEventViews
+    and return a list of events (views or JSON)
+    """
+
+    def __init__(self, hook_fn, batch_size):
+        super().__init__(hook_fn, event_views=True)
+        self._batch_size = batch_size
+
+    def get_batch_size(self):
+        return self._batch_size
+
+    def run(self, event):
+        if AcquisitionEvent.is_acquisition_finished_event(event):
+            return event
+        output = self.run_batch([event])
+        if output:
+            return output[0]
+
+    def run_batch(self, events):
+        acq = events[0].acquisition_
+        try:
+            output = self._hook_fn([AcquisitionEventView(event) for event in events])
+        except Exception as e:
+            acq.abort()
+            traceback.print_exc()
+            return # cancel events and let the shutdown process handle the exception
+        if output is not None:
+            return [_event_from_hook_output(e, events[0]) for e in output]
+
 class NotificationListener:
     """
     Lightweight wrapper to convert function pointers to AcqEng notification listeners
@@ -44,20 +44,36 @@ def start_headless(
         Default port to use for ZMQServer (Java backend only)
     debug : bool
         Print debug messages
+
+    Returns
+    -------
+    The core that was started when using the Python backend, otherwise None. Calling this again with the
+    Python backend starts another core with its own acquisition engine, which can be passed to Acquisition
+    with the core argument to control a second microscope from the same process (this needs a version of
+    mmpycorex whose create_core_instance returns the core)
     """
-    create_core_instance(
+    core = create_core_instance(
         mm_app_path=mm_app_path, config_file=config_file, java_loc=java_loc,
         python_backend=python_backend, core_log_path=core_log_path,
         buffer_size_mb=buffer_size_mb, max_memory_mb=max_memory_mb,
         port=port, debug=debug)
     if python_backend:
-        Engine(Core())
+        if core is None:
+            # Versions of mmpycorex whose create_core_instance doesn't return the core only give access to
+            # the first one
+            core = Core()
+            if any(engine.core is core for engine in Engine.get_instances()):
+                raise RuntimeError("Starting more than one core needs a version of mmpycorex that returns the "
+                                   "core from create_core_instance")
+        # Each core gets its own engine, so that separate microscopes can be run from one process
+        Engine.for_core(core)
+        return core
     else:
         # make sure any Java processes are cleaned up when Python exits
         atexit.register(stop_headless)
 
 def stop_headless(debug=False):
     terminate_core_instances(debug=debug)
-    if Engine.get_instance():
-        Engine.get_instance().shutdown()
+    for engine in Engine.get_instances():
+        engine.shutdown()
 
@@ -9,7 +9,7 @@ import glob
 
 from pycromanager import start_headless, stop_headless
 import socket
-from mmpycorex import download_and_install_mm, find_existing_mm_install
+from mmpycorex import download_and_install_mm, find_existing_mm_install, is_pymmcore_active
 
 def is_port_in_use(port):
     with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
@@ -174,3 +174,12 @@ def launch_mm_headless(request, install_mm):
                        debug=True)
         yield
         stop_headless(debug=True)
+
+
+@pytest.fixture
+def python_backend_only(launch_mm_headless):
+    """
+    Skip tests of features that are only available with the Python backend
+    """
+    if not is_pymmcore_active():
+        pytest.skip('Only available with the Python backend')
@@ -1,8 +1,10 @@
 import numpy as np
 import pytest
+import threading
 import time
 from pycromanager import Acquisition, Core, multi_d_acquisition_events
 from pycromanager.acquisition.acquisition_superclass import AcqAlreadyCompleteException
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine
 
 
 def check_acq_sequenced(events, expected_num_events):
@@ -47,6 +49,477 @@ def test_timelapse_seq_acq(launch_mm_headless, setup_data_folder):
         dataset.close()
 
 
+def test_zstack_hook_event_views_acq(python_backend_only, setup_data_folder):
+    """
+    Test hooks given views of the events rather than dicts, with one hook changing the events
+    """
+    events = multi_d_acquisition_events(num_time_points=2, z_start=0, z_end=4, z_step=1)
+    seen = []
+
+    def event_generation_hook_fn(event):
+        if event['axes']['z'] == 4:
+            event['axes']['z'] = 5
+            event['z'] = 5
+        return event
+
+    def hook_fn(_events):
+        seen.extend(event['axes']['z'] for event in (_events if isinstance(_events, list) else [_events]))
+        return _events
+
+    with Acquisition(setup_data_folder, 'test_zstack_hook_event_views_acq', show_display=False,
+                     event_generation_hook_fn=event_generation_hook_fn, pre_hardware_hook_fn=hook_fn,
+                     hook_event_views=True) as acq:
+        acq.acquire(events)
+
+    assert sorted(seen) == sorted([0, 1, 2, 3, 5] * 2)
+    dataset = acq.get_dataset()
+    try:
+        assert np.all([dataset.has_image(time=t, z=z) for t in range(2) for z in (0, 1, 2, 3, 5)])
+    finally:
+        dataset.close()
+
+
+def test_async_hook_acq(python_backend_only, setup_data_folder):
+    """
+    Test a hook that runs asynchronously, with the engine waiting for it before the camera starts
+    """
+    events = multi_d_acquisition_events(num_time_points=5, time_interval_s=0.1)
+    finished = []
+
+    def hook_fn(event):
+        time.sleep(0.05)
+        finished.append(event['axes']['time'])
+
+    with Acquisition(setup_data_folder, 'test_async_hook_acq', show_display=False,
+                     pre_hardware_hook_fn=hook_fn, async_hooks={'pre_hardware': 'camera'}) as acq:
+        acq.acquire(events)
+
+    assert sorted(finished) == list(range(5))
+    dataset = acq.get_dataset()
+    try:
+        assert np.all([dataset.has_image(time=t) for t in range(5)])
+    finally:
+        dataset.close()
+
+
+def test_invalid_async_hooks_acq(python_backend_only, setup_data_folder):
+    """
+    Test that an invalid async_hooks value raises without leaving any thread of the acquisition running
+    """
+    threads_before = set(threading.enumerate())
+    for async_hooks in ({'event_generation': None}, {'pre_hardware': 'nowhere'}):
+        with pytest.raises(ValueError):
+            Acquisition(setup_data_folder, 'test_invalid_async_hooks_acq', show_display=False,
+                        pre_hardware_hook_fn=lambda event: event, async_hooks=async_hooks)
+    assert set(threading.enumerate()) <= threads_before
+
+
+def test_timelapse_camera_timed_acq(python_backend_only, setup_data_folder):
+    """
+    Test that evenly spaced time points are acquired as one sequence timed by the camera
+    """
+    events = multi_d_acquisition_events(num_time_points=10, time_interval_s=0.01)
+
+    with Acquisition(setup_data_folder, 'test_timelapse_camera_timed_acq', show_display=False,
+                     camera_timed_intervals=True) as acq:
+        assert len(acq.plan_sequences(events)) == 1
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        for t in range(10):
+            metadata = dataset.read_metadata(time=t)
+            assert metadata['FrameTimePlanned-ms'] == pytest.approx(t * 10, abs=1)
+            assert 'FrameTime-ms' in metadata
+    finally:
+        dataset.close()
+
+
+def test_zstack_frame_pool_acq(python_backend_only, setup_data_folder):
+    """
+    Test that images pass through a frame pool smaller than the number of images, including images
+    dropped by an image processor
+    """
+    events = multi_d_acquisition_events(num_time_points=3, z_start=0, z_end=9, z_step=1)
+
+    def drop_z_3(image, metadata):
+        if metadata['Axes']['z'] == 3:
+            return None
+        return image, metadata
+
+    with Acquisition(setup_data_folder, 'test_zstack_frame_pool_acq', show_display=False,
+                     image_process_fn=drop_z_3, frame_pool_size=4) as acq:
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        assert len(dataset.get_image_coordinates_list()) == 27
+        assert not dataset.has_image(time=1, z=3)
+        assert dataset.read_image(time=2, z=9).shape == dataset.read_image(time=0, z=0).shape
+    finally:
+        dataset.close()
+
+
+def test_zstack_frame_pool_crop_acq(python_backend_only, setup_data_folder):
+    """
+    Test that images cropped by an image processor to a view of their pooled buffer are saved intact while
+    the pool keeps reusing buffers
+    """
+    events = multi_d_acquisition_events(num_time_points=3, z_start=0, z_end=9, z_step=1)
+
+    def crop(image, metadata):
+        # Rows of the image are contiguous, so this can be saved without a copy
+        cropped = image[:image.shape[0] // 2]
+        metadata['CroppedSum'] = int(cropped.sum())
+        return cropped, metadata
+
+    with Acquisition(setup_data_folder, 'test_zstack_frame_pool_crop_acq', show_display=False,
+                     image_process_fn=crop, frame_pool_size=2) as acq:
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        assert len(dataset.get_image_coordinates_list()) == 30
+        for axes in dataset.get_image_coordinates_list():
+            image = dataset.read_image(**axes)
+            assert int(image.sum()) == dataset.read_metadata(**axes)['CroppedSum']
+    finally:
+        dataset.close()
+
+
+def test_zstack_parallel_image_process_acq(python_backend_only, setup_data_folder):
+    """
+    Test that images processed on several threads are saved in the order they were acquired
+    """
+    events = multi_d_acquisition_events(z_start=0, z_end=19, z_step=1)
+    saved = []
+
+    def slow_for_even_z(image, metadata):
+        if metadata['Axes']['z'] % 2 == 0:
+            time.sleep(0.05)
+        return image, metadata
+
+    with Acquisition(setup_data_folder, 'test_zstack_parallel_image_process_acq', show_display=False,
+                     image_process_fn=slow_for_even_z, image_process_workers=4,
+                     image_saved_fn=lambda axes, dataset: saved.append(axes['z'])) as acq:
+        acq.acquire(events)
+
+    assert saved == list(range(20))
+    assert len(acq.get_image_processor_utilization()) == 4
+    acq.get_dataset().close()
+
+
+def test_zstack_image_process_graph_acq(python_backend_only, setup_data_folder):
+    """
+    Test a processor graph that sends the raw images to the dataset, a downsampled copy to a slow analysis
+    branch that drops images, and a projection to a second dataset
+    """
+    from ndstorage import NDRAMDataset
+
+    events = multi_d_acquisition_events(z_start=0, z_end=19, z_step=1)
+    projections = NDRAMDataset()
+
+    def downsample(image, metadata):
+        return image[::2, ::2], metadata
+
+    def slow_analysis(image, metadata):
+        time.sleep(0.05)
+
+    def project(image, metadata):
+        return image.astype(np.float32), metadata
+
+    graph = {'downsample': {'fn': downsample},
+             'analysis': {'fn': slow_analysis, 'inputs': ['downsample'], 'queue_size': 2, 'drop_when_full': True},
+             'projection': {'fn': project},
+             'projections': {'sink': projections, 'inputs': ['projection']}}
+    with Acquisition(setup_data_folder, 'test_zstack_image_process_graph_acq', show_display=False,
+                     image_process_graph=graph) as acq:
+        acq.acquire(events)
+
+    assert len(projections.get_image_coordinates_list()) == 20
+    assert projections.is_finished()
+    assert acq.get_dropped_image_counts()['projection'] == 0
+    dataset = acq.get_dataset()
+    try:
+        assert len(dataset.get_image_coordinates_list()) == 20
+        assert dataset.read_image(z=0).shape == projections.read_image(z=0).shape
+    finally:
+        dataset.close()
+
+
+def test_zstack_batch_image_process_acq(python_backend_only, setup_data_folder):
+    """
+    Test an image processing function called with stacks of images, which drops half of them
+    """
+    events = multi_d_acquisition_events(z_start=0, z_end=19, z_step=1)
+    batch_sizes = []
+
+    def keep_even_z(images, metadata):
+        assert images.ndim == 3 and len(images) == len(metadata)
+        batch_sizes.append(len(metadata))
+        keep = [i for i, md in enumerate(metadata) if md['Axes']['z'] % 2 == 0]
+        return images[keep], [metadata[i] for i in keep]
+
+    with Acquisition(setup_data_folder, 'test_zstack_batch_image_process_acq', show_display=False,
+                     image_process_fn=keep_even_z, image_process_batch_size=4,
+                     image_process_batch_latency_ms=100) as acq:
+        acq.acquire(events)
+
+    assert sum(batch_sizes) == 20 and max(batch_sizes) <= 4
+    dataset = acq.get_dataset()
+    try:
+        assert len(dataset.get_image_coordinates_list()) == 10
+        assert not dataset.has_image(z=1)
+    finally:
+        dataset.close()
+
+
+def test_timelapse_image_queue_memory_budget_acq(python_backend_only, setup_data_folder):
+    """
+    Test image queues bounded by a memory budget shared with the image processing function
+    """
+    events = multi_d_acquisition_events(num_time_points=20)
+
+    def slow_process(image, metadata):
+        time.sleep(0.01)
+        return image, metadata
+
+    with Acquisition(setup_data_folder, 'test_timelapse_image_queue_memory_budget_acq', show_display=False,
+                     image_process_fn=slow_process, image_queue_memory_mb=1) as acq:
+        acq.acquire(events)
+
+    metrics = acq.get_image_queue_metrics()
+    assert metrics['depth'] == 0 and metrics['bytes_in_flight'] == 0
+    assert 'camera' in metrics['queues']
+    dataset = acq.get_dataset()
+    try:
+        assert len(dataset.get_image_coordinates_list()) == 20
+    finally:
+        dataset.close()
+
+
+def invert_and_tag(image, metadata):
+    # Run in a separate process, so it is defined at the top level to be pickled
+    metadata['Inverted'] = True
+    return np.iinfo(image.dtype).max - image, metadata
+
+
+def test_zstack_process_image_process_acq(python_backend_only, setup_data_folder):
+    """
+    Test processing images in separate processes, with frames passed through shared memory
+    """
+    events = multi_d_acquisition_events(z_start=0, z_end=9, z_step=1)
+
+    with Acquisition(setup_data_folder, 'test_zstack_process_image_process_acq', show_display=False,
+                     image_process_fn=invert_and_tag, image_process_workers=2,
+                     image_process_backend='process') as acq:
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        assert len(dataset.get_image_coordinates_list()) == 10
+        for z in range(10):
+            assert dataset.read_metadata(z=z)['Inverted']
+    finally:
+        dataset.close()
+
+
+def test_unpicklable_process_image_process_acq(python_backend_only, setup_data_folder):
+    """
+    Test that a process function that can't be sent to the worker processes raises straight away, without
+    leaving any thread of the acquisition running
+    """
+    def local_fn(image, metadata):
+        return image, metadata
+
+    threads_before = set(threading.enumerate())
+    for image_process_fn in (lambda image, metadata: (image, metadata), local_fn):
+        with pytest.raises(ValueError, match='picklable'):
+            Acquisition(setup_data_folder, 'test_unpicklable_process_image_process_acq', show_display=False,
+                        image_process_fn=image_process_fn, image_process_backend='process')
+    assert set(threading.enumerate()) <= threads_before
+
+
+def crop_and_tag(image, metadata):
+    # Returns a view of the frame that isn't C-contiguous, which the worker process must copy out
+    cropped = image[:, :image.shape[1] // 2]
+    metadata['CroppedSum'] = int(cropped.sum(dtype=np.int64))
+    metadata['CroppedFirstColumn'] = cropped[:, 0].tolist()
+    return cropped, metadata
+
+
+def test_zstack_process_image_process_crop_acq(python_backend_only, setup_data_folder):
+    """
+    Test processing images in separate processes with a function that returns a crop of the frame
+    """
+    events = multi_d_acquisition_events(z_start=0, z_end=4, z_step=1)
+
+    with Acquisition(setup_data_folder, 'test_zstack_process_image_process_crop_acq', show_display=False,
+                     image_process_fn=crop_and_tag, image_process_backend='process') as acq:
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        for z in range(5):
+            image = dataset.read_image(z=z)
+            metadata = dataset.read_metadata(z=z)
+            assert int(image.sum(dtype=np.int64)) == metadata['CroppedSum']
+            assert image[:, 0].tolist() == metadata['CroppedFirstColumn']
+    finally:
+        dataset.close()
+
+
+def test_timelapse_explicit_core_acq(python_backend_only, setup_data_folder):
+    """
+    Test acquiring with a core passed explicitly, which uses the acquisition engine of that core
+    """
+    events = multi_d_acquisition_events(num_time_points=10)
+
+    with Acquisition(setup_data_folder, 'test_timelapse_explicit_core_acq', show_display=False,
+                     core=Core()) as acq:
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        assert np.all([dataset.has_image(time=t) for t in range(10)])
+    finally:
+        dataset.close()
+
+
+def test_engine_per_core(python_backend_only):
+    """
+    Test that each core is driven by its own acquisition engine, and that a core always gets the same one
+    """
+    core = Core()
+    # A second core of the same type as the one made by start_headless, without any devices loaded
+    other_core = type(core)()
+    engine = Engine.for_core(core)
+    other_engine = Engine.for_core(other_core)
+    try:
+        assert other_engine is not engine
+        assert other_engine.core is other_core
+        assert Engine.for_core(core) is engine
+        assert Engine.for_core(other_core) is other_engine
+        # The engine of the first core stays the default
+        assert Engine.get_instance() is engine
+        with pytest.raises(RuntimeError):
+            Engine(other_core)
+    finally:
+        other_engine.shutdown()
+    assert other_engine not in Engine.get_instances()
+    assert Engine.for_core(core) is engine
+
+
+def test_unchanged_hardware_skipped_acq(python_backend_only, setup_data_folder):
+    """
+    Test that a second acquisition at the same position and channel doesn't resend the hardware commands,
+    unless asked to
+    """
+    events = multi_d_acquisition_events(xy_positions=[[0, 0]], channel_group='Channel', channels=['DAPI'],
+                                        z_start=0, z_end=0, z_step=1)
+    skipped = []
+    for i, resend in enumerate([False, False, True]):
+        with Acquisition(setup_data_folder, 'test_unchanged_hardware_skipped_acq', show_display=False,
+                         resend_unchanged_hardware=resend) as acq:
+            acq.acquire(events)
+        skipped.append(acq.get_skipped_hardware_command_count())
+        dataset = acq.get_dataset()
+        try:
+            assert dataset.has_image(channel='DAPI', z=0, position=0)
+        finally:
+            dataset.close()
+
+    assert skipped[1] > skipped[0]
+    assert skipped[2] == skipped[1]
+
+
+def test_core_round_trips_saved_acq(python_backend_only, setup_data_folder):
+    """
+    Test that device roles and image size are requested from the core once rather than for every image
+    """
+    events = multi_d_acquisition_events(num_time_points=10)
+
+    with Acquisition(setup_data_folder, 'test_core_round_trips_saved_acq', show_display=False) as acq:
+        acq.acquire(events)
+
+    assert acq.get_core_round_trips_saved() >= 10
+    dataset = acq.get_dataset()
+    try:
+        assert np.all([dataset.has_image(time=t) for t in range(10)])
+    finally:
+        dataset.close()
+
+
+def test_concurrent_acqs_on_one_core(python_backend_only, setup_data_folder):
+    """
+    Test that a z-stack acquired while a time-lapse on the same core waits for its next time point runs
+    straight away, rather than after the time-lapse
+    """
+    timelapse_events = multi_d_acquisition_events(num_time_points=2, time_interval_s=60)
+    z_stack_events = multi_d_acquisition_events(z_start=0, z_end=4, z_step=1)
+    # (acquisition name, axes) of each event, in the order the engine runs them
+    acquired = []
+    first_time_point_acquired = threading.Event()
+
+    def make_hook(acq_name):
+        def hook_fn(_events):
+            for event in (_events if isinstance(_events, list) else [_events]):
+                acquired.append((acq_name, event['axes']))
+            if acq_name == 'timelapse':
+                first_time_point_acquired.set()
+            return _events
+        return hook_fn
+
+    timelapse_acq = Acquisition(setup_data_folder, 'test_concurrent_acqs_timelapse', show_display=False,
+                                pre_hardware_hook_fn=make_hook('timelapse'))
+    timelapse_acq.acquire(timelapse_events)
+    timelapse_acq.mark_finished()
+    assert first_time_point_acquired.wait(60)
+    with Acquisition(setup_data_folder, 'test_concurrent_acqs_z_stack', show_display=False, priority=1,
+                     pre_hardware_hook_fn=make_hook('z_stack')) as z_stack_acq:
+        z_stack_acq.acquire(z_stack_events)
+    # The second time point of the time-lapse is a minute away, so it can't be run before the z-stack
+    assert acquired == [('timelapse', {'time': 0})] + [('z_stack', {'z': z}) for z in range(5)]
+    timelapse_acq.abort()
+    timelapse_acq.await_completion()
+
+    z_stack_dataset = z_stack_acq.get_dataset()
+    try:
+        assert np.all([z_stack_dataset.has_image(z=z) for z in range(5)])
+    finally:
+        z_stack_dataset.close()
+    timelapse_dataset = timelapse_acq.get_dataset()
+    try:
+        assert timelapse_dataset.has_image(time=0) and not timelapse_dataset.has_image(time=1)
+    finally:
+        timelapse_dataset.close()
+
+
+def test_priority_events_from_image_processor_acq(python_backend_only, setup_data_folder):
+    """
+    Test that events an image processor submits with priority are acquired before the remaining bulk events
+    """
+    acquired_axes = []
+
+    def zoom_in(image, metadata, event_queue):
+        acquired_axes.append(metadata['Axes'])
+        if metadata['Axes'].get('time') == 1:
+            event_queue.put_priority([{'axes': {'zoom': 0, 'z': z}, 'z': z} for z in range(3)])
+        return image, metadata
+
+    acq = Acquisition(setup_data_folder, 'test_priority_events_acq', show_display=False, image_process_fn=zoom_in)
+    acq.acquire(multi_d_acquisition_events(num_time_points=50, time_interval_s=0.05))
+    while len(acquired_axes) < 53:
+        time.sleep(0.05)
+    acq.mark_finished()
+    acq.await_completion()
+
+    first_zoom_index = next(i for i, axes in enumerate(acquired_axes) if 'zoom' in axes)
+    assert first_zoom_index < 10
+    assert len(acq.get_priority_latencies_ms()) >= 1
+    acq.get_dataset().close()
+
+
 def test_empty_list_acq(launch_mm_headless, setup_data_folder):
     events = []
 
@@ -639,7 +1112,49 @@ def test_multiple_labeled_positions_acq(launch_mm_headless, setup_data_folder):
             assert metadata['YPosition_um_Intended'] == xy[1]
     finally:
         dataset.close()
-    
+
+def test_multiple_positions_pipelined_acq(python_backend_only, setup_data_folder):
+    """
+    Test acquiring images over multiple XY positions and channels with the hardware for the next
+    event being prepared while the current image is read out
+    """
+    xy_positions = ((0, 0), (0, 1), (1, 0))
+    channels = ['DAPI', 'FITC']
+
+    events = multi_d_acquisition_events(xy_positions=xy_positions, channel_group='Channel', channels=channels)
+
+    with Acquisition(setup_data_folder, 'test_multiple_positions_pipelined_acq', show_display=False,
+                     pipeline_hardware=True) as acq:
+        acq.acquire(events)
+
+    dataset = acq.get_dataset()
+    try:
+        for pos_idx, xy in enumerate(xy_positions):
+            for channel in channels:
+                metadata = dataset.read_metadata(position=pos_idx, channel=channel)
+                assert metadata['XPosition_um_Intended'] == xy[0]
+                assert metadata['YPosition_um_Intended'] == xy[1]
+    finally:
+        dataset.close()
+
+def test_plan_sequences(python_backend_only, setup_data_folder):
+    """
+    Test that a dry run of sequence planning accounts for every event, in order
+    """
+    events = multi_d_acquisition_events(num_time_points=2, z_start=0, z_end=9, z_step=1)
+
+    with Acquisition(setup_data_folder, 'test_plan_sequences', show_display=False) as acq:
+        plan = acq.plan_sequences(events)
+        acq.acquire(events)
+
+    first_event_index = 0
+    for sequence in plan:
+        assert sequence['first_event_index'] == first_event_index
+        first_event_index += sequence['num_events']
+    assert first_event_index == len(events)
+    assert plan[-1]['break_reason'] is None
+    acq.get_dataset().close()
+
 def test_multi_channel_parsing(launch_mm_headless, setup_data_folder):
     """
     Test that datasets NDTiff datasets that are built up in real time parse channel names correctly
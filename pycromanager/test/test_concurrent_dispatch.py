@@ -0,0 +1,109 @@
+"""
+Test that concurrent hardware dispatch issues commands in waves that respect the dependencies between devices,
+and waits for every device of a wave before the next one starts
+"""
+import pytest
+
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine, HardwareControlException
+
+
+class StubCore:
+    """
+    Stands in for the core, logging the devices that are waited for
+    """
+
+    def __init__(self, log):
+        self.log = log
+        self.callback = None
+
+    def register_callback(self, callback):
+        self.callback = callback
+
+    def device_busy(self, device_name):
+        return False
+
+    def wait_for_device(self, device_name):
+        self.log.append(('wait', device_name))
+
+    def log_message(self, message):
+        pass
+
+
+class StubAcquisition:
+    """
+    Stands in for an acquisition in concurrent dispatch mode
+    """
+
+    def __init__(self, device_dependencies):
+        self.device_dependencies = device_dependencies
+        self.settle_time_saved_ms = []
+
+    def get_device_dependencies(self, device_name):
+        return self.device_dependencies.get(device_name, [])
+
+    def add_settle_time_saved_ms(self, saved_ms):
+        self.settle_time_saved_ms.append(saved_ms)
+
+    def is_debug_mode(self):
+        return False
+
+
+class StubEvent:
+    def __init__(self, acq):
+        self.acquisition_ = acq
+
+
+@pytest.fixture
+def log():
+    return []
+
+
+@pytest.fixture
+def engine(log):
+    engine = Engine(StubCore(log))
+    yield engine
+    engine.shutdown()
+
+
+def queue_commands(log, device_names):
+    return [(lambda d=device_name: log.append(('set', d)), [device_name]) for device_name in device_names]
+
+
+def test_independent_devices_are_issued_before_waiting(engine, log):
+    acq = StubAcquisition({})
+    engine.dispatch_concurrently(StubEvent(acq), queue_commands(log, ['XY', 'Z', 'Wheel']))
+
+    assert log[:3] == [('set', 'XY'), ('set', 'Z'), ('set', 'Wheel')]
+    assert sorted(log[3:]) == [('wait', 'Wheel'), ('wait', 'XY'), ('wait', 'Z')]
+    assert len(acq.settle_time_saved_ms) == 1
+
+
+def test_dependent_devices_wait_for_their_prerequisites(engine, log):
+    # The objective must have settled before the Z drive moves, and the Z drive before the light source
+    acq = StubAcquisition({'Z': ['Objective'], 'LED': ['Z']})
+    engine.dispatch_concurrently(StubEvent(acq), queue_commands(log, ['LED', 'Z', 'XY', 'Objective']))
+
+    waves = []
+    for action, device_name in log:
+        if action == 'set' and (not waves or waves[-1][-1][0] == 'wait'):
+            waves.append([])
+        waves[-1].append((action, device_name))
+    assert waves == [[('set', 'XY'), ('set', 'Objective'), ('wait', 'XY'), ('wait', 'Objective')],
+                     [('set', 'Z'), ('wait', 'Z')],
+                     [('set', 'LED'), ('wait', 'LED')]]
+
+
+def test_dependency_on_device_not_commanded_is_ignored(engine, log):
+    acq = StubAcquisition({'Z': ['Objective']})
+    engine.dispatch_concurrently(StubEvent(acq), queue_commands(log, ['Z', 'XY']))
+
+    assert log[:2] == [('set', 'Z'), ('set', 'XY')]
+
+
+def test_circular_dependency_raises(engine, log):
+    acq = StubAcquisition({'Z': ['Objective'], 'Objective': ['Z']})
+    with pytest.raises(HardwareControlException, match='Circular dependency'):
+        engine.dispatch_concurrently(StubEvent(acq), queue_commands(log, ['XY', 'Z', 'Objective']))
+
+    # Devices outside the cycle are still commanded and waited for before the cycle is found
+    assert log == [('set', 'XY'), ('wait', 'XY')]
@@ -0,0 +1,96 @@
+"""
+Test that device capabilities are requested from the core once, and again after the core reports a change to
+its configuration
+"""
+import collections
+
+from pycromanager.acquisition.acq_eng_py.internal.device_capabilities import DeviceCapabilities
+
+
+class Setting:
+    def __init__(self, device_name, prop_name, value):
+        self.device_name, self.prop_name, self.value = device_name, prop_name, value
+
+    def getDeviceLabel(self):
+        return self.device_name
+
+    def getPropertyName(self):
+        return self.prop_name
+
+    def getPropertyValue(self):
+        return self.value
+
+
+class Configuration:
+    def __init__(self, settings):
+        self.settings = settings
+
+    def size(self):
+        return len(self.settings)
+
+    def getSetting(self, index):
+        return self.settings[index]
+
+
+class CountingCore:
+    """
+    Stands in for the core, counting the calls made to it
+    """
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.presets = {('Channel', 'DAPI'): [Setting('Wheel', 'Label', 'A'), Setting('LED', 'State', '1')]}
+
+    def is_stage_sequenceable(self, stage_device):
+        self.calls['is_stage_sequenceable', stage_device] += 1
+        return stage_device == 'Z'
+
+    def get_stage_sequence_max_length(self, stage_device):
+        self.calls['get_stage_sequence_max_length', stage_device] += 1
+        return 50
+
+    def get_config_data(self, group, preset):
+        self.calls['get_config_data', group, preset] += 1
+        return Configuration(self.presets[(group, preset)])
+
+
+def test_capabilities_are_cached_for_each_device():
+    core = CountingCore()
+    capabilities = DeviceCapabilities(core)
+    for _ in range(3):
+        assert capabilities.is_stage_sequenceable('Z')
+        assert not capabilities.is_stage_sequenceable('Z2')
+        assert capabilities.get_stage_sequence_max_length('Z') == 50
+    assert core.calls == {('is_stage_sequenceable', 'Z'): 1, ('is_stage_sequenceable', 'Z2'): 1,
+                          ('get_stage_sequence_max_length', 'Z'): 1}
+
+
+def test_config_settings_are_keyed_by_device_and_property():
+    core = CountingCore()
+    capabilities = DeviceCapabilities(core)
+    assert capabilities.get_config_settings('Channel', 'DAPI') == {('Wheel', 'Label'): 'A', ('LED', 'State'): '1'}
+    capabilities.get_config_settings('Channel', 'DAPI')
+    assert core.calls['get_config_data', 'Channel', 'DAPI'] == 1
+
+
+def check_invalidated_by(callback_name):
+    core = CountingCore()
+    capabilities = DeviceCapabilities(core)
+    capabilities.is_stage_sequenceable('Z')
+    capabilities.get_config_settings('Channel', 'DAPI')
+    core.presets[('Channel', 'DAPI')] = [Setting('Wheel', 'Label', 'B')]
+
+    getattr(capabilities, callback_name)()
+
+    assert capabilities.get_config_settings('Channel', 'DAPI') == {('Wheel', 'Label'): 'B'}
+    capabilities.is_stage_sequenceable('Z')
+    assert core.calls['is_stage_sequenceable', 'Z'] == 2
+    assert core.calls['get_config_data', 'Channel', 'DAPI'] == 2
+
+
+def test_system_configuration_loaded_invalidates():
+    check_invalidated_by('onSystemConfigurationLoaded')
+
+
+def test_properties_changed_invalidates():
+    check_invalidated_by('onPropertiesChanged')
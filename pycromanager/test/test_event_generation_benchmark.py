@@ -0,0 +1,80 @@
+"""
+Micro-benchmark of the rate at which the Python backend takes events through event generation hooks, with
+0, 1 and 3 hooks called once per event and called with batches of events (which are chained without
+converting the events between hooks). Run with -s to see the rates
+"""
+import time
+
+from pycromanager import multi_d_acquisition_events
+from pycromanager.acquisition.acq_eng_py.internal.acquisition_scheduler import run_event_generation_hooks
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+from pycromanager.acquisition.python_backend_acquisitions import AcquisitionHook, BatchAcquisitionHook
+
+NUM_EVENTS = 20000
+BATCH_SIZE = 256
+
+
+def shift_z(event):
+    event['z'] = event['z'] + 1
+    return event
+
+
+def shift_z_batch(events):
+    return [shift_z(event) for event in events]
+
+
+def make_events():
+    events = multi_d_acquisition_events(num_time_points=NUM_EVENTS // 20, z_start=0, z_end=19, z_step=1)
+    return [AcquisitionEvent.from_json(event, None) for event in events]
+
+
+def generate(hooks, events, batch_size):
+    output = []
+    for i in range(0, len(events), batch_size):
+        batch, cancelled = run_event_generation_hooks(hooks, events[i:i + batch_size])
+        assert not cancelled
+        output.extend(batch)
+    return output
+
+
+def events_per_second(hooks, batch_size, repeats=3):
+    best_elapsed = None
+    for _ in range(repeats):
+        events = make_events()
+        start = time.perf_counter()
+        output = generate(hooks, events, batch_size)
+        elapsed = time.perf_counter() - start
+        best_elapsed = elapsed if best_elapsed is None else min(best_elapsed, elapsed)
+    return NUM_EVENTS / best_elapsed, output
+
+
+def test_event_generation_hook_benchmark():
+    print()
+    for num_hooks in (0, 1, 3):
+        per_event_rate, per_event_output = events_per_second(
+            [AcquisitionHook(shift_z) for _ in range(num_hooks)], 1)
+        batch_rate, batch_output = events_per_second(
+            [BatchAcquisitionHook(shift_z_batch, BATCH_SIZE) for _ in range(num_hooks)], BATCH_SIZE)
+        print('{} hooks: {:.0f} events/s called per event, {:.0f} events/s called with batches'.format(
+            num_hooks, per_event_rate, batch_rate))
+
+        assert len(per_event_output) == len(batch_output) == NUM_EVENTS
+        for per_event, batch in zip(per_event_output, batch_output):
+            assert per_event.to_json() == batch.to_json()
+            assert per_event.get_z_position() == batch.get_z_position()
+        assert batch_output[0].get_z_position() == num_hooks
+
+
+def test_event_generation_hook_cancel():
+    events = make_events()[:10]
+
+    def cancel_after_five(event):
+        return None if event['z'] == 5 else event
+
+    output, cancelled = run_event_generation_hooks([AcquisitionHook(cancel_after_five)], events)
+    assert cancelled
+    assert [event.get_z_position() for event in output] == [0, 1, 2, 3, 4]
+
+    output, cancelled = run_event_generation_hooks([BatchAcquisitionHook(lambda events: None, BATCH_SIZE)],
+                                                   events)
+    assert cancelled and output == []
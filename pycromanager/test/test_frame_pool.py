@@ -0,0 +1,131 @@
+"""
+Test that buffers of the frame pool are only reused once nothing refers to them any more, including images
+that an image processor replaced with a view of their buffer
+"""
+import queue
+
+import numpy as np
+
+from pycromanager.acquisition.acq_eng_py.internal.frame_pool import FramePool
+from pycromanager.acquisition.python_backend_acquisitions import ImageProcessor
+
+
+class TaggedImage:
+    def __init__(self, tags, pix):
+        self.tags = tags
+        self.pix = pix
+
+
+class StubAcquisition:
+    """
+    Stands in for both the pycromanager acquisition and the acquisition engine's acquisition of an image
+    processor
+    """
+
+    def __init__(self, frame_pool, process_fn):
+        self.frame_pool = frame_pool
+        self._process_fn = process_fn
+
+    def _call_image_process_fn(self, image, metadata, process_fn):
+        return process_fn(image, metadata)
+
+    def _check_for_exceptions(self):
+        pass
+
+    def get_frame_pool(self):
+        return self.frame_pool
+
+    def release_frame(self, pix):
+        self.frame_pool.release(pix)
+
+
+def process(frame_pool, process_fn, images):
+    """
+    Pass images through an ImageProcessor and return what comes out of it
+    """
+    acq = StubAcquisition(frame_pool, process_fn)
+    processor = ImageProcessor(acq)
+    input_queue, output_queue = queue.Queue(), queue.Queue()
+    for pix in images:
+        input_queue.put(TaggedImage({}, frame_pool.lease(pix)))
+    input_queue.put(TaggedImage(None, None))
+    processor.set_acq_and_queues(acq, input_queue, output_queue)
+    processor._process_thread.join()
+    outputs = []
+    while True:
+        tagged_image = output_queue.get()
+        if tagged_image.pix is None:
+            return outputs
+        outputs.append(tagged_image)
+
+
+def test_buffer_is_reused_once_released():
+    pool = FramePool(2)
+    first = pool.lease(np.ones((4, 4), dtype=np.uint16))
+    pool.release(first)
+    second = pool.lease(np.full((4, 4), 7, dtype=np.uint16))
+
+    assert second is first
+    assert pool.get_counters()['allocations'] == 1
+    assert pool.get_counters()['in_use'] == 1
+
+
+def test_retained_buffer_needs_each_view_released():
+    pool = FramePool(1)
+    buffer = pool.lease(np.ones((4, 4), dtype=np.uint16))
+    pool.retain(buffer, 1)
+    views = [buffer[:2], buffer[2:]]
+
+    assert pool.release(views[0])
+    assert pool.get_counters()['in_use'] == 1
+    assert pool.release(views[1])
+    assert pool.get_counters()['in_use'] == 0
+
+
+def test_cropping_processor_keeps_buffer_in_use():
+    pool = FramePool(4)
+    frames = [np.arange(16, dtype=np.uint16).reshape(4, 4) + 100 * i for i in range(2)]
+
+    outputs = process(pool, lambda image, metadata: (image[::2, ::2], metadata), frames)
+
+    # The crops hold on to the buffers they are views of
+    assert pool.get_counters()['in_use'] == 2
+    crops = [output.pix.copy() for output in outputs]
+    # Buffers reused now would overwrite the crops
+    others = [pool.lease(np.full((4, 4), 7, dtype=np.uint16)) for _ in range(2)]
+    for output, crop, frame in zip(outputs, crops, frames):
+        assert np.array_equal(output.pix, frame[::2, ::2])
+        assert np.array_equal(output.pix, crop)
+
+    # Releasing a crop only frees its own buffer
+    pool.release(outputs[0].pix)
+    assert pool.get_counters()['in_use'] == 3
+    pool.release(outputs[1].pix)
+    for other in others:
+        assert pool.is_leased(other)
+        pool.release(other)
+    assert pool.get_counters()['in_use'] == 0
+
+
+def test_replacing_processor_releases_buffer():
+    pool = FramePool(2)
+    frames = [np.ones((4, 4), dtype=np.uint16) for _ in range(2)]
+
+    outputs = process(pool, lambda image, metadata: (image * 2, metadata), frames)
+
+    assert pool.get_counters()['in_use'] == 0
+    assert all(np.array_equal(output.pix, np.full((4, 4), 2)) for output in outputs)
+
+
+def test_processor_view_of_buffer_that_pool_cannot_find_is_copied():
+    pool = FramePool(1)
+    frame = np.arange(16, dtype=np.uint16).reshape(4, 4)
+
+    # A view made without numpy's indexing has no base the pool knows about
+    outputs = process(pool, lambda image, metadata: (
+        np.lib.stride_tricks.as_strided(image, (2, 2), (image.strides[0] * 2, image.strides[1] * 2)), metadata),
+                      [frame])
+
+    assert pool.get_counters()['in_use'] == 0
+    pool.lease(np.zeros((4, 4), dtype=np.uint16))
+    assert np.array_equal(outputs[0].pix, frame[::2, ::2])
@@ -0,0 +1,123 @@
+"""
+Test that the engine only forgets the state it last put the hardware in after hooks that declare they change
+devices which don't report their changes to the core
+"""
+from concurrent.futures import Future
+
+import pytest
+
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine
+from pycromanager.acquisition.python_backend_acquisitions import AcquisitionHook
+
+
+class StubCore:
+    def register_callback(self, callback):
+        pass
+
+
+class StubHook:
+    """
+    Stands in for a hook, returning the event or a future that is still running
+    """
+
+    def __init__(self, untracked_hardware=False, future=None, barrier=None):
+        self.untracked_hardware = untracked_hardware
+        self.future = future
+        self.barrier = barrier
+
+    def run(self, event):
+        return event if self.future is None else self.future
+
+    def get_barrier(self):
+        return self.barrier
+
+    def changes_untracked_hardware(self):
+        return self.untracked_hardware
+
+
+class StubAcquisition:
+    def __init__(self):
+        self.pending_hook_futures = []
+
+    def add_pending_hook_future(self, future):
+        self.pending_hook_futures.append(future)
+
+
+class StubEvent:
+    def __init__(self):
+        self.acquisition_ = StubAcquisition()
+
+
+STAGE = ('stage', 'Z')
+
+
+@pytest.fixture
+def engine():
+    engine = Engine(StubCore())
+    engine.hardware_state.set(STAGE, 5.0)
+    yield engine
+    engine.shutdown()
+
+
+def is_remembered(engine):
+    return engine.hardware_state.is_current(STAGE, 5.0)
+
+
+def test_hook_keeps_hardware_state(engine):
+    engine.run_hook(StubHook(), StubEvent())
+    assert is_remembered(engine)
+
+
+def test_hook_without_declaration_keeps_hardware_state(engine):
+    class PlainHook:
+        def run(self, event):
+            return event
+    engine.run_hook(PlainHook(), StubEvent())
+    assert is_remembered(engine)
+
+
+def test_untracked_hardware_hook_forgets_hardware_state(engine):
+    engine.run_hook(StubHook(untracked_hardware=True), StubEvent())
+    assert not is_remembered(engine)
+
+
+@pytest.mark.parametrize('untracked_hardware', [False, True])
+def test_async_hook_forgets_hardware_state_at_barrier(engine, untracked_hardware):
+    future = Future()
+    engine.run_hook(StubHook(untracked_hardware, future, 'z_drive'), StubEvent())
+    # Nothing is forgotten while the hook is still running, or at an earlier barrier
+    engine.await_hook_barrier('hardware')
+    assert is_remembered(engine)
+
+    future.set_result(None)
+    engine.await_hook_barrier('z_drive')
+    assert is_remembered(engine) != untracked_hardware
+
+
+def test_async_hook_until_acquisition_end_forgets_hardware_state(engine):
+    future = Future()
+    event = StubEvent()
+    engine.run_hook(StubHook(True, future, 'acquisition_end'), event)
+    assert event.acquisition_.pending_hook_futures == [future]
+    assert is_remembered(engine)
+
+    future.set_result(None)
+    assert not is_remembered(engine)
+
+
+def test_discarded_hooks_forget_hardware_state_if_untracked(engine):
+    engine.run_hook(StubHook(False, Future(), 'camera'), StubEvent())
+    engine.pending_hook_futures[0][1].set_result(None)
+    engine.discard_hook_futures()
+    assert is_remembered(engine)
+
+    failed = Future()
+    failed.set_exception(RuntimeError('Hook failed'))
+    engine.run_hook(StubHook(True, failed, 'camera'), StubEvent())
+    engine.discard_hook_futures()
+    assert not is_remembered(engine)
+
+
+def test_acquisition_hook_declares_untracked_hardware():
+    assert not AcquisitionHook(lambda event: event).changes_untracked_hardware()
+    assert AcquisitionHook(lambda event: event, untracked_hardware=True).changes_untracked_hardware()
@@ -0,0 +1,127 @@
+"""
+Test that image metadata added from a template made once per sequence is the same as when the values that are
+fixed for the sequence are read from the core for every image, and micro-benchmark the per-image cost of both.
+Run with -s to see the timings
+"""
+import time
+
+from pycromanager import multi_d_acquisition_events
+from pycromanager.acquisition.acq_eng_py.main.acq_eng_metadata import AcqEngMetadata
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+
+NUM_IMAGES = 200
+
+
+class CountingCore:
+    """
+    Stands in for the core, counting the calls made to it
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def get_pixel_size_um(self):
+        self.calls += 1
+        return 0.5
+
+    def get_focus_device(self):
+        self.calls += 1
+        return 'Z'
+
+
+class RoundTripCore(CountingCore):
+    """
+    Stands in for a core whose calls each take a round trip, e.g. to a bridged core
+    """
+
+    ROUND_TRIP_S = 20e-6
+
+    def get_pixel_size_um(self):
+        self._round_trip()
+        return super().get_pixel_size_um()
+
+    def get_focus_device(self):
+        self._round_trip()
+        return super().get_focus_device()
+
+    def _round_trip(self):
+        end = time.perf_counter() + self.ROUND_TRIP_S
+        while time.perf_counter() < end:
+            pass
+
+
+def make_events():
+    events = multi_d_acquisition_events(num_time_points=NUM_IMAGES // 20, z_start=0, z_end=19, z_step=1,
+                                        xy_positions=[(10, 20)])
+    for event in events:
+        event['tags'] = {'sample': 'A1', 'condition': 3}
+    return [AcquisitionEvent.from_json(event, None) for event in events]
+
+
+def test_image_metadata_template():
+    events = make_events()
+
+    core = CountingCore()
+    untemplated_tags = [{} for _ in events]
+    for tags, event in zip(untemplated_tags, events):
+        AcqEngMetadata.add_image_metadata(core, tags, event, 0, 10)
+    assert core.calls == 2 * NUM_IMAGES
+
+    core = CountingCore()
+    templated_tags = [{} for _ in events]
+    template = AcqEngMetadata.make_sequence_metadata_template(core)
+    for tags, event in zip(templated_tags, events):
+        AcqEngMetadata.add_image_metadata(core, tags, event, 0, 10, template)
+    assert core.calls == 2
+
+    for untemplated, templated in zip(untemplated_tags, templated_tags):
+        untemplated.pop(AcqEngMetadata.TIME)
+        templated.pop(AcqEngMetadata.TIME)
+        assert templated == untemplated
+
+
+def test_tags_to_json_copies_are_independent():
+    tags = {'sample': 'A1', 'condition': 3}
+    first = AcqEngMetadata.tags_to_json(tags)
+    second = AcqEngMetadata.tags_to_json(dict(tags))
+    assert first == second == tags
+    first['sample'] = 'B2'
+    assert AcqEngMetadata.tags_to_json(tags)['sample'] == 'A1'
+    assert second['sample'] == 'A1'
+    # Equal values of different types are converted separately
+    assert AcqEngMetadata.tags_to_json({'flag': True})['flag'] is True
+    assert AcqEngMetadata.tags_to_json({'flag': 1})['flag'] is not True
+
+
+def time_per_image_us(fn, events, repeats=3):
+    best_elapsed = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best_elapsed = elapsed if best_elapsed is None else min(best_elapsed, elapsed)
+    return best_elapsed / len(events) * 1e6
+
+
+def test_image_metadata_template_benchmark():
+    events = make_events()
+    core = RoundTripCore()
+
+    def add_reading_core_per_image():
+        for event in events:
+            tags = {}
+            AcqEngMetadata.add_image_metadata(core, tags, event, 0, 10)
+            tags[AcqEngMetadata.TAGS] = AcqEngMetadata.tags_to_json(event.get_tags())
+
+    def add_from_template():
+        template = AcqEngMetadata.make_sequence_metadata_template(core)
+        for event in events:
+            tags = {}
+            AcqEngMetadata.add_image_metadata(core, tags, event, 0, 10, template)
+            tags[AcqEngMetadata.TAGS] = AcqEngMetadata.tags_to_json(event.get_tags())
+
+    per_image_us = time_per_image_us(add_reading_core_per_image, events)
+    template_us = time_per_image_us(add_from_template, events)
+    print('\nMetadata per image with a {:.0f} us core round trip: {:.1f} us reading the core for each image, '
+          '{:.1f} us with a template made once per sequence'.format(RoundTripCore.ROUND_TRIP_S * 1e6, per_image_us,
+                                                                   template_us))
@@ -0,0 +1,111 @@
+"""
+Test how long the engine waits before polling the core for images again, with a fake clock
+"""
+import pytest
+
+from pycromanager.acquisition.acq_eng_py.internal import image_waiter
+from pycromanager.acquisition.acq_eng_py.internal.image_waiter import ImageWaiter
+
+
+class FakeClock:
+    """
+    Stands in for time.perf_counter and time.sleep, recording the sleeps instead of sleeping
+    """
+
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(image_waiter.time, 'perf_counter', clock.perf_counter)
+    monkeypatch.setattr(image_waiter.time, 'sleep', clock.sleep)
+    return clock
+
+
+def test_wait_doubles_up_to_maximum(clock):
+    waiter = ImageWaiter()
+    waiter.start_sequence()
+    for _ in range(10):
+        waiter.wait()
+
+    expected = [min(ImageWaiter.MIN_WAIT_S * 2 ** i, ImageWaiter.MAX_WAIT_S) for i in range(10)]
+    assert clock.sleeps == pytest.approx(expected)
+    assert clock.sleeps[-1] == ImageWaiter.MAX_WAIT_S
+
+
+def test_first_wait_is_fraction_of_expected_interval(clock):
+    waiter = ImageWaiter()
+    waiter.start_sequence(expected_interval_ms=8)
+    waiter.wait()
+    waiter.wait()
+
+    assert clock.sleeps == pytest.approx([0.002, 0.004])
+
+
+def test_image_arrival_resets_wait_from_measured_interval(clock):
+    waiter = ImageWaiter()
+    # The camera turns out to be faster than expected
+    waiter.start_sequence(expected_interval_ms=16)
+    waiter.image_arrived()
+    clock.now += 0.002
+    waiter.image_arrived()
+    waiter.wait()
+
+    # The measured interval is smoothed with the expected one
+    assert clock.sleeps == pytest.approx([(0.8 * 0.016 + 0.2 * 0.002) * ImageWaiter.FIRST_WAIT_FRACTION])
+
+    for _ in range(50):
+        clock.now += 0.002
+        waiter.image_arrived()
+    clock.sleeps.clear()
+    waiter.wait()
+    waiter.wait()
+
+    assert clock.sleeps == pytest.approx([0.002 * ImageWaiter.FIRST_WAIT_FRACTION,
+                                          0.004 * ImageWaiter.FIRST_WAIT_FRACTION], rel=0.01)
+
+
+def test_wait_is_reset_when_sequence_starts(clock):
+    waiter = ImageWaiter()
+    waiter.start_sequence()
+    for _ in range(5):
+        waiter.wait()
+    waiter.start_sequence()
+    clock.sleeps.clear()
+    waiter.wait()
+
+    assert clock.sleeps == [ImageWaiter.MIN_WAIT_S]
+
+
+def test_busy_poll_does_not_sleep(clock):
+    waiter = ImageWaiter(busy_poll=True)
+    waiter.start_sequence(expected_interval_ms=10)
+    for _ in range(5):
+        waiter.wait()
+
+    assert clock.sleeps == []
+    assert waiter.get_counters()['polls'] == 5
+
+
+def test_counters(clock):
+    waiter = ImageWaiter()
+    waiter.start_sequence()
+    for _ in range(3):
+        waiter.wait()
+    waiter.image_arrived()
+
+    counters = waiter.get_counters()
+    assert counters['polls'] == 3
+    assert counters['wait_wall_time_s'] == pytest.approx(sum(clock.sleeps))
+    waiter.reset_counters()
+    assert waiter.get_counters() == {'polls': 0, 'wait_cpu_time_s': 0.0, 'wait_wall_time_s': 0.0}
@@ -0,0 +1,82 @@
+"""
+Test that a hardware sequence is only uploaded again when the device doesn't already hold it
+"""
+import pytest
+
+from pycromanager.acquisition.acq_eng_py.internal.loaded_sequences import LoadedSequences
+
+
+class Uploads:
+    """
+    Records the sequences that are uploaded
+    """
+
+    def __init__(self):
+        self.uploaded = []
+
+    def load_fn(self, values):
+        return lambda: self.uploaded.append(list(values))
+
+
+def test_same_sequence_is_uploaded_once():
+    loaded_sequences = LoadedSequences()
+    uploads = Uploads()
+    z_stack = [0.0, 1.0, 2.0]
+    for _ in range(3):
+        loaded_sequences.load(('stage', 'Z'), z_stack, uploads.load_fn(z_stack))
+
+    assert uploads.uploaded == [z_stack]
+    assert loaded_sequences.get_counts() == {'hits': 2, 'misses': 1}
+
+
+def test_changed_sequence_is_uploaded():
+    loaded_sequences = LoadedSequences()
+    uploads = Uploads()
+    loaded_sequences.load(('stage', 'Z'), [0.0, 1.0], uploads.load_fn([0.0, 1.0]))
+    loaded_sequences.load(('stage', 'Z'), [0.0, 2.0], uploads.load_fn([0.0, 2.0]))
+    # Each device holds its own sequence
+    loaded_sequences.load(('stage', 'Z2'), [0.0, 2.0], uploads.load_fn([0.0, 2.0]))
+    loaded_sequences.load(('stage', 'Z'), [0.0, 2.0], uploads.load_fn([0.0, 2.0]))
+
+    assert uploads.uploaded == [[0.0, 1.0], [0.0, 2.0], [0.0, 2.0]]
+    assert loaded_sequences.get_counts() == {'hits': 1, 'misses': 3}
+
+
+def test_sequence_given_as_iterator():
+    loaded_sequences = LoadedSequences()
+    uploads = Uploads()
+    for _ in range(2):
+        loaded_sequences.load(('xy', 'XY'), zip([0.0, 1.0], [5.0, 6.0]), uploads.load_fn([0.0, 1.0]))
+
+    assert loaded_sequences.get_counts() == {'hits': 1, 'misses': 1}
+
+
+def test_failed_upload_forgets_sequence():
+    loaded_sequences = LoadedSequences()
+    uploads = Uploads()
+    loaded_sequences.load(('stage', 'Z'), [0.0, 1.0], uploads.load_fn([0.0, 1.0]))
+
+    def fail():
+        raise RuntimeError('Device error')
+    with pytest.raises(RuntimeError):
+        loaded_sequences.load(('stage', 'Z'), [0.0, 2.0], fail)
+    assert loaded_sequences.get_counts() == {'hits': 0, 'misses': 1}
+
+    # The device may hold part of either sequence, so both are uploaded again
+    loaded_sequences.load(('stage', 'Z'), [0.0, 1.0], uploads.load_fn([0.0, 1.0]))
+    assert uploads.uploaded == [[0.0, 1.0], [0.0, 1.0]]
+    assert loaded_sequences.get_counts() == {'hits': 0, 'misses': 2}
+
+
+@pytest.mark.parametrize('invalidate', [lambda s: s.invalidate(), lambda s: s.invalidate(('stage', 'Z')),
+                                        lambda s: s.onSystemConfigurationLoaded(),
+                                        lambda s: s.onPropertiesChanged()])
+def test_invalidated_sequence_is_uploaded_again(invalidate):
+    loaded_sequences = LoadedSequences()
+    uploads = Uploads()
+    loaded_sequences.load(('stage', 'Z'), [0.0, 1.0], uploads.load_fn([0.0, 1.0]))
+    invalidate(loaded_sequences)
+    loaded_sequences.load(('stage', 'Z'), [0.0, 1.0], uploads.load_fn([0.0, 1.0]))
+
+    assert uploads.uploaded == [[0.0, 1.0], [0.0, 1.0]]
+    assert loaded_sequences.get_counts() == {'hits': 0, 'misses': 2}
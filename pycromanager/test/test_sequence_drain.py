@@ -0,0 +1,199 @@
+"""
+Test that the images of a single-camera sequence are taken out of the circular buffer in batches, with a fake
+core whose images become ready a few at a time
+"""
+import time
+
+import numpy as np
+import pytest
+
+from pycromanager import multi_d_acquisition_events
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine, HardwareControlException
+from pycromanager.acquisition.acq_eng_py.internal.hardware_sequences import HardwareSequences
+from pycromanager.acquisition.acq_eng_py.main.acq_eng_metadata import AcqEngMetadata
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+
+
+class TaggedImage:
+    def __init__(self, tags, pix):
+        self.tags = tags
+        self.pix = pix
+
+
+class SequenceCore:
+    """
+    Stands in for the core running a sequence. Each time the number of images in the circular buffer is
+    requested, the next number in releases is added to it
+    """
+
+    def __init__(self, releases):
+        self.releases = list(releases)
+        self.ready = 0
+        self.num_popped = 0
+        self.running = True
+        self.calls = {'get_pixel_size_um': 0, 'stop_sequence_acquisition': 0}
+
+    def register_callback(self, callback):
+        pass
+
+    def is_buffer_overflowed(self):
+        return False
+
+    def is_sequence_running(self):
+        return self.running
+
+    def get_remaining_image_count(self):
+        # Once releases runs out, the camera waits for a trigger that never comes
+        if self.releases:
+            self.ready += self.releases.pop(0)
+        return self.ready
+
+    def pop_next_tagged_image(self):
+        if not self.ready:
+            raise IndexError('Circular buffer is empty')
+        self.ready -= 1
+        self.num_popped += 1
+        return TaggedImage({AcqEngMetadata.ELAPSED_TIME_MS: str(self.num_popped)},
+                           np.full((4, 4), self.num_popped, dtype=np.uint16))
+
+    def stop_sequence_acquisition(self):
+        self.calls['stop_sequence_acquisition'] += 1
+        self.running = False
+
+    def clear_circular_buffer(self):
+        self.ready = 0
+
+    def get_exposure(self):
+        return 10.0
+
+    def get_pixel_size_um(self):
+        self.calls['get_pixel_size_um'] += 1
+        return 0.5
+
+    def get_focus_device(self):
+        return 'Z'
+
+    def get_camera_device(self):
+        return 'Camera'
+
+    def get_number_of_camera_channels(self):
+        return 1
+
+
+class StubAcquisition:
+    """
+    Stands in for an acquisition, recording the batches of images it is given
+    """
+
+    def __init__(self, after_exposure_hooks=()):
+        self.batches = []
+        self.abort_exception = None
+        self.after_exposure_hooks = list(after_exposure_hooks)
+
+    def is_camera_timed_intervals(self):
+        return False
+
+    def is_abort_requested(self):
+        return self.abort_exception is not None
+
+    def abort(self, e=None):
+        self.abort_exception = e
+
+    def get_start_time_ms(self):
+        return 0
+
+    def get_after_exposure_hooks(self):
+        return self.after_exposure_hooks
+
+    def add_tags_to_tagged_image(self, tags, more_tags):
+        tags['tags'] = more_tags
+
+    def add_to_image_metadata(self, tags):
+        pass
+
+    def add_to_output(self, batch):
+        self.batches.append(batch)
+
+
+def make_sequence_event(acq, timeout_ms=None):
+    events = []
+    for event in multi_d_acquisition_events(z_start=0, z_end=9, z_step=1):
+        if timeout_ms is not None:
+            event['timeout_ms'] = timeout_ms
+        events.append(AcquisitionEvent.from_json(event, acq))
+    return AcquisitionEvent(acq, events)
+
+
+def drain(engine, event):
+    return engine.drain_sequence_images(event, HardwareSequences(), 0, time.time(), 0)
+
+
+@pytest.fixture
+def engine_for():
+    engines = []
+
+    def create(core):
+        engines.append(Engine(core))
+        return engines[-1]
+    yield create
+    for engine in engines:
+        engine.shutdown()
+
+
+def test_sequence_is_batch_drainable(engine_for):
+    engine = engine_for(SequenceCore([]))
+    assert engine.is_batch_drainable(make_sequence_event(StubAcquisition()))
+    # Hooks have to run between the images
+    assert not engine.is_batch_drainable(make_sequence_event(StubAcquisition(after_exposure_hooks=[None])))
+
+
+def test_images_are_drained_in_batches(engine_for):
+    core = SequenceCore([0, 3, 0, 0, 4, 3])
+    engine = engine_for(core)
+    acq = StubAcquisition()
+
+    assert not drain(engine, make_sequence_event(acq))
+
+    assert [len(batch) for batch in acq.batches] == [3, 4, 3]
+    images = [image for batch in acq.batches for image in batch]
+    assert [image.pix[0, 0] for image in images] == list(range(1, 11))
+    assert [image.tags[AcqEngMetadata.AXES] for image in images] == [{'z': z} for z in range(10)]
+    assert [image.tags[AcqEngMetadata.ELAPSED_TIME_MS] for image in images] == [0] * 10
+    # Metadata that is the same for the whole sequence is only read from the core once
+    assert core.calls['get_pixel_size_um'] == 1
+
+
+def test_batch_is_limited_to_images_of_sequence(engine_for):
+    core = SequenceCore([12])
+    engine = engine_for(core)
+    acq = StubAcquisition()
+
+    assert not drain(engine, make_sequence_event(acq))
+
+    assert [len(batch) for batch in acq.batches] == [10]
+    assert core.ready == 2
+
+
+def test_sequence_timeout(engine_for):
+    core = SequenceCore([4])
+    engine = engine_for(core)
+    acq = StubAcquisition()
+
+    assert drain(engine, make_sequence_event(acq, timeout_ms=20))
+
+    assert [len(batch) for batch in acq.batches] == [4]
+    assert core.calls['stop_sequence_acquisition'] == 1
+    assert acq.abort_exception is None
+
+
+def test_images_that_never_arrive(engine_for):
+    core = SequenceCore([4])
+    core.running = False
+    engine = engine_for(core)
+    acq = StubAcquisition()
+
+    with pytest.raises(HardwareControlException, match='did not arrive'):
+        drain(engine, make_sequence_event(acq))
+
+    assert [len(batch) for batch in acq.batches] == [4]
+    assert isinstance(acq.abort_exception, HardwareControlException)
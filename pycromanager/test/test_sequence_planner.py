@@ -0,0 +1,251 @@
+"""
+Test how the sequence planner splits events into hardware sequences, and how the engine builds the property
+sequences of config group presets, with made up device capabilities
+"""
+import pytest
+
+from pycromanager import multi_d_acquisition_events
+from pycromanager.acquisition.acq_eng_py.internal.engine import Engine, HardwareControlException
+from pycromanager.acquisition.acq_eng_py.internal.sequence_planner import SequencePlanner
+from pycromanager.acquisition.acq_eng_py.main.acquisition_event import AcquisitionEvent
+
+
+class FakeCapabilities:
+    """
+    Stands in for DeviceCapabilities. Devices missing from max_lengths are not sequenceable
+    """
+
+    def __init__(self, max_lengths=None, presets=None):
+        self.max_lengths = max_lengths or {}
+        self.presets = presets or {}
+
+    def get_camera_device(self):
+        return 'Camera'
+
+    def get_focus_device(self):
+        return 'Z'
+
+    def get_xy_stage_device(self):
+        return 'XY'
+
+    def is_property_sequenceable(self, device_name, prop_name):
+        return (device_name, prop_name) in self.max_lengths
+
+    def get_property_sequence_max_length(self, device_name, prop_name):
+        return self.max_lengths.get((device_name, prop_name), 0)
+
+    def is_stage_sequenceable(self, stage_device):
+        return stage_device in self.max_lengths
+
+    def get_stage_sequence_max_length(self, stage_device):
+        return self.max_lengths.get(stage_device, 0)
+
+    def is_xy_stage_sequenceable(self, xy_stage_device):
+        return xy_stage_device in self.max_lengths
+
+    def get_xy_stage_sequence_max_length(self, xy_stage_device):
+        return self.max_lengths.get(xy_stage_device, 0)
+
+    def is_exposure_sequenceable(self, camera_device):
+        return camera_device in self.max_lengths
+
+    def get_exposure_sequence_max_length(self, camera_device):
+        return self.max_lengths.get(camera_device, 0)
+
+    def get_config_settings(self, group, preset):
+        return self.presets[(group, preset)]
+
+
+class StubAcquisition:
+    def __init__(self, camera_timed_intervals=False):
+        self.camera_timed_intervals = camera_timed_intervals
+
+    def is_camera_timed_intervals(self):
+        return self.camera_timed_intervals
+
+    def get_start_time_ms(self):
+        return 0
+
+
+class StubCore:
+    def register_callback(self, callback):
+        pass
+
+
+CHANNEL_PRESETS = {('Channel', 'DAPI'): {('Wheel', 'Label'): 'A', ('LED', 'State'): '1'},
+                   ('Channel', 'FITC'): {('Wheel', 'Label'): 'A', ('LED', 'State'): '2'},
+                   ('Channel', 'Cy5'): {('Wheel', 'Label'): 'B', ('LED', 'State'): '2'},
+                   # Leaves the LED as it is
+                   ('Channel', 'Brightfield'): {('Wheel', 'Label'): 'B'}}
+
+
+def make_events(acq=None, **kwargs):
+    acq = StubAcquisition() if acq is None else acq
+    return [AcquisitionEvent.from_json(event, acq) for event in multi_d_acquisition_events(**kwargs)]
+
+
+def test_z_stacks_merge_across_time_points():
+    planner = SequencePlanner(FakeCapabilities({'Z': 100}))
+    plan = planner.plan(make_events(num_time_points=3, z_start=0, z_end=4, z_step=1))
+
+    assert plan == [{'first_event_index': 0, 'num_events': 15, 'sequenced': ['z'], 'break_reason': None}]
+
+
+def test_z_stage_that_is_not_sequenceable():
+    planner = SequencePlanner(FakeCapabilities())
+    plan = planner.plan(make_events(z_start=0, z_end=2, z_step=1))
+
+    assert [sequence['num_events'] for sequence in plan] == [1, 1, 1]
+    assert plan[0]['break_reason'] == 'z stage Z is not sequenceable'
+
+
+def test_z_stage_maximum_sequence_length():
+    planner = SequencePlanner(FakeCapabilities({'Z': 4}))
+    plan = planner.plan(make_events(num_time_points=2, z_start=0, z_end=4, z_step=1))
+
+    assert [sequence['num_events'] for sequence in plan] == [4, 4, 2]
+    assert plan[0]['break_reason'] == 'z stage Z has a maximum sequence length of 4'
+
+
+def test_maximum_sequence_length_of_planner():
+    planner = SequencePlanner(FakeCapabilities({'Z': 100}), max_sequence_length=6)
+    plan = planner.plan(make_events(num_time_points=2, z_start=0, z_end=4, z_step=1))
+
+    assert [sequence['num_events'] for sequence in plan] == [6, 4]
+    assert plan[0]['break_reason'] == 'maximum sequence length of 6 events reached'
+
+
+def test_channels_with_sequenceable_property():
+    planner = SequencePlanner(FakeCapabilities({('LED', 'State'): 10}, CHANNEL_PRESETS))
+    plan = planner.plan(make_events(channel_group='Channel', channels=['DAPI', 'FITC']))
+
+    assert plan == [{'first_event_index': 0, 'num_events': 2, 'sequenced': ['config group Channel'],
+                     'break_reason': None}]
+
+
+def test_channel_change_that_cannot_be_sequenced():
+    # Only the LED changes between the presets, and it can't be sequenced
+    planner = SequencePlanner(FakeCapabilities({('Wheel', 'Label'): 10}, CHANNEL_PRESETS))
+    events = make_events(channel_group='Channel', channels=['DAPI', 'FITC'])
+
+    assert not planner.is_sequencable(events[:1], events[1])
+    plan = planner.plan(events)
+    assert [sequence['num_events'] for sequence in plan] == [1, 1]
+    assert plan[0]['break_reason'] == 'property LED-State is not sequenceable'
+
+
+def test_channel_property_maximum_sequence_length():
+    planner = SequencePlanner(FakeCapabilities({'Z': 100, ('LED', 'State'): 4}, CHANNEL_PRESETS))
+    events = make_events(z_start=0, z_end=2, z_step=1, channel_group='Channel', channels=['DAPI', 'FITC'],
+                         order='zc')
+
+    assert planner.is_sequencable(events[:3], events[3])
+    assert not planner.is_sequencable(events[:3], events[3], new_seq_length=5)
+    plan = planner.plan(events)
+    assert [sequence['num_events'] for sequence in plan] == [4, 2]
+    assert plan[0]['break_reason'] == 'property LED-State has a maximum sequence length of 4'
+
+
+def test_time_points_timed_by_camera():
+    planner = SequencePlanner(FakeCapabilities())
+    plan = planner.plan(make_events(StubAcquisition(camera_timed_intervals=True), num_time_points=5,
+                                    time_interval_s=1))
+
+    assert plan == [{'first_event_index': 0, 'num_events': 5, 'sequenced': ['camera interval'],
+                     'break_reason': None}]
+
+
+def test_time_points_not_timed_by_camera():
+    planner = SequencePlanner(FakeCapabilities())
+    plan = planner.plan(make_events(num_time_points=3, time_interval_s=1))
+
+    assert [sequence['num_events'] for sequence in plan] == [1, 1, 1]
+    assert plan[0]['break_reason'] == 'minimum start time changes'
+
+
+def test_unevenly_spaced_time_points():
+    acq = StubAcquisition(camera_timed_intervals=True)
+    events = make_events(acq, num_time_points=4, time_interval_s=1)
+    events[3].set_minimum_start_time(3500)
+    planner = SequencePlanner(FakeCapabilities())
+    plan = planner.plan(events)
+
+    assert [sequence['num_events'] for sequence in plan] == [3, 1]
+    assert plan[0]['break_reason'] == 'time points are not evenly spaced'
+
+
+def test_several_images_per_camera_timed_time_point():
+    acq = StubAcquisition(camera_timed_intervals=True)
+    events = make_events(acq, num_time_points=2, time_interval_s=1, z_start=0, z_end=1, z_step=1)
+    planner = SequencePlanner(FakeCapabilities({'Z': 100}))
+    plan = planner.plan(events)
+
+    # The z-stack of each time point is sequenced, but the camera can only time single images
+    assert [sequence['num_events'] for sequence in plan] == [2, 2]
+    assert plan[0]['sequenced'] == ['z']
+    assert plan[0]['break_reason'] == 'time points of a camera-timed sequence must each have one image'
+
+
+def test_hardware_change_between_camera_timed_time_points():
+    acq = StubAcquisition(camera_timed_intervals=True)
+    events = make_events(acq, num_time_points=3, time_interval_s=1)
+    for z, event in enumerate(events):
+        event.set_z(None, float(z))
+    planner = SequencePlanner(FakeCapabilities({'Z': 100}))
+    plan = planner.plan(events)
+
+    assert [sequence['num_events'] for sequence in plan] == [1, 1, 1]
+    assert plan[0]['break_reason'] == 'hardware changes between time points, so they cannot be timed by the camera'
+
+
+def test_plan_accounts_for_every_event_in_order():
+    planner = SequencePlanner(FakeCapabilities({'Z': 3}))
+    events = make_events(num_time_points=2, z_start=0, z_end=4, z_step=1)
+    plan = planner.plan(events)
+
+    first_event_index = 0
+    for sequence in plan:
+        assert sequence['first_event_index'] == first_event_index
+        first_event_index += sequence['num_events']
+    assert first_event_index == len(events)
+    assert all(sequence['break_reason'] is not None for sequence in plan[:-1])
+    assert plan[-1]['break_reason'] is None
+    # The dry run doesn't change the state of the planner
+    assert planner.get_pending_events() == []
+
+
+def test_presets_that_set_different_properties_are_not_merged():
+    planner = SequencePlanner(FakeCapabilities({('Wheel', 'Label'): 10, ('LED', 'State'): 10}, CHANNEL_PRESETS))
+    events = make_events(channel_group='Channel', channels=['DAPI', 'FITC', 'Brightfield'])
+
+    assert not planner.is_sequencable(events[:2], events[2])
+    plan = planner.plan(events)
+    assert [sequence['num_events'] for sequence in plan] == [2, 1]
+    assert plan[0]['break_reason'] == \
+        'preset Brightfield of config group Channel sets different properties than the presets before it'
+    assert plan[1]['break_reason'] is None
+
+
+@pytest.fixture
+def engine():
+    engine = Engine(StubCore())
+    engine.device_capabilities = FakeCapabilities(presets=CHANNEL_PRESETS)
+    yield engine
+    engine.shutdown()
+
+
+def test_property_sequences_include_properties_that_change_later(engine):
+    events = make_events(channel_group='Channel', channels=['DAPI', 'FITC', 'Cy5'])
+    # An event without a preset keeps the preset of the event before it
+    events.insert(2, make_events(z_start=0, z_end=0, z_step=1)[0])
+
+    prop_sequences = engine.build_property_sequences(AcquisitionEvent(events[0].acquisition_, events))
+
+    assert prop_sequences == {('Wheel', 'Label'): ['A', 'A', 'A', 'B'], ('LED', 'State'): ['1', '2', '2', '2']}
+
+
+def test_property_sequences_of_presets_that_set_different_properties(engine):
+    events = make_events(channel_group='Channel', channels=['Brightfield', 'DAPI'])
+
+    with pytest.raises(HardwareControlException):
+        engine.build_property_sequences(AcquisitionEvent(events[0].acquisition_, events))